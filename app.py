@@ -1,38 +1,100 @@
 import asyncio
 import hashlib
 import json
+import logging
+import multiprocessing
 import os
 import pathlib
 import random
+import signal
 import socket
+import time
 from asyncio import create_task
 
 import aiohttp
-import requests
 from aiohttp import ClientResponse, ClientSession, ClientTimeout, web
-from kubernetes import client, config
-from requests.sessions import Session
 
+from broadcast import relay_hops, subtrees
 from cookies import cookiesList
+from failure_detector import FailureDetectors
+from fortunes import FortuneFile
+from labels import LabelReconciler, PodPatcher
+from logs import setup_logging
 from frontend import frontpage_html
+from membership import EndpointSliceSource, Membership, PeerTable
+from mesh import MeshResponse, MeshUnavailable, PeerMesh
+from probes import ProbeSchedule, detection_bounds, probe_period
+from profiler import StallWatchdog, collapsed_text, sample_stacks
+from responses import EncodedAsset, StaticAssets
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, Registry
+from shared_state import SharedState
+from tracing import Tracer
 
-config.load_incluster_config()
 v1 = None
+log = logging.getLogger("bully")
 
 
 def init_kubernetes():
+    """
+    Import and configure the kubernetes client, blocking. The import alone takes
+    a few hundred ms, so it is not done at module import
+    """
     global v1
     if v1 is None:
+        from kubernetes import client, config
+
         config.load_incluster_config()
         v1 = client.CoreV1Api()
     return v1
 
 
+async def kubernetes_client():
+    """The CoreV1Api, initialized on a thread on first use with K8S_INIT=lazy"""
+    async with K8S_LOCK:
+        if v1 is None:
+            await asyncio.to_thread(init_kubernetes)
+    return v1
+
+
+def process_age():
+    """Seconds since this process was started, None where /proc is missing"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks after boot
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        boot_time = time.clock_gettime(time.CLOCK_BOOTTIME)
+        return boot_time - started / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def startup_phase(phase):
+    """Record when a startup phase was first reached, log them all at the last one"""
+    if phase in STARTUP:
+        return
+    age = process_age()
+    if age is None:
+        return
+    STARTUP[phase] = age
+    STARTUP_SECONDS.labels(phase).set(age)
+    if phase == "first_heartbeat":
+        log.info(
+            "Started: imported after %.3fs, listening after %.3fs,"
+            " first heartbeat after %.3fs",
+            STARTUP.get("import", float("nan")),
+            STARTUP.get("listen", float("nan")),
+            age,
+            extra={"startup": dict(STARTUP)},
+        )
+
+
 pod_name = os.environ["POD_NAME"]
 namespace = os.environ.get("NAMESPACE", "default")
 
 POD_IP = str(os.environ["POD_IP"])
 WEB_PORT = int(os.environ["WEB_PORT"])
+# Port for pod to pod traffic, the same as WEB_PORT unless set
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", WEB_PORT))
 hostname = socket.gethostname()
 POD_ID = int(hashlib.md5(hostname.encode()).hexdigest(), 16) % 10**6
 
@@ -42,12 +104,273 @@ IP_TO_ID = {}
 ELECTION_IN_PROCESS: bool = False
 IS_READY = True
 ELECTION_TYPE = os.getenv("ELECTION_TYPE")
+# Elections hosted by this pod, "<pod id>-<n>" identifies one in the logs, the
+# messages and the trace
+ELECTION_SEQ = 0
+ELECTION_ID = None
+# Election terms: the highest one seen, the one the current leader was elected
+# in and the one of the last election this pod ran. Every election starts a new
+# term and messages from older ones are rejected
+TERM = 0
+LEADER_TERM = 0
+ELECTION_TERM = 0
+# The election pending or running on this pod, further triggers merge into it
+ELECTION_TASK = None
+ELECTION_BACKOFF = float(os.getenv("ELECTION_BACKOFF", "0.2"))
+# ELECTION_TYPE=ring: (term, highest candidate passed on, when) and when this
+# pod's own last ring election started
+RING_SEEN = None
+RING_STARTED = None
+
+# Admission limits. User requests (/, /static/, /get_cookie) get 503 once
+# USER_MAX_INFLIGHT are in flight or the event loop lags more than USER_SHED_LAG,
+# so probes and election messages are still answered in time. Control-plane
+# requests have a cap of their own. With CONTROL_PORT != WEB_PORT each kind is
+# only served on its own port
+USER_MAX_INFLIGHT = int(os.getenv("USER_MAX_INFLIGHT", "256"))
+USER_SHED_LAG = float(os.getenv("USER_SHED_LAG", "0.1"))
+CONTROL_MAX_INFLIGHT = int(os.getenv("CONTROL_MAX_INFLIGHT", "1024"))
+INFLIGHT = {"user": 0, "control": 0}
+# Delay of the last loop lag sample, taken every LOOP_LAG_INTERVAL seconds (0 = off)
+LOOP_LAG = 0.0
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.05"))
+# Log the loop thread's stack when the loop has not ticked for this long (0 = off)
+STALL_LOG_AFTER = float(os.getenv("STALL_LOG_AFTER", "0.25"))
+# /debug/profile: longest profile allowed, and whether one is running
+PROFILE_MAX_SECONDS = 60
+PROFILING = False
+# User connections this process stopped reading from while the loop lags
+THROTTLED = set()
+
+# Pooled client used for all pod to pod traffic
+PEER_SESSION: ClientSession = None
+PEER_CONN_LIMIT_PER_HOST = int(os.getenv("PEER_CONN_LIMIT_PER_HOST", "4"))
+# Max peer connections in use at once over all peers, 0 means no limit
+PEER_CONN_LIMIT = int(os.getenv("PEER_CONN_LIMIT", "0"))
+PEER_KEEPALIVE = float(os.getenv("PEER_KEEPALIVE", "30"))
+PROBE_TIMEOUT = ClientTimeout(total=0.5)
+MESSAGE_TIMEOUT = ClientTimeout(total=2)
+# "ws" sends peer messages over one WebSocket per peer (mesh.py), falling back to
+# HTTP for pods without /mesh. "http" is a request per message
+PEER_TRANSPORT = os.getenv("PEER_TRANSPORT", "http")
+MESH_HEARTBEAT = float(os.getenv("MESH_HEARTBEAT", "5"))
+MESH: PeerMesh = None
+
+# Where the peer list comes from: "dns" polls the headless service every heartbeat,
+# "watch" follows its EndpointSlices through the Kubernetes API
+MEMBERSHIP_MODE = os.getenv("MEMBERSHIP_MODE", "dns")
+PEER_SERVICE = os.getenv("PEER_SERVICE", "bully-service")
+MEMBERSHIP = Membership()
+# Set once the watch delivered its first event, until then the heartbeat uses DNS
+MEMBERSHIP_SYNCED = False
+PEERS = PeerTable(ttl=float(os.getenv("PEER_ID_TTL", "300")))
+
+# Number of peers whose /cluster_view is fetched per round to learn new pods, 0 = off
+GOSSIP_FANOUT = int(os.getenv("GOSSIP_FANOUT", "0"))
+GOSSIP_PROBE_AFTER = int(os.getenv("GOSSIP_PROBE_AFTER", "3"))
+UNRESOLVED = {}
+
+# Leader failure detection: an election starts once the leader's phi reaches the
+# threshold (8 is roughly a 1e-8 chance the leader is actually alive)
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "1"))
+PHI_THRESHOLD = float(os.getenv("PHI_THRESHOLD", "8"))
+# A heartbeat round takes the interval plus on average 0.3 intervals of jitter
+DETECTORS = FailureDetectors(first_interval=HEARTBEAT_INTERVAL * 1.3)
+WATCHED_LEADER = None
+# Set to run the next heartbeat round right away, e.g. when the leader's link closed
+HEARTBEAT_WAKE = asyncio.Event()
+
+# "leader" probes the leader every round, "swim" one peer per period (probes.py)
+PROBE_MODE = os.getenv("PROBE_MODE", "leader")
+# Probes per second for the whole cluster, 0 = one per pod every HEARTBEAT_INTERVAL
+PROBE_BUDGET = float(os.getenv("PROBE_BUDGET", "0"))
+PROBE_INDIRECT = int(os.getenv("PROBE_INDIRECT", "3"))
+INDIRECT_PROBE_TIMEOUT = ClientTimeout(total=1)
+PROBES = ProbeSchedule()
+PROBE_PERIOD = HEARTBEAT_INTERVAL
+# Coordinator messages: 0 sends them to every peer at once, k relays them over a
+# k-ary tree so no pod has more than k in flight (broadcast.py)
+COORDINATOR_FANOUT = int(os.getenv("COORDINATOR_FANOUT", "0"))
+# GET /pod_id?v=2 also returns the leader the pod follows and its term. Older
+# pods ignore the parameter and answer with the bare ID
+POD_ID_VERSION = 2
+
+# Leader hand-over: "graceful" steps down in-process, "restart" exits the process
+STEP_DOWN_MODE = os.getenv("STEP_DOWN_MODE", "graceful")
+STEP_DOWN_DRAIN_TIMEOUT = float(os.getenv("STEP_DOWN_DRAIN_TIMEOUT", "2"))
+STEPPING_DOWN = False
+STEP_DOWN_TASK = None
+# How often workers read the shared state, see watch_shared_state
+SHARED_STATE_POLL = 0.02
+RUNNER = None
+
+# Fortunes served by /get_cookie: cookiesList, or a memory-mapped file that is
+# reloaded when it changes (fortunes.py)
+FORTUNE_FILE = os.getenv("FORTUNE_FILE", "")
+FORTUNES = None
+if FORTUNE_FILE:
+    FORTUNES = FortuneFile(
+        FORTUNE_FILE,
+        fmt=os.getenv("FORTUNE_FORMAT", "fortune"),
+        interval=float(os.getenv("FORTUNE_RELOAD_INTERVAL", "5")),
+    )
+
+# /get_cookie bodies are a pre-serialized cookie plus the pod and leader suffix
+COOKIE_FRAGMENTS = [json.dumps(cookie)[:-1].encode() for cookie in cookiesList]
+COOKIE_SUFFIXES = {}
+
+# Who answers /get_cookie: "leader" only the pod labelled role=leader (followers
+# answer too but close the connection), "local" every pod itself, "proxy" every
+# pod, followers forward to the leader over PROXY_SESSION
+COOKIE_ROUTING = os.getenv("COOKIE_ROUTING", "leader")
+PROXY_SESSION: ClientSession = None
+PROXY_CONN_LIMIT = int(os.getenv("PROXY_CONN_LIMIT", "100"))
+PROXY_TIMEOUT = ClientTimeout(total=float(os.getenv("PROXY_TIMEOUT", "2")))
+# Set on forwarded requests, the leader serves them itself instead of forwarding again
+FORWARDED_HEADER = "X-Bully-Forwarded-By"
+
+# "eager" sets up the kubernetes client before serving, "lazy" imports it on a
+# thread the first time it is needed (EndpointSlice watch or label patch)
+K8S_INIT = os.getenv("K8S_INIT", "eager")
+K8S_LOCK = asyncio.Lock()
+# Seconds from the process start to "import", "listen" and "first_heartbeat"
+STARTUP = {}
+
+# Role label of this pod, patched only when it changes
+POD_PATCHER = None
+LABELS = LabelReconciler(lambda role: patch_role_label(role))
+MEMBERSHIP_SOURCE = None
+
+# With WORKERS > 1 this process only runs the election agent on CONTROL_PORT and
+# WORKERS processes serve WEB_PORT (SO_REUSEPORT), reading the leader from SHARED_STATE
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARED_STATE: SharedState = None
+WORKER = False
+WORKER_PROCESSES = []
+
+# JSON logs written off the event loop, LOG_RATE records per second per message key
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_RATE = float(os.getenv("LOG_RATE", "1"))
+LOG_BURST = int(os.getenv("LOG_BURST", "5"))
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1") == "1"
+
+# Last TRACE_EVENTS election events, served on /debug/trace (tracing.py)
+TRACE = Tracer(
+    int(os.getenv("TRACE_EVENTS", "4096")), POD_ID, f"pod {POD_ID} ({POD_IP})"
+)
+
+# Prometheus metrics served on /metrics
+METRICS = Registry()
+COOKIE_SECONDS = Histogram(
+    "bully_get_cookie_seconds", "Time to serve /get_cookie", registry=METRICS
+)
+PROXY_SECONDS = Histogram(
+    "bully_get_cookie_proxy_seconds",
+    "Round trip of the /get_cookie requests forwarded to the leader",
+    registry=METRICS,
+)
+HEARTBEAT_SECONDS = Histogram(
+    "bully_heartbeat_round_seconds",
+    "Peer refresh and leader check of one heartbeat round",
+    registry=METRICS,
+)
+PROBE_SECONDS = Histogram(
+    "bully_peer_probe_seconds",
+    "Latency of answered /pod_id probes per peer",
+    ["peer"],
+    registry=METRICS,
+)
+LOOP_LAG_SECONDS = Histogram(
+    "bully_event_loop_lag_seconds",
+    "How much later than scheduled the event loop woke the lag sampler",
+    registry=METRICS,
+)
+ELECTION_SECONDS = Histogram(
+    "bully_election_seconds",
+    "Duration of the elections hosted by this pod",
+    ["election_type"],
+    registry=METRICS,
+)
+SHED_REQUESTS = Counter(
+    "bully_shed_requests",
+    "Requests refused by the admission limits",
+    ["plane", "reason"],
+    registry=METRICS,
+)
+COOKIE_ROUTES = Counter(
+    "bully_get_cookie_routes",
+    "/get_cookie requests by how they were answered",
+    ["route"],
+    registry=METRICS,
+)
+ELECTION_TRIGGERS = Counter(
+    "bully_election_triggers",
+    "Election triggers: started, merged into a pending one, or dropped because"
+    " a leader was announced during the backoff or the term was already covered",
+    ["outcome"],
+    registry=METRICS,
+)
+BROADCAST_SECONDS = Histogram(
+    "bully_coordinator_broadcast_seconds",
+    "Time until every peer answered or failed a coordinator broadcast",
+    registry=METRICS,
+)
+PATCH_SECONDS = Histogram(
+    "bully_label_patch_seconds", "Kubernetes role label patch latency", registry=METRICS
+)
+LEADER_ID = Gauge(
+    "bully_leader_id", "ID of the current leader, -1 if none", registry=METRICS
+)
+LEADER_ID.set_function(lambda: leader["id"])
+KNOWN_PEERS = Gauge("bully_known_peers", "Peers with a known ID", registry=METRICS)
+KNOWN_PEERS.set_function(lambda: len(IP_TO_ID))
+MESH_LINKS = Gauge("bully_mesh_links", "Open peer WebSockets", registry=METRICS)
+MESH_LINKS.set_function(lambda: len(MESH.links) if MESH is not None else 0)
+SWIM_PROBES = Counter(
+    "bully_swim_probes",
+    "SWIM probes sent, direct or through another pod, by whether the peer answered",
+    ["kind", "result"],
+    registry=METRICS,
+)
+PROBE_PERIOD_SECONDS = Gauge(
+    "bully_probe_period_seconds",
+    "Seconds between the SWIM probes of this pod",
+    registry=METRICS,
+)
+PROBE_PERIOD_SECONDS.set_function(lambda: PROBE_PERIOD)
+DETECTION_SECONDS = Gauge(
+    "bully_failure_detection_seconds",
+    "Expected and worst case seconds until some pod suspects a crashed peer",
+    ["bound"],
+    registry=METRICS,
+)
+PEER_CACHE = Counter(
+    "bully_peer_id_cache",
+    "Lookups of a peer's ID in the peer table, by whether it was cached and fresh",
+    ["result"],
+    registry=METRICS,
+)
+PEER_CACHE.labels("hit").set_function(lambda: PEERS.hits)
+PEER_CACHE.labels("miss").set_function(lambda: PEERS.misses)
+PIGGYBACKED_LEADERS = Counter(
+    "bully_piggybacked_leaders",
+    "Newer leaders followed from a peer's /pod_id reply instead of an election",
+    registry=METRICS,
+)
+STARTUP_SECONDS = Gauge(
+    "bully_startup_seconds",
+    "Seconds from the process start to each startup phase",
+    ["phase"],
+    registry=METRICS,
+)
 
 
 # Add this new endpoint
 async def readiness_check(request):
     """Return 200 only if ready to serve traffic"""
-    if IS_READY:
+    ready = SHARED_STATE.read().ready if WORKER else IS_READY
+    if ready:
         return web.Response(status=200, text="OK")
     else:
         return web.Response(status=503, text="Not Ready")
@@ -55,178 +378,795 @@ async def readiness_check(request):
 
 async def setup_k8s():
     # If you need to do setup of Kubernetes, i.e. if using Kubernetes Python client
-    print("K8S setup completed")
+    log.info("K8S setup completed")
 
 
-async def send_coordinator(id=POD_ID, url=POD_IP):
+def peer_session():
+    """
+    Return the app-wide session for pod to pod traffic, creating it on first use.
+    Connections are kept alive between heartbeats instead of being rebuilt every round
+    """
+    global PEER_SESSION
+    if PEER_SESSION is None or PEER_SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=PEER_CONN_LIMIT,
+            limit_per_host=PEER_CONN_LIMIT_PER_HOST,
+            keepalive_timeout=PEER_KEEPALIVE,
+        )
+        PEER_SESSION = ClientSession(connector=connector, timeout=MESSAGE_TIMEOUT)
+    return PEER_SESSION
+
+
+async def close_peer_session():
+    global PEER_SESSION
+    if PEER_SESSION is not None:
+        await PEER_SESSION.close()
+        PEER_SESSION = None
+
+
+def proxy_session():
+    """
+    Return the session followers forward /get_cookie with (COOKIE_ROUTING=proxy).
+    Separate from the peer pool so user traffic cannot hold up elections
+    """
+    global PROXY_SESSION
+    if PROXY_SESSION is None or PROXY_SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=PROXY_CONN_LIMIT, keepalive_timeout=PEER_KEEPALIVE
+        )
+        PROXY_SESSION = ClientSession(connector=connector, timeout=PROXY_TIMEOUT)
+    return PROXY_SESSION
+
+
+async def close_proxy_session():
+    global PROXY_SESSION
+    if PROXY_SESSION is not None:
+        await PROXY_SESSION.close()
+        PROXY_SESSION = None
+
+
+async def peer_request(method, pod_ip, endpoint, timeout=MESSAGE_TIMEOUT, **kwargs):
+    """
+    Send a request to another pod over its mesh link, or the pooled session.
+    The body is read before returning so the connection goes back to the pool
+    """
+    if PEER_TRANSPORT == "ws" and MESH is not None:
+        # GET parameters travel as the frame body
+        body = kwargs.get("json", kwargs.get("params"))
+        try:
+            return await MESH.request(pod_ip, endpoint, body, timeout=timeout.total)
+        except MeshUnavailable:
+            pass
+    url = "http://" + str(pod_ip) + ":" + str(CONTROL_PORT) + endpoint
+    async with peer_session().request(
+        method, url, timeout=timeout, **kwargs
+    ) as response:
+        await response.read()
+    return response
+
+
+async def send_coordinator(id=None, url=None, term=None):
+    """Announce a leader, this pod by default, with the term it was elected in"""
+    payload = {
+        "id": POD_ID if id is None else id,
+        "url": POD_IP if url is None else url,
+        "term": ELECTION_TERM if term is None else term,
+        "election_id": ELECTION_ID,
+    }
+    start = time.perf_counter()
+    with TRACE.span(
+        "coordinator_broadcast",
+        peers=len(IP_LIST),
+        fanout=COORDINATOR_FANOUT,
+        **payload,
+    ) as span:
+        missed = await disseminate(payload, list(IP_LIST), COORDINATOR_FANOUT)
+        if missed and COORDINATOR_FANOUT:
+            # Retry directly, around relays that failed or are too old to relay
+            log.info("Retrying the coordinator message to %d pods", len(missed))
+            missed = await disseminate(payload, missed, 0)
+        span["missed"] = len(missed)
+    BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+
+async def disseminate(payload, targets, fanout):
+    """
+    Send a coordinator message to `targets`, directly with fanout 0 or else
+    through a tree of relays. Returns the pods that were not reached, a pod
+    that rejected the message counts as reached but did not relay it
+    """
+    global TERM
+    if fanout:
+        groups = subtrees(targets, fanout)
+    else:
+        groups = [(pod_ip, []) for pod_ip in targets]
     tasks = []
-    payload = {"id": POD_ID, "url": POD_IP}
-    async with ClientSession(timeout=ClientTimeout(total=2)) as session:
-        for pod_ip in IP_LIST:
-            endpoint = "/receive_coordinator"
-            url = "http://" + str(pod_ip) + ":" + str(WEB_PORT) + endpoint
-            task = create_task(session.post(url=url, json=payload))
-            tasks.append(task)
+    for head, rest in groups:
+        message, timeout = payload, MESSAGE_TIMEOUT
+        if rest:
+            message = {**payload, "relay": rest, "fanout": fanout}
+            # The relay answers once its whole subtree has
+            hops = relay_hops(len(rest), fanout)
+            timeout = ClientTimeout(total=MESSAGE_TIMEOUT.total * (1 + hops))
+        tasks.append(
+            create_task(
+                traced_post(
+                    "coordinator", head, "/receive_coordinator", message, timeout
+                )
+            )
+        )
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
+
+    missed = []
+    for (head, rest), resp in zip(groups, responses):
+        if isinstance(resp, Exception):
+            log.warning(
+                "Coordinator message to %s failed: %r",
+                head,
+                resp,
+                extra={"key": ("coordinator", head)},
+            )
+            missed += [head, *rest]
+        elif resp.status == 409:
+            # Rejected as stale, catch up so the next election gets a fresh term
+            TERM = max(TERM, await rejected_term(resp))
+            missed += rest
+        elif resp.status != 200:
+            missed += [head, *rest]
+        elif rest:
+            missed += await relay_missed(resp, rest)
+    return missed
+
+
+async def relay_missed(response, rest):
+    """The pods a relay could not reach, all of them if it did not relay at all"""
+    try:
+        body = await response.json()
+    except (ValueError, aiohttp.ContentTypeError):
+        return rest
+    if not isinstance(body, dict) or not isinstance(body.get("missed"), list):
+        # An older pod, it followed the leader but did not pass it on
+        return rest
+    return [pod_ip for pod_ip in body["missed"] if pod_ip in rest]
+
+
+async def relay_coordinator(data):
+    """Pass a coordinator message on to this pod's subtree, returns the pods missed"""
+    peers = set(IP_LIST)
+    relay = [str(pod_ip) for pod_ip in data["relay"] if pod_ip != POD_IP]
+    # Only to known peers, the others go back to the leader as missed
+    unknown = [pod_ip for pod_ip in relay if pod_ip not in peers]
+    relay = [pod_ip for pod_ip in relay if pod_ip in peers]
+    fanout = int(data.get("fanout") or COORDINATOR_FANOUT or len(relay))
+    payload = {k: v for k, v in data.items() if k not in ("relay", "fanout")}
+    return unknown + await disseminate(payload, relay, fanout)
+
+
+async def traced_post(name, pod_ip, endpoint, payload, timeout=MESSAGE_TIMEOUT):
+    """POST an election message to a peer, recorded as a span in the trace"""
+    with TRACE.span(
+        name,
+        peer=pod_ip,
+        election_id=payload.get("election_id"),
+        term=payload.get("term"),
+    ) as span:
+        response = await peer_request(
+            "POST", pod_ip, endpoint, timeout=timeout, json=payload
+        )
+        span["status"] = response.status
+        return response
 
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
-        for resp in responses:
-            if isinstance(resp, Exception):
-                print(f"Broadcast error: {resp}")
+
+async def rejected_term(response):
+    """The receiver's term from a 409 reply, 0 if it did not send one"""
+    try:
+        return int((await response.json())["term"])
+    except (ValueError, KeyError, TypeError, aiohttp.ContentTypeError):
+        return 0
+
+
+async def catch_up_term(responses):
+    """
+    Catch up with the terms of the 409 replies to an election message, returns
+    True if there were any so the election is sent again in a fresh term
+    """
+    global TERM
+    rejected = [
+        response
+        for response in responses
+        if isinstance(response, (ClientResponse, MeshResponse))
+        and response.status == 409
+    ]
+    for response in rejected:
+        TERM = max(TERM, await rejected_term(response))
+    return bool(rejected)
 
 
 async def send_election(improved=False):
     tasks = []
-    ip_list = [ip for ip in IP_LIST if IP_TO_ID[ip] > POD_ID]
-    async with ClientSession(timeout=ClientTimeout(total=2)) as session:
-        for pod_ip in ip_list:
-            endpoint = "/receive_election"
-            url = "http://" + str(pod_ip) + ":" + str(WEB_PORT) + endpoint
-            task = create_task(session.post(url=url))
-            if improved:
-                tasks.append((pod_ip, task))
-            else:
-                tasks.append(task)
-
+    payload = {"id": POD_ID, "term": ELECTION_TERM, "election_id": ELECTION_ID}
+    ip_list = [ip for ip in IP_LIST if IP_TO_ID.get(ip, -1) > POD_ID]
+    for pod_ip in ip_list:
+        task = create_task(
+            traced_post("election_message", pod_ip, "/receive_election", payload)
+        )
         if improved:
-            results = await asyncio.gather(
-                *(t for _, t in tasks), return_exceptions=True
-            )
-            return list(zip((ip for ip, _ in tasks), results))
+            tasks.append((pod_ip, task))
         else:
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            return responses
+            tasks.append(task)
 
+    if improved:
+        results = await asyncio.gather(*(t for _, t in tasks), return_exceptions=True)
+        return list(zip((ip for ip, _ in tasks), results))
+    else:
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        return responses
 
-async def heartbeat():
-    global IP_LIST, IP_TO_ID, ELECTION_IN_PROCESS, leader
-    while True:
-        await asyncio.sleep(1)  # wait for everything to be up
-        print("Starting heartbeat")
-
-        # Get all pods doing bully
-        ip_list = []
-        print("Making a DNS lookup to service")
-        response = await asyncio.to_thread(
-            socket.getaddrinfo, "bully-service", 0, 0, 0, 0
+
+def pod_id_body():
+    """Versioned /pod_id reply: this pod's ID, the leader it follows and its term"""
+    return {
+        "v": POD_ID_VERSION,
+        "id": POD_ID,
+        "leader": {"id": leader["id"], "url": leader["url"]},
+        "term": LEADER_TERM,
+    }
+
+
+def read_pod_id(body):
+    """
+    The ID in a /pod_id reply, a bare int from older pods or a versioned body.
+    The leader in a versioned body is followed if it is newer than this pod's
+    """
+    if not isinstance(body, dict):
+        return int(body)
+    follow_piggybacked_leader(body)
+    return int(body["id"])
+
+
+def follow_piggybacked_leader(body):
+    """
+    Catch up with a leader whose coordinator broadcast this pod missed, with
+    the same rules as on_coordinator. Returns True if the leader changed
+    """
+    global RING_SEEN, TERM
+    try:
+        leader_id = int(body["leader"]["id"])
+        leader_url = body["leader"]["url"]
+        term = int(body["term"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    # A leader lower than this pod is not followed, this pod would win against it
+    if leader_id <= POD_ID or not leader_url or leader_url == POD_IP:
+        return False
+    if (term, leader_id) <= (LEADER_TERM, leader["id"]):
+        return False
+
+    log.info("Following leader %s of term %s from a probe reply", leader_id, term)
+    TRACE.instant("leader_piggybacked", leader=leader_id, term=term)
+    PIGGYBACKED_LEADERS.inc()
+    TERM = max(TERM, term)
+    RING_SEEN = None
+    was_leader = leader["id"] == POD_ID
+    set_leader(leader_id, leader_url, term)
+    if was_leader:
+        schedule_step_down()
+    return True
+
+
+async def fetch_pod_id(pod_ip):
+    """Ask one pod for its ID, returns None if it does not answer"""
+    start = time.perf_counter()
+    try:
+        response = await peer_request(
+            "GET",
+            pod_ip,
+            "/pod_id",
+            timeout=PROBE_TIMEOUT,
+            params={"v": POD_ID_VERSION},
         )
-        print("Get response from DNS")
-        if not response or not response[0]:
-            print("No response from DNS")
-            await asyncio.sleep(1)
-            continue
+        if response.status == 200:
+            PROBE_SECONDS.labels(pod_ip).observe(time.perf_counter() - start)
+            return read_pod_id(await response.json())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.warning(
+            "Error communicating with pod %s: %r",
+            pod_ip,
+            e,
+            extra={"key": ("probe", pod_ip)},
+        )
+    return None
+
 
-        for result in response:
-            ip_list.append(result[-1][0])
-        ip_list = list(set(ip_list))
+async def resolve_service():
+    """Resolve the headless service through DNS, returns the other pods' IPs or None"""
+    # Get all pods doing bully
+    ip_list = []
+    log.debug("Making a DNS lookup to service")
+    response = await asyncio.to_thread(socket.getaddrinfo, PEER_SERVICE, 0, 0, 0, 0)
+    if not response or not response[0]:
+        log.warning("No response from DNS")
+        return None
 
-        # Remove own POD ip from the list of pods
+    for result in response:
+        ip_list.append(result[-1][0])
+    ip_list = list(set(ip_list))
+
+    # Remove own POD ip from the list of pods
+    if POD_IP in ip_list:
         ip_list.remove(POD_IP)
-        print(f"Got {len(ip_list)} other pod ip's")
-
-        # current leader
-        current_leader = leader  # copy or smth
-        leader_found = leader["id"] == POD_ID
-        call_election = False
-
-        # Get ID's of other pods by sending a GET request to them
-        await asyncio.sleep(random.uniform(0.1, 0.5))
-        ip_to_id = {}
-        async with ClientSession(timeout=ClientTimeout(total=0.5)) as session:
-            tasks = []
-            for pod_ip in ip_list:
-                endpoint = "/pod_id"
-                url = "http://" + str(pod_ip) + ":" + str(WEB_PORT) + endpoint
-                task = create_task(session.get(url=url))
-                tasks.append(task)
-
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            for id, response in enumerate(responses):
-                pod_ip = ip_list[id]
-                try:
-                    if isinstance(response, ClientResponse) and response.status == 200:
-                        crnt_pod_id = await response.json()
-                        # check for leader
-                        if crnt_pod_id == current_leader["id"]:
-                            leader_found = True
-                        if crnt_pod_id > current_leader["id"]:
-                            # a new leader has been found?
-                            call_election = True
-
-                        # else we don't care
-                        ip_to_id[str(pod_ip)] = int(crnt_pod_id)
-                # If a pod is dead
-                except aiohttp.ClientError as e:
-                    print(f"Error communicating with pod {pod_ip}: {e}")
-
-        # Other pods in network
-        IP_LIST = ip_list
-        IP_TO_ID = ip_to_id
-        # after requesting every found pod
+    log.debug("Got %d other pod ip's", len(ip_list))
+    return ip_list
+
+
+async def refresh_peers(ip_list):
+    """
+    Update IP_LIST/IP_TO_ID for the given pods. Only pods missing from the peer table
+    (new, or past their TTL) get a /pod_id request
+    """
+    global IP_LIST, IP_TO_ID
+    PEERS.retain(ip_list)
+    DETECTORS.retain(ip_list)
+    PROBE_SECONDS.retain({(pod_ip,) for pod_ip in ip_list})
+    misses = [pod_ip for pod_ip in ip_list if PEERS.lookup(pod_ip) is None]
+    # Asking a few peers only pays off when more pods are missing than we would ask
+    if GOSSIP_FANOUT > 0 and len(misses) > GOSSIP_FANOUT:
+        misses = await sync_cluster_view(ip_list, misses)
+    if misses:
+        pod_ids = await asyncio.gather(*(fetch_pod_id(pod_ip) for pod_ip in misses))
+        for pod_ip, crnt_pod_id in zip(misses, pod_ids):
+            if crnt_pod_id is not None:
+                PEERS.store(pod_ip, crnt_pod_id)
+
+    # Other pods in network
+    IP_LIST = list(ip_list)
+    IP_TO_ID = PEERS.id_map()
+
+
+async def fetch_cluster_view(pod_ip):
+    try:
+        response = await peer_request(
+            "GET", pod_ip, "/cluster_view", timeout=PROBE_TIMEOUT
+        )
+        if response.status == 200:
+            return await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.warning(
+            "Error fetching cluster view from %s: %r",
+            pod_ip,
+            e,
+            extra={"key": ("cluster_view", pod_ip)},
+        )
+    return None
+
+
+async def sync_cluster_view(ip_list, misses):
+    """
+    Gossip-style resolution: take missing IDs from the cluster view of a few random
+    peers instead of asking every pod. Returns the pods that still have to be probed
+    directly, which are the ones no view has known for GOSSIP_PROBE_AFTER rounds
+    """
+    sources = random.sample(ip_list, min(GOSSIP_FANOUT, len(ip_list)))
+    views = await asyncio.gather(*(fetch_cluster_view(pod_ip) for pod_ip in sources))
+    wanted = set(misses)
+    for view in views:
+        if view is None:
+            continue
+        for pod_ip, crnt_pod_id in view["peers"].items():
+            if pod_ip in wanted:
+                PEERS.store(pod_ip, int(crnt_pod_id))
+                wanted.discard(pod_ip)
+
+        # Join the known leader instead of electing, unless we would beat it
+        view_leader = view["leader"]
+        if leader["id"] == -1 and view_leader["id"] > POD_ID:
+            set_leader(view_leader["id"], view_leader["url"])
+
+    for pod_ip in list(UNRESOLVED):
+        if pod_ip not in wanted:
+            del UNRESOLVED[pod_ip]
+    for pod_ip in wanted:
+        UNRESOLVED[pod_ip] = UNRESOLVED.get(pod_ip, 0) + 1
+    return [pod_ip for pod_ip in wanted if UNRESOLVED[pod_ip] > GOSSIP_PROBE_AFTER]
+
+
+async def check_leader():
+    """
+    Liveness check of the current leader. Returns (leader_found, call_election),
+    a new election is needed if the leader is suspected dead or a higher ID has joined.
+    A single slow or lost probe only raises the leader's phi, it does not fail it
+    """
+    global WATCHED_LEADER
+    if leader["id"] == POD_ID:
+        leader_found = True
+    elif leader["id"] == -1 or not leader["url"]:
+        leader_found = False
+    else:
+        leader_ip = leader["url"]
+        if leader_ip != WATCHED_LEADER:
+            DETECTORS.reset(leader_ip)
+            WATCHED_LEADER = leader_ip
+        leader_id = leader["id"]
+        detector = DETECTORS.get(leader_ip)
+        timeout = detector.timeout(PROBE_TIMEOUT.total, MESSAGE_TIMEOUT.total)
+        start = time.monotonic()
+        try:
+            response = await peer_request(
+                "GET",
+                leader_ip,
+                "/pod_id",
+                timeout=ClientTimeout(total=timeout),
+                params={"v": POD_ID_VERSION},
+            )
+            if response.status == 200:
+                latency = time.monotonic() - start
+                PROBE_SECONDS.labels(leader_ip).observe(latency)
+                # A leader that stepped down names its successor here
+                if read_pod_id(await response.json()) == leader_id:
+                    detector.heartbeat(latency=latency)
+                else:
+                    # Another pod has taken over the leader's IP
+                    detector.mark_down()
+        except aiohttp.ClientConnectorError as e:
+            log.warning("Leader %s refused the connection: %r", leader_id, e)
+            detector.mark_down()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.info("Leader probe failed: %r", e)
+
+        phi = detector.phi()
+        leader_found = phi < PHI_THRESHOLD or leader["id"] != leader_id
+        if not leader_found:
+            log.warning("Leader %s suspected dead, phi %.1f", leader_id, phi)
+            TRACE.instant("leader_suspected", leader=leader_id, phi=round(phi, 1))
+            # Forget the old leader so it is not elected again from the cache
+            PEERS.evict(leader_ip)
+            IP_TO_ID.pop(leader_ip, None)
+
+    call_election = any(pod_id > leader["id"] for pod_id in IP_TO_ID.values())
+    return leader_found, call_election
+
+
+async def ask_peer_for_leader():
+    """
+    Before an election, ask one random peer for its ID. If this pod missed the
+    coordinator broadcast of a newer leader, the peer's reply names it and this
+    pod follows it without an election. Returns True if the leader changed
+    """
+    peers = [pod_ip for pod_ip in IP_LIST if pod_ip != leader["url"]]
+    if not peers:
+        return False
+    before = (LEADER_TERM, leader["id"])
+    await fetch_pod_id(random.choice(peers))
+    return (LEADER_TERM, leader["id"]) != before
+
+
+def next_heartbeat_delay():
+    """Probe again sooner while the leader is overdue, so a dead leader is found fast"""
+    if PROBE_MODE == "swim":
+        # A random slot in every period, so the pods' probes do not bunch up
+        return random.uniform(0.5, 1.5) * PROBE_PERIOD
+    if leader["id"] in (-1, POD_ID) or not leader["url"]:
+        return HEARTBEAT_INTERVAL
+    if DETECTORS.phi(leader["url"]) >= 1:
+        return HEARTBEAT_INTERVAL / 4
+    return HEARTBEAT_INTERVAL
+
+
+def update_probe_schedule(ip_list):
+    global PROBE_PERIOD
+    if not PROBES.update(ip_list):
+        return
+    cluster_size = len(PROBES.members) + 1
+    PROBE_PERIOD = probe_period(cluster_size, HEARTBEAT_INTERVAL, PROBE_BUDGET)
+    expected, worst = detection_bounds(
+        cluster_size,
+        PROBE_PERIOD,
+        PROBE_TIMEOUT.total,
+        INDIRECT_PROBE_TIMEOUT.total if PROBE_INDIRECT else 0,
+    )
+    DETECTION_SECONDS.labels("expected").set(expected)
+    DETECTION_SECONDS.labels("worst").set(worst)
+    log.info(
+        "Probing one of %d peers every %.2fs, a crash is found in %.1fs,"
+        " %.1fs at worst",
+        len(PROBES.members),
+        PROBE_PERIOD,
+        expected,
+        worst,
+    )
+
+
+async def probe_indirect(helper_ip, pod_ip):
+    """Ask another pod to probe `pod_ip`, returns the ID it got back or None"""
+    try:
+        response = await peer_request(
+            "POST",
+            helper_ip,
+            "/probe",
+            timeout=INDIRECT_PROBE_TIMEOUT,
+            json={"target": pod_ip},
+        )
+        if response.status == 200:
+            return int(await response.json())
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, TypeError) as e:
+        log.info("Indirect probe of %s through %s failed: %r", pod_ip, helper_ip, e)
+    return None
+
+
+async def swim_probe(pod_ip):
+    """
+    Probe one peer, then through PROBE_INDIRECT others if it does not answer.
+    False if nobody got an answer with the ID the peer is known by
+    """
+    expected = IP_TO_ID.get(pod_ip)
+    answer = await fetch_pod_id(pod_ip)
+    if answer is not None and expected in (None, answer):
+        SWIM_PROBES.labels("direct", "ack").inc()
+        return True
+    SWIM_PROBES.labels("direct", "nack").inc()
+    if answer is not None:
+        # Another pod has taken over the peer's IP
+        return False
+
+    helpers = [ip for ip in PROBES.members if ip != pod_ip]
+    helpers = random.sample(helpers, min(PROBE_INDIRECT, len(helpers)))
+    answers = await asyncio.gather(
+        *(probe_indirect(helper_ip, pod_ip) for helper_ip in helpers)
+    )
+    acked = [a for a in answers if a is not None and expected in (None, a)]
+    SWIM_PROBES.labels("indirect", "ack").inc(len(acked))
+    SWIM_PROBES.labels("indirect", "nack").inc(len(answers) - len(acked))
+    return bool(acked)
+
+
+async def swim_round():
+    """
+    One SWIM protocol period: probe the next peer of the round-robin order.
+    Returns (leader_found, call_election) like check_leader. The leader is
+    probed by some pod about every period, and a follower that finds it dead
+    starts the election that tells everybody else
+    """
+    update_probe_schedule(IP_LIST)
+    if leader["id"] == POD_ID:
+        leader_found = True
+    elif leader["id"] == -1 or not leader["url"]:
+        leader_found = False
+    else:
+        # Gone from the service, nothing left to probe
+        leader_found = leader["url"] in PROBES.members
+
+    pod_ip = PROBES.next()
+    if pod_ip is not None and not await swim_probe(pod_ip):
+        log.warning(
+            "Peer %s did not answer direct or indirect probes",
+            pod_ip,
+            extra={"key": ("swim", pod_ip)},
+        )
+        if pod_ip == leader["url"] and leader["id"] != POD_ID:
+            log.warning("Leader %s suspected dead", leader["id"])
+            TRACE.instant("leader_suspected", leader=leader["id"], probe="swim")
+            leader_found = False
+        PEERS.evict(pod_ip)
+        IP_TO_ID.pop(pod_ip, None)
+
+    call_election = any(pod_id > leader["id"] for pod_id in IP_TO_ID.values())
+    return leader_found, call_election
+
+
+async def resolve_peer(pod_ip):
+    """Fetch the ID of a pod that just joined, retrying until it answers or leaves"""
+    delay = 0.2
+    while pod_ip in MEMBERSHIP.members:
+        crnt_pod_id = await fetch_pod_id(pod_ip)
+        if crnt_pod_id is not None:
+            if pod_ip in MEMBERSHIP.members:
+                PEERS.store(pod_ip, crnt_pod_id)
+                IP_TO_ID[pod_ip] = crnt_pod_id
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 5)
+
+
+async def watch_endpoints(min_backoff=1.0, max_backoff=30.0):
+    source = MEMBERSHIP_SOURCE
+    backoff = min_backoff
+    while source is None:
+        try:
+            api = await kubernetes_client()
+            source = EndpointSliceSource(api.api_client, namespace, PEER_SERVICE)
+        except Exception as e:
+            # The heartbeat resolves the service meanwhile, see MEMBERSHIP_SYNCED
+            log.error("Kubernetes client failed, retrying in %.1fs: %r", backoff, e)
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            backoff = min(backoff * 2, max_backoff)
+    await watch_membership(source)
+
+
+async def watch_membership(source):
+    """Apply endpoint add/remove deltas to IP_LIST and IP_TO_ID"""
+    global IP_LIST, MEMBERSHIP_SYNCED
+    async for event in source.events():
+        if event["type"] == "ERROR":
+            log.error("Membership watch error: %s", event["object"])
+            continue
+
+        joined, left = MEMBERSHIP.apply(event)
+        joined.discard(POD_IP)
+        left.discard(POD_IP)
+        for pod_ip in left:
+            PEERS.evict(pod_ip)
+            IP_TO_ID.pop(pod_ip, None)
+        IP_LIST = sorted(MEMBERSHIP.members - {POD_IP})
+        MEMBERSHIP_SYNCED = True
+        for pod_ip in joined:
+            create_task(resolve_peer(pod_ip))
+
+        if joined or left:
+            log.info(
+                "Membership: +%d -%d, %d peers", len(joined), len(left), len(IP_LIST)
+            )
+
+
+async def wait_next_round(delay):
+    try:
+        await asyncio.wait_for(HEARTBEAT_WAKE.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+    HEARTBEAT_WAKE.clear()
+
+
+def mesh_link_closed(pod_ip):
+    """A closed link to the leader means it is probably gone, check it now"""
+    if pod_ip == leader["url"] and leader["id"] != POD_ID:
+        log.warning("Mesh link to leader %s closed", leader["id"])
+        DETECTORS.get(pod_ip).mark_down()
+        HEARTBEAT_WAKE.set()
+
+
+async def heartbeat():
+    global IP_LIST, IP_TO_ID, ELECTION_IN_PROCESS, leader
+    while True:
+        await wait_next_round(next_heartbeat_delay())
+        log.debug("Starting heartbeat")
+
+        if MEMBERSHIP_MODE == "watch" and MEMBERSHIP_SYNCED:
+            ip_list = IP_LIST
+        else:
+            ip_list = await resolve_service()
+            if ip_list is None:
+                await asyncio.sleep(1)
+                continue
+
+        start = time.perf_counter()
+        if PROBE_MODE == "swim":
+            await refresh_peers(ip_list)
+            leader_found, call_election = await swim_round()
+        else:
+            await asyncio.sleep(random.uniform(0.1, 0.5) * HEARTBEAT_INTERVAL)
+            start = time.perf_counter()
+            await refresh_peers(ip_list)
+            leader_found, call_election = await check_leader()
+        if not leader_found and await ask_peer_for_leader():
+            leader_found = True
+            call_election = any(pod_id > leader["id"] for pod_id in IP_TO_ID.values())
+
+        # after checking the leader
         if not leader_found or call_election:
             await general_election()
-
-        print("=" * 50)
-        print(IP_TO_ID)
-        print("Leader ID: " + str(leader["id"]))
+        HEARTBEAT_SECONDS.observe(time.perf_counter() - start)
+        startup_phase("first_heartbeat")
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Heartbeat done, leader %s, %d peers",
+                leader["id"],
+                len(IP_TO_ID),
+                extra={
+                    "peers": dict(IP_TO_ID),
+                    "cache_hits": PEERS.hits,
+                    "cache_misses": PEERS.misses,
+                },
+            )
 
         if leader["id"] != -1 and leader["id"] != POD_ID:
             await remove_leader_label()
 
 
+def set_leader(leader_id, leader_url, term=None):
+    global LEADER_TERM
+    if leader_id != leader["id"]:
+        TRACE.instant("leader_changed", leader=leader_id, url=leader_url, term=term)
+    leader["id"] = leader_id
+    leader["url"] = leader_url
+    if term is not None:
+        LEADER_TERM = term
+    publish_state()
+
+
+def publish_state():
+    """Hand the leader and the serving state to the HTTP workers, if there are any"""
+    if SHARED_STATE is not None and not WORKER:
+        SHARED_STATE.write(leader["id"], leader["url"], IS_READY, STEPPING_DOWN)
+
+
+def next_election_id():
+    """Start a new term for an election hosted by this pod, returns its log fields"""
+    global ELECTION_SEQ, ELECTION_ID, TERM, ELECTION_TERM
+    ELECTION_SEQ += 1
+    TERM += 1
+    ELECTION_TERM = TERM
+    ELECTION_ID = f"{POD_ID}-{ELECTION_SEQ}"
+    return {"election_id": ELECTION_ID, "term": TERM}
+
+
 async def leader_election():
     """
     Host an election, whenever a leader is either down or there is a new candidate
     """
     global ELECTION_IN_PROCESS, leader, ELECTION_TYPE
     # Try to acquire the lock, if already held by another election, skip
-    print("starting election for node", POD_ID)
     if ELECTION_IN_PROCESS:
-        print("[LEADER_ELECTION] Already in progress, skipping ...")
+        log.debug("Election already in progress, skipping")
         return
     ELECTION_IN_PROCESS = True
-    # Collect the ID's higher than my own:
-    election_candidates = [node_ID for node_ID in IP_TO_ID.values() if node_ID > POD_ID]
-    print(f"Node {POD_ID} will send elections to {len(election_candidates)} nodes")
-    # Check if there are no candidates, elect as leader if no candidates
-    if len(election_candidates) == 0:
-        leader["id"] = POD_ID
-        leader["url"] = POD_IP
-        await send_coordinator()
-        ELECTION_IN_PROCESS = False
-        await label_self_as_leader()
-        return
+    election = next_election_id()
+    start = time.perf_counter()
+    try:
+        # Collect the ID's higher than my own:
+        election_candidates = [
+            node_ID for node_ID in IP_TO_ID.values() if node_ID > POD_ID
+        ]
+        log.info(
+            "Starting election, sending it to %d nodes",
+            len(election_candidates),
+            extra=election,
+        )
+        # Check if there are no candidates, elect as leader if no candidates
+        if len(election_candidates) == 0:
+            set_leader(POD_ID, POD_IP, election["term"])
+            await send_coordinator()
+            ELECTION_IN_PROCESS = False
+            await label_self_as_leader()
+            return
+
+        # If there are candidates call election on them
+        ok_recieved = False
+        responses = await send_election()
+        if await catch_up_term(responses):
+            election = next_election_id()
+            log.info("Election rejected as stale, retrying", extra=election)
+            responses = await send_election()
+        for response in responses:
+            if (
+                isinstance(response, (ClientResponse, MeshResponse))
+                and response.status == 200
+            ):
+                ok_recieved = True
+            else:
+                log.warning("Election message failed: %r", response, extra=election)
 
-    # If there are candidates call election on them
-    ok_recieved = False
-    responses = await send_election()
-    for response in responses:
-        if isinstance(response, ClientResponse) and response.status == 200:
-            ok_recieved = True
-        else:
-            print(f"Broadcast error: {response}")
+        # we should send all messages out before terminating
+        if ok_recieved:
+            ELECTION_IN_PROCESS = False
 
-    # we should send all messages out before terminating
-    if ok_recieved:
-        ELECTION_IN_PROCESS = False
+            was_leader = leader["id"] == POD_ID
+            await remove_leader_label()
 
-        was_leader = leader["id"] == POD_ID
-        await remove_leader_label()
+            if was_leader:
+                log.info("Stepping down: found higher candidate", extra=election)
+                schedule_step_down()
 
-        if was_leader:
-            print(
-                f"Stepping down: Found higher candidate. Restarting to break sticky connections."
-            )
-            asyncio.get_event_loop().call_later(1, lambda: os._exit(0))
+            return
 
+        # If no 'ok' from higher candidate, you are then leader
+        set_leader(POD_ID, POD_IP, election["term"])
+        await label_self_as_leader()
+        # send broadcasts sends a message for each node in here
+        await send_coordinator()
+        ELECTION_IN_PROCESS = False
         return
-
-    # If no 'ok' from higher candidate, you are then leader
-    leader["id"] = POD_ID
-    leader["url"] = POD_IP
-    # send broadcasts sends a message for each node in here
-    await send_coordinator()
-    ELECTION_IN_PROCESS = False
-    return
+    finally:
+        ELECTION_SECONDS.labels("normal").observe(time.perf_counter() - start)
 
 
 async def improved_leader_election():
@@ -236,90 +1176,471 @@ async def improved_leader_election():
     global ELECTION_IN_PROCESS, leader
     # Try to acquire the lock, if already held by another election, skip
     if ELECTION_IN_PROCESS:
-        print("[LEADER_ELECTION] Already in progress, skipping ...")
+        log.debug("Election already in progress, skipping")
         return
-    print("starting election for node", POD_ID)
     ELECTION_IN_PROCESS = True
-    # Collect the ID's higher than my own:
-    election_candidates = [node_ID for node_ID in IP_TO_ID.values() if node_ID > POD_ID]
-    print(f"Node {POD_ID} will send elections to {len(election_candidates)} nodes")
-    # Check if there are no candidates, elect as leader if no candidates
-    if len(election_candidates) == 0:
-        leader["id"] = POD_ID
-        leader["url"] = POD_IP
-        await send_coordinator()
+    election = next_election_id()
+    start = time.perf_counter()
+    try:
+        # Collect the ID's higher than my own:
+        election_candidates = [
+            node_ID for node_ID in IP_TO_ID.values() if node_ID > POD_ID
+        ]
+        log.info(
+            "Starting election, sending it to %d nodes",
+            len(election_candidates),
+            extra=election,
+        )
+        # Check if there are no candidates, elect as leader if no candidates
+        if len(election_candidates) == 0:
+            set_leader(POD_ID, POD_IP, election["term"])
+            await send_coordinator()
+            ELECTION_IN_PROCESS = False
+            await label_self_as_leader()
+            return
+
+        # If there are candidates call election on them
+        ok_recieved = False
+        highest_id = -1
+        responses = await send_election(improved=True)
+        if await catch_up_term(response for _, response in responses):
+            election = next_election_id()
+            log.info("Election rejected as stale, retrying", extra=election)
+            responses = await send_election(improved=True)
+        for ip, response in responses:
+            if (
+                isinstance(response, (ClientResponse, MeshResponse))
+                and response.status == 200
+            ):
+                ok_recieved = True
+                # The pod may have left while the election was running
+                highest_id = max(highest_id, IP_TO_ID.get(ip, -1))
+            else:
+                log.warning("Election message failed: %r", response, extra=election)
+
+        # we should send all messages out before terminating
+        new_leader = -1
+
+        if ok_recieved:
+            new_leader = highest_id
+            if leader["id"] == POD_ID:
+                log.info("Stepping down: found higher candidate", extra=election)
+                schedule_step_down()
+            else:
+                await remove_leader_label()
+        else:
+            new_leader = POD_ID
+            await label_self_as_leader()
+
+        if new_leader == POD_ID:
+            set_leader(POD_ID, POD_IP, election["term"])
+        else:
+            set_leader(
+                new_leader,
+                next((ip for ip, id_ in IP_TO_ID.items() if id_ == new_leader), None),
+                election["term"],
+            )
+        await send_coordinator(id=leader["id"], url=leader["url"])
         ELECTION_IN_PROCESS = False
-        await label_self_as_leader()
+    finally:
+        ELECTION_SECONDS.labels("improved").observe(time.perf_counter() - start)
+
+
+def ring_successors():
+    """Peers after this pod on the ring of ascending IDs, nearest first"""
+    ring = sorted((pod_id, ip) for ip, pod_id in IP_TO_ID.items())
+    after = [ip for pod_id, ip in ring if pod_id > POD_ID]
+    before = [ip for pod_id, ip in ring if pod_id < POD_ID]
+    return after + before
+
+
+def ring_forwarded(term=None):
+    """
+    Highest candidate this pod passed on in the ring election of `term` (the
+    current one by default), or -1. Forgotten after a heartbeat interval, in
+    case the candidate died on the way
+    """
+    if RING_SEEN is None or RING_SEEN[0] != (TERM if term is None else term):
+        return -1
+    if time.monotonic() - RING_SEEN[2] > HEARTBEAT_INTERVAL:
+        return -1
+    return RING_SEEN[1]
+
+
+async def forward_ring(candidate, hops, election):
+    """Pass a candidate to the next live pod on the ring"""
+    global RING_SEEN, TERM
+    RING_SEEN = (election["term"], candidate, time.monotonic())
+    payload = {"candidate": candidate, "hops": hops, **election}
+    for pod_ip in ring_successors():
+        try:
+            response = await traced_post(
+                "ring_message", pod_ip, "/ring_election", payload
+            )
+            if response.status == 200:
+                return
+            if response.status == 409:
+                # The successor has seen a newer term, this election is over
+                TERM = max(TERM, await rejected_term(response))
+                return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning(
+                "Ring successor %s unreachable: %r",
+                pod_ip,
+                e,
+                extra={"key": ("ring", pod_ip), **election},
+            )
+        # Skip the dead successor, the ring closes around it
+    if RING_SEEN is None and leader["id"] > POD_ID:
+        # A higher pod won and announced itself while the successors timed out
         return
+    log.info("No other pod on the ring answered", extra=election)
+    await win_ring_election(election)
 
-    # If there are candidates call election on them
-    ok_recieved = False
-    highest_id = -1
-    responses = await send_election(improved=True)
-    for ip, response in responses:
-        if isinstance(response, ClientResponse) and response.status == 200:
-            ok_recieved = True
-            highest_id = max(highest_id, IP_TO_ID[ip])
-        else:
-            print(f"Broadcast error: {response}")
 
-    # we should send all messages out before terminating
-    new_leader = -1
+async def win_ring_election(election):
+    global RING_SEEN, RING_STARTED
+    RING_SEEN = None
+    log.info("Won the ring election", extra=election)
+    TRACE.instant("ring_won", **election)
+    set_leader(POD_ID, POD_IP, election["term"])
+    await label_self_as_leader()
+    await send_coordinator(term=election["term"])
+    if RING_STARTED is not None:
+        ELECTION_SECONDS.labels("ring").observe(time.perf_counter() - RING_STARTED)
+        RING_STARTED = None
 
-    if ok_recieved:
-        new_leader = highest_id
-        await remove_leader_label()
-    else:
-        new_leader = POD_ID
-        await label_self_as_leader()
 
-    leader["id"] = new_leader
-    leader["url"] = next(
-        (ip for ip, id_ in IP_TO_ID.items() if id_ == new_leader), None
+async def ring_leader_election():
+    """
+    Chang-Roberts election on a ring of ascending IDs: the candidate travels
+    to the successor, each pod passes on the higher of it and its own ID and
+    drops lower ones once it took part. The pod that gets its own ID back has
+    the highest ID on the ring. O(N log N) messages on average instead of the
+    O(N^2) of the bully elections
+    """
+    global RING_STARTED
+    if ring_forwarded() >= POD_ID:
+        log.debug("Ring election with a candidate >= this pod under way, skipping")
+        return
+    election = next_election_id()
+    log.info(
+        "Starting ring election, %d pods on the ring",
+        len(IP_TO_ID) + 1,
+        extra=election,
     )
-    await send_coordinator(id=leader["id"], url=leader["url"])
-    ELECTION_IN_PROCESS = False
+    RING_STARTED = time.perf_counter()
+    await forward_ring(POD_ID, 1, election)
+
+
+async def patch_role_label(role):
+    # Setting the label to None removes it
+    body = {"metadata": {"labels": {"role": role}}}
+    start = time.perf_counter()
+    try:
+        with TRACE.span("label_patch", role=role, term=LEADER_TERM):
+            if POD_PATCHER is not None:
+                await POD_PATCHER.patch_pod(pod_name, body)
+            else:
+                api = await kubernetes_client()
+                await asyncio.to_thread(
+                    api.patch_namespaced_pod,
+                    name=pod_name,
+                    namespace=namespace,
+                    body=body,
+                )
+    finally:
+        PATCH_SECONDS.observe(time.perf_counter() - start)
 
 
 async def label_self_as_leader():
-    # The patch to apply
-    body = {"metadata": {"labels": {"role": "leader"}}}
-    print(f"Labeled pod {pod_name} as leader with id {POD_ID}")
-    # Patch the pod
-    await asyncio.to_thread(
-        v1.patch_namespaced_pod, name=pod_name, namespace=namespace, body=body
-    )
+    if LABELS.applied != "leader":
+        log.info("Labeling pod %s as leader with id %s", pod_name, POD_ID)
+    LABELS.set("leader")
 
 
 async def remove_leader_label():
-    # Remove label by setting it to None
-    body = {"metadata": {"labels": {"role": None}}}
-    print(f"Removed leader label from pod {pod_name}")
-
-    await asyncio.to_thread(
-        v1.patch_namespaced_pod, name=pod_name, namespace=namespace, body=body
-    )
+    LABELS.set(None)
 
 
 async def general_election():
-    # start election in background task
-    # ELECTION_TYPE = os.getenv("ELECTION_TYPE")
-    print("[INFO] Starting general election")
-    print(f"Server uses ELECTION_TYPE: {ELECTION_TYPE}")
-    if ELECTION_TYPE == "normal":
-        asyncio.create_task(leader_election())
-    elif ELECTION_TYPE == "improved":
-        asyncio.create_task(improved_leader_election())
-    else:
-        print("Not recognized ELECTION_TYPE, defaulting to normal")
-        asyncio.create_task(leader_election())
+    """
+    Start an election in the background, unless one is already pending or
+    running on this pod: the heartbeat and election messages from peers can
+    trigger many at once when the leader dies, they merge into that one
+    """
+    global ELECTION_TASK
+    if ELECTION_TASK is not None and not ELECTION_TASK.done():
+        log.debug("Election already pending, merging")
+        ELECTION_TRIGGERS.labels("merged").inc()
+        TRACE.instant("election_merged")
+        return
+    ELECTION_TASK = asyncio.create_task(run_election())
 
 
-# GET /pod_id
+def election_backoff():
+    """
+    Random wait before starting an election, longer the more known pods have a
+    higher ID, so the likely winner usually goes first and its coordinator
+    message spares the others their election
+    """
+    higher = sum(1 for pod_id in IP_TO_ID.values() if pod_id > POD_ID)
+    rank = higher / max(len(IP_TO_ID), 1)
+    return ELECTION_BACKOFF * (rank + random.random()) / 2
+
+
+async def run_election():
+    announced = LEADER_TERM
+    with TRACE.span("election_backoff") as span:
+        await asyncio.sleep(election_backoff())
+        span["skipped"] = LEADER_TERM > announced
+    if LEADER_TERM > announced:
+        log.debug("Leader announced during the election backoff, skipping")
+        ELECTION_TRIGGERS.labels("announced").inc()
+        return
+    ELECTION_TRIGGERS.labels("started").inc()
+    log.debug("Starting general election, ELECTION_TYPE %s", ELECTION_TYPE)
+    with TRACE.span("election", election_type=ELECTION_TYPE) as span:
+        if ELECTION_TYPE == "normal":
+            await leader_election()
+        elif ELECTION_TYPE == "improved":
+            await improved_leader_election()
+        elif ELECTION_TYPE == "ring":
+            await ring_leader_election()
+        else:
+            log.warning("Not recognized ELECTION_TYPE, defaulting to normal")
+            await leader_election()
+        span.update(election_id=ELECTION_ID, term=ELECTION_TERM, leader=leader["id"])
+
+
+# GET /pod_id, the bare ID unless a newer version of the reply is asked for
 async def pod_id(request):
+    if request.query.get("v") == str(POD_ID_VERSION):
+        return web.json_response(pod_id_body())
     return web.json_response(POD_ID)
 
 
+# GET /metrics, with the counters and histograms of the HTTP workers added
+async def metrics(request):
+    snapshots = await worker_snapshots() if WORKER_PROCESSES else ()
+    body = METRICS.render(snapshots).encode()
+    return web.Response(body=body, headers={"Content-Type": CONTENT_TYPE})
+
+
+# GET /metrics on a worker's unix socket, read by the agent's /metrics
+async def metrics_snapshot(request):
+    return web.json_response(METRICS.snapshot())
+
+
+def worker_metrics_path(index):
+    """Unix socket a worker serves its metrics on, next to the shared state file"""
+    return f"{SHARED_STATE.path}.{index}.sock"
+
+
+async def worker_snapshots():
+    """Metrics snapshots of the HTTP workers, without the ones that do not answer"""
+
+    async def fetch(index):
+        connector = aiohttp.UnixConnector(path=worker_metrics_path(index))
+        async with ClientSession(
+            connector=connector, timeout=ClientTimeout(total=1)
+        ) as session:
+            async with session.get("http://worker/metrics") as resp:
+                return await resp.json()
+
+    results = await asyncio.gather(
+        *(fetch(index) for index in range(len(WORKER_PROCESSES))),
+        return_exceptions=True,
+    )
+    snapshots = []
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            log.warning("Metrics of worker %d unavailable: %r", index, result)
+        else:
+            snapshots.append(result)
+    return snapshots
+
+
+# GET /debug/labels
+async def label_stats(request):
+    return web.json_response(LABELS.stats())
+
+
+# GET /debug/trace
+async def trace(request):
+    return web.json_response(TRACE.dump())
+
+
+# GET /debug/profile?seconds=N&hz=200
+async def profile(request):
+    """Sample all threads for N seconds, returns collapsed stacks for flame graphs"""
+    global PROFILING
+    try:
+        seconds = float(request.query.get("seconds", "5"))
+        hz = float(request.query.get("hz", "200"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds and hz have to be numbers")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 0 < hz <= 1000:
+        raise web.HTTPBadRequest(
+            text=f"seconds has to be in (0, {PROFILE_MAX_SECONDS}], hz in (0, 1000]"
+        )
+    if PROFILING:
+        raise web.HTTPConflict(text="A profile is already running")
+    PROFILING = True
+    try:
+        counts = await asyncio.to_thread(sample_stacks, seconds, 1 / hz)
+    finally:
+        PROFILING = False
+    return web.Response(text=collapsed_text(counts))
+
+
+def cluster_view_body():
+    """Everything this pod knows about the cluster, for peers to sync from"""
+    peers = dict(IP_TO_ID)
+    peers[POD_IP] = POD_ID
+    return {"version": PEERS.generation, "id": POD_ID, "leader": leader, "peers": peers}
+
+
+def on_election(data=None):
+    """
+    A lower pod holds an election, this one answers OK and holds its own.
+    Returns (status, body), 409 with this pod's term for a stale term
+    """
+    global TERM
+    term = data.get("term") if isinstance(data, dict) else None
+    if isinstance(data, dict):
+        TRACE.instant(
+            "receive_election",
+            candidate=data.get("id"),
+            election_id=data.get("election_id"),
+            term=term,
+        )
+    if term is not None:
+        if term <= ELECTION_TERM:
+            # This pod already held an election in that term or a later one
+            ELECTION_TRIGGERS.labels("covered").inc()
+            return 409, {"term": TERM}
+        TERM = max(TERM, term)
+    if ELECTION_TYPE == "normal":
+        create_task(general_election())
+    return 200, "OK"
+
+
+def on_ring_election(data):
+    """Returns (status, body), 409 with this pod's term for a stale candidate"""
+    global TERM
+    candidate = int(data["candidate"])
+    hops = int(data.get("hops", 0))
+    term = int(data.get("term", TERM))
+    election = {"election_id": data.get("election_id"), "term": term}
+    TRACE.instant("receive_ring", candidate=candidate, hops=hops, **election)
+    if term < TERM:
+        log.debug("Dropping ring candidate %s of stale term %d", candidate, term)
+        return 409, {"term": TERM}
+    TERM = term
+    log.debug(
+        "Ring candidate %s, hop %d, forwarded %s",
+        candidate,
+        hops,
+        ring_forwarded(),
+        extra=election,
+    )
+    if candidate == POD_ID:
+        # Unless a coordinator or a higher candidate came by since it was sent
+        if RING_SEEN is not None and RING_SEEN[:2] == (term, POD_ID):
+            create_task(win_ring_election(election))
+    elif hops > 2 * (len(IP_LIST) + 1):
+        # Went round the ring without finding the candidate, it is gone. Pods
+        # may not agree on the ring yet, hence the slack
+        log.info("Dropping ring candidate %s after %d hops", candidate, hops)
+    elif candidate > POD_ID:
+        if candidate > ring_forwarded():
+            create_task(forward_ring(candidate, hops + 1, election))
+    elif ring_forwarded() < POD_ID:
+        # This pod's own candidacy starts here
+        create_task(forward_ring(POD_ID, 1, election))
+    return 200, "OK"
+
+
+async def on_coordinator(data):
+    """
+    Follow the announced leader unless the announcement is stale: from an older
+    term, or the same term with a lower leader. A lower pod than this one is not
+    followed either, this pod holds its own election instead, as in the bully
+    algorithm. Rejections are 409 with this pod's term
+    """
+    global RING_SEEN, TERM
+    try:
+        leader_id = data.get("id", POD_ID)
+        # Pods without terms are followed as before
+        term = data.get("term", LEADER_TERM)
+        TRACE.instant(
+            "receive_coordinator",
+            leader=leader_id,
+            term=term,
+            election_id=data.get("election_id"),
+        )
+        if (term, leader_id) < (LEADER_TERM, leader["id"]):
+            log.info("Rejecting stale coordinator %s of term %s", leader_id, term)
+            TRACE.instant("coordinator_rejected", leader=leader_id, reason="stale")
+            return 409, {"term": TERM}
+        TERM = max(TERM, term)
+        if leader_id < POD_ID:
+            log.info("Rejecting coordinator %s, lower than this pod", leader_id)
+            TRACE.instant("coordinator_rejected", leader=leader_id, reason="lower")
+            create_task(general_election())
+            return 409, {"term": TERM}
+
+        # The ring election, if any, is over
+        RING_SEEN = None
+        was_leader = leader["id"] == POD_ID
+
+        set_leader(leader_id, data.get("url", POD_IP), term)
+        # The sender waits for this pod's subtree, relay before anything else
+        missed = await relay_coordinator(data) if data.get("relay") else None
+
+        if leader["id"] == POD_ID:
+            # An improved election found this pod and announced it
+            await label_self_as_leader()
+        elif was_leader:
+            schedule_step_down()
+        else:
+            await remove_leader_label()
+
+        if missed is not None:
+            return 200, {"missed": missed}
+        return 200, "OK"
+    except Exception as e:
+        log.warning("Error in receive_coordinator: %r", e)
+        return 500, "Error"
+
+
+# GET /cluster_view
+async def cluster_view(request):
+    return web.json_response(cluster_view_body())
+
+
+async def on_probe(data):
+    """Probe a peer for another pod (SWIM indirect probe), returns (status, body)"""
+    target = str(data["target"])
+    if target not in IP_LIST:
+        # Only peers, this port may be reachable from outside the cluster
+        return 400, "Unknown target"
+    answer = await fetch_pod_id(target)
+    if answer is None:
+        return 504, "No answer"
+    return 200, answer
+
+
+# POST /probe
+async def indirect_probe(request):
+    try:
+        status, body = await on_probe(await request.json())
+    except (ValueError, KeyError, TypeError):
+        return web.Response(status=400, text="Bad target")
+    return web.json_response(body, status=status)
+
+
 # POST /receive_answer
 async def receive_answer(request):
     return web.json_response("OK")
@@ -327,64 +1648,619 @@ async def receive_answer(request):
 
 # POST /receive_election
 async def receive_election(request):
-    if ELECTION_TYPE == "normal":
-        asyncio.create_task(leader_election())
-    return web.json_response("OK")
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    status, body = on_election(data)
+    return web.json_response(body, status=status)
+
+
+# POST /ring_election
+async def ring_election(request):
+    try:
+        status, body = on_ring_election(await request.json())
+    except (ValueError, KeyError, TypeError):
+        return web.json_response("Bad candidate", status=400)
+    return web.json_response(body, status=status)
 
 
 # POST /receive_coordinator
 async def receive_coordinator(request):
-    global IS_READY
     try:
         data = await request.json()
+    except ValueError:
+        data = None
+    status, body = await on_coordinator(data)
+    return web.json_response(body, status=status)
 
-        was_leader = leader["id"] == POD_ID
 
-        leader["id"] = data.get("id", POD_ID)
-        leader["url"] = data.get("url", POD_IP)
-        await remove_leader_label()
+# The same messages over a mesh link, see mesh.py
+async def mesh_pod_id(body):
+    if isinstance(body, dict) and str(body.get("v")) == str(POD_ID_VERSION):
+        return 200, pod_id_body()
+    return 200, POD_ID
 
-        if was_leader and leader["id"] != POD_ID:
-            print(f"Stepping down: Marking as not ready immediately")
-            IS_READY = False  # Fail readiness checks immediately
-            asyncio.get_event_loop().call_later(1, lambda: os._exit(0))
 
-        return web.json_response("OK")
-    except Exception as e:
-        print(f"Error in recieve_coordinator: {e}")
-        return web.json_response("Error", status=500)
+async def mesh_cluster_view(body):
+    return 200, cluster_view_body()
+
+
+async def mesh_receive_answer(body):
+    return 200, "OK"
+
+
+async def mesh_receive_election(body):
+    return on_election(body)
+
+
+async def mesh_probe(body):
+    try:
+        return await on_probe(body)
+    except (KeyError, TypeError):
+        return 400, "Bad target"
+
+
+async def mesh_ring_election(body):
+    try:
+        return on_ring_election(body)
+    except (ValueError, KeyError, TypeError):
+        return 400, "Bad candidate"
+
+
+MESH_HANDLERS = {
+    "/pod_id": mesh_pod_id,
+    "/cluster_view": mesh_cluster_view,
+    "/receive_answer": mesh_receive_answer,
+    "/receive_election": mesh_receive_election,
+    "/receive_coordinator": on_coordinator,
+    "/ring_election": mesh_ring_election,
+    "/probe": mesh_probe,
+}
+
+
+# GET /mesh, served whatever PEER_TRANSPORT this pod uses itself
+async def mesh_link(request):
+    return await MESH.handle(request)
 
 
 async def get_cookie(request):
-    cookie = random.choice(cookiesList)
-    cookie += " Pod ID: " + str(POD_ID) + " and leader is: " + str(leader["id"])
-    return web.json_response(cookie)
+    # Every answer counts, also refusals and the ones forwarded to the leader
+    start = time.perf_counter()
+    try:
+        return await route_cookie(request)
+    finally:
+        COOKIE_SECONDS.observe(time.perf_counter() - start)
+
+
+async def route_cookie(request):
+    if WORKER:
+        # Written by the election agent, reading it is a few struct unpacks
+        view = SHARED_STATE.read()
+        leader_id, leader_url = view.leader_id, view.leader_url
+        stepping_down = view.stepping_down
+    else:
+        leader_id, leader_url, stepping_down = (
+            leader["id"],
+            leader["url"],
+            STEPPING_DOWN,
+        )
+    if stepping_down and COOKIE_ROUTING == "leader":
+        # Send the client back through the Service to the new leader
+        return web.Response(
+            status=503,
+            text="Stepping down",
+            headers={"Connection": "close", "Retry-After": "1"},
+        )
+    if (
+        COOKIE_ROUTING == "proxy"
+        and leader_id != POD_ID
+        and FORWARDED_HEADER not in request.headers
+    ):
+        return await proxy_cookie(leader_id, leader_url)
+    return serve_cookie(leader_id)
+
+
+def serve_cookie(leader_id):
+    response = web.Response(
+        body=cookie_fragment() + cookie_suffix(leader_id),
+        content_type="application/json",
+        charset="utf-8",
+    )
+    if leader_id != POD_ID and COOKIE_ROUTING == "leader":
+        # No keep-alive on followers, so clients cannot stick to a former leader
+        response.force_close()
+    COOKIE_ROUTES.labels("local").inc()
+    return response
+
+
+def cookie_fragment():
+    """A random cookie as the start of a JSON string, without the closing quote"""
+    # cookiesList until the fortune file is loaded, or if it is empty
+    if FORTUNES:
+        return json.dumps(FORTUNES.choice())[:-1].encode()
+    return random.choice(COOKIE_FRAGMENTS)
+
+
+def cookie_suffix(leader_id):
+    """The end of the cookie JSON string, built once per leader"""
+    key = (POD_ID, leader_id)
+    suffix = COOKIE_SUFFIXES.get(key)
+    if suffix is None:
+        suffix = f' Pod ID: {POD_ID} and leader is: {leader_id}"'.encode()
+        COOKIE_SUFFIXES.clear()
+        COOKIE_SUFFIXES[key] = suffix
+    return suffix
+
+
+async def proxy_cookie(leader_id, leader_url):
+    """Forward /get_cookie to the leader over a kept-alive connection"""
+    if leader_id == -1 or not leader_url:
+        COOKIE_ROUTES.labels("unavailable").inc()
+        return web.Response(status=503, text="No leader", headers={"Retry-After": "1"})
+    url = f"http://{leader_url}:{WEB_PORT}/get_cookie"
+    start = time.perf_counter()
+    try:
+        async with proxy_session().get(
+            url, headers={FORWARDED_HEADER: str(POD_ID)}
+        ) as resp:
+            body = await resp.read()
+            COOKIE_ROUTES.labels("proxied").inc()
+            return web.Response(
+                status=resp.status,
+                body=body,
+                content_type=resp.content_type,
+                charset=resp.charset,
+            )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.warning(
+            "Forwarding /get_cookie to leader %s failed: %r",
+            leader_url,
+            e,
+            extra={"key": ("proxy", leader_url)},
+        )
+        COOKIE_ROUTES.labels("unavailable").inc()
+        return web.Response(
+            status=503, text="Leader unreachable", headers={"Retry-After": "1"}
+        )
+    finally:
+        PROXY_SECONDS.observe(time.perf_counter() - start)
+
+
+def schedule_step_down():
+    """Give up leadership, in-process or by restarting (STEP_DOWN_MODE=restart)"""
+    global IS_READY, STEP_DOWN_TASK
+    if STEP_DOWN_MODE == "restart":
+        log.info("Stepping down: restarting to break sticky connections")
+        LABELS.set(None)
+        IS_READY = False  # Fail readiness checks immediately
+        publish_state()
+        asyncio.get_event_loop().call_later(1, lambda: os._exit(0))
+    elif STEP_DOWN_TASK is None or STEP_DOWN_TASK.done():
+        STEP_DOWN_TASK = asyncio.create_task(step_down())
+
+
+async def step_down():
+    """
+    Hand over to the new leader without restarting: refuse new user requests, let
+    the ones in flight finish within STEP_DOWN_DRAIN_TIMEOUT, drop the label and
+    close kept-alive connections so clients reconnect through the Service
+    """
+    global STEPPING_DOWN
+    log.info("Stepping down: draining user requests")
+    start = time.monotonic()
+    STEPPING_DOWN = True
+    publish_state()
+    TRACE.instant("step_down", leader=leader["id"], term=LEADER_TERM)
+    try:
+        await remove_leader_label()
+        deadline = start + STEP_DOWN_DRAIN_TIMEOUT
+        if WORKER_PROCESSES:
+            # The workers drain their own requests, keep the flag up until
+            # every one of them has read it
+            await asyncio.sleep(5 * SHARED_STATE_POLL)
+        # Counted by the admission middleware, from arrival to response
+        while INFLIGHT["user"] > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        close_connections()
+    finally:
+        STEPPING_DOWN = False
+        publish_state()
+    log.info(
+        "Stepped down in %.3fs, %d requests still in flight",
+        time.monotonic() - start,
+        INFLIGHT["user"],
+    )
+
+
+def close_connections(grace=0.1):
+    """Close the kept-alive client connections of this process, not the peers' links"""
+    if RUNNER is not None:
+        links = MESH.transports() if MESH is not None else set()
+        closing = [
+            connection
+            for connection in RUNNER.server.connections
+            if connection.transport not in links
+            and listener_port(connection.transport) != CONTROL_PORT
+        ]
+        for connection in closing:
+            connection.close()
+
+        # close() lets a request in progress finish, but leaves an idle connection
+        # open without reading from it, so a peer reusing it would wait for its
+        # timeout. Like aiohttp's own shutdown, force close what is left
+        def force_close():
+            for connection in closing:
+                connection.force_close()
+
+        asyncio.get_running_loop().call_later(grace, force_close)
+
+
+async def label_reconciler(app):
+    global POD_PATCHER
+    if PodPatcher.in_cluster():
+        POD_PATCHER = PodPatcher(namespace)
+    LABELS.start()
+    yield
+    await LABELS.stop()
+    if POD_PATCHER is not None:
+        await POD_PATCHER.close()
+
+
+async def peer_client(app):
+    global MESH
+    peer_session()
+    MESH = PeerMesh(
+        POD_IP,
+        CONTROL_PORT,
+        MESH_HANDLERS,
+        peer_session,
+        on_close=mesh_link_closed,
+        heartbeat=MESH_HEARTBEAT,
+    )
+    yield
+    await MESH.close()
+    MESH = None
+    await close_peer_session()
+
+
+async def fortune_reloader(app):
+    # Loaded in the background, so a big file does not hold up listening
+    task = None
+    if FORTUNES is not None:
+        task = asyncio.create_task(FORTUNES.watch())
+    yield
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        FORTUNES.close()
+
+
+async def proxy_client(app):
+    yield
+    await close_proxy_session()
+
+
+async def close_mesh(app):
+    # Before the server waits for its handlers, which the open links would hold up
+    if MESH is not None:
+        await MESH.close()
 
 
 async def background_tasks(app):
-    task = asyncio.create_task(heartbeat())
+    tasks = [asyncio.create_task(heartbeat())]
+    if MEMBERSHIP_MODE == "watch":
+        tasks.append(asyncio.create_task(watch_endpoints()))
     yield
-    task.cancel()
-    await task
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def request_plane(path):
+    """Traffic class of a path: user pages and cookies, control, or None for probes"""
+    if path == "/" or path == "/get_cookie" or path.startswith("/static/"):
+        return "user"
+    if path == "/readiness":
+        return None
+    return "control"
+
+
+def listener_port(transport):
+    """Local port a connection came in on, None if unknown (or split ports are off)"""
+    if CONTROL_PORT == WEB_PORT or transport is None:
+        return None
+    sockname = transport.get_extra_info("sockname")
+    return sockname[1] if sockname else None
+
+
+def shed(plane, reason):
+    SHED_REQUESTS.labels(plane, reason).inc()
+    return web.Response(status=503, text="Overloaded", headers={"Retry-After": "1"})
+
+
+@web.middleware
+async def admission(request, handler):
+    plane = request_plane(request.path)
+    if plane is None:
+        return await handler(request)
+    port = listener_port(request.transport)
+    if port is not None and port != (WEB_PORT if plane == "user" else CONTROL_PORT):
+        raise web.HTTPNotFound()
+    if request.path == "/mesh":
+        # A peer's link stays open as long as both pods run, it is no request
+        # in flight and must not hold a control slot
+        return await handler(request)
+    if plane == "user":
+        if USER_MAX_INFLIGHT and INFLIGHT["user"] >= USER_MAX_INFLIGHT:
+            return shed(plane, "inflight")
+        if USER_SHED_LAG and LOOP_LAG > USER_SHED_LAG:
+            return shed(plane, "loop_lag")
+    elif CONTROL_MAX_INFLIGHT and INFLIGHT["control"] >= CONTROL_MAX_INFLIGHT:
+        return shed(plane, "inflight")
+    INFLIGHT[plane] += 1
+    try:
+        return await handler(request)
+    finally:
+        INFLIGHT[plane] -= 1
+
+
+async def watch_loop_lag(watchdog=None):
+    """Sample how late the event loop runs a timer, the wait every request sees"""
+    global LOOP_LAG
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(LOOP_LAG)
+        if watchdog is not None:
+            watchdog.tick()
+        throttle_user_connections()
+
+
+def throttle_user_connections():
+    """
+    A 503 costs about as much loop time as a cookie, so shedding alone cannot keep
+    a flood from delaying probes. While the loop lags, stop reading from the user
+    connections on WEB_PORT, they wait in the kernel and the control port is
+    served first. Needs CONTROL_PORT != WEB_PORT to tell the connections apart
+    """
+    if RUNNER is None or CONTROL_PORT == WEB_PORT or not USER_SHED_LAG:
+        return
+    if LOOP_LAG > USER_SHED_LAG:
+        for connection in RUNNER.server.connections:
+            if connection not in THROTTLED and (
+                listener_port(connection.transport) == WEB_PORT
+            ):
+                connection.pause_reading()
+                THROTTLED.add(connection)
+    elif LOOP_LAG < USER_SHED_LAG / 2 and THROTTLED:
+        for connection in THROTTLED:
+            connection.resume_reading()
+        THROTTLED.clear()
+
+
+async def loop_monitor(app):
+    task = watchdog = None
+    if LOOP_LAG_INTERVAL:
+        if STALL_LOG_AFTER:
+            watchdog = StallWatchdog(STALL_LOG_AFTER)
+            watchdog.start()
+        task = asyncio.create_task(watch_loop_lag(watchdog))
+    yield
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    if watchdog is not None:
+        watchdog.stop()
 
 
 async def homepage(request):
-    return web.Response(text=frontpage_html, content_type="text/html")
+    return HOMEPAGE.response(request)
 
 
 static_dir = pathlib.Path(__file__).resolve().parent / "static"
+# Encoded once, served with ETags. The page is checked again on every visit, the
+# assets it links to are cached for STATIC_MAX_AGE
+HOMEPAGE = EncodedAsset(frontpage_html.encode(), "text/html; charset=utf-8", "no-cache")
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "86400"))
+STATIC = StaticAssets(static_dir, f"public, max-age={STATIC_MAX_AGE}")
 
-if __name__ == "__main__":
-    init_kubernetes()
-    app = web.Application()
+
+def create_app():
+    app = web.Application(middlewares=[admission])
     app.router.add_get("/", homepage)
-    app.router.add_static("/static/", path=str(static_dir), name="static")
+    app.router.add_get("/static/{name:.+}", STATIC.handle, name="static")
 
     app.router.add_get("/pod_id", pod_id)
+    app.router.add_get("/cluster_view", cluster_view)
+    app.router.add_get("/debug/labels", label_stats)
+    app.router.add_get("/debug/profile", profile)
+    app.router.add_get("/debug/trace", trace)
+    app.router.add_get("/metrics", metrics)
     app.router.add_get("/readiness", readiness_check)
     app.router.add_get("/get_cookie", get_cookie)
     app.router.add_post("/receive_answer", receive_answer)
     app.router.add_post("/receive_election", receive_election)
     app.router.add_post("/receive_coordinator", receive_coordinator)
+    app.router.add_post("/ring_election", ring_election)
+    app.router.add_post("/probe", indirect_probe)
+    app.router.add_get("/mesh", mesh_link)
+    app.on_shutdown.append(close_mesh)
+    app.cleanup_ctx.append(loop_monitor)
+    app.cleanup_ctx.append(peer_client)
+    app.cleanup_ctx.append(fortune_reloader)
+    app.cleanup_ctx.append(proxy_client)
+    app.cleanup_ctx.append(label_reconciler)
     app.cleanup_ctx.append(background_tasks)
-    web.run_app(app, host="0.0.0.0", port=WEB_PORT)
+    return app
+
+
+async def serve(app):
+    """Like web.run_app, but keeps the runner around so step-down can reach its connections"""
+    global RUNNER
+    RUNNER = web.AppRunner(app, access_log=None)
+    await RUNNER.setup()
+    # With workers, WEB_PORT belongs to them and this process only takes peer traffic
+    ports = [CONTROL_PORT] if WORKER_PROCESSES else sorted({WEB_PORT, CONTROL_PORT})
+    for port in ports:
+        await web.TCPSite(RUNNER, host="0.0.0.0", port=port).start()
+    log.info("Serving on ports %s", ports)
+    startup_phase("listen")
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    supervisor = create_task(watch_workers(stop))
+    try:
+        await stop.wait()
+    finally:
+        supervisor.cancel()
+        await RUNNER.cleanup()
+        RUNNER = None
+
+
+def create_worker_app():
+    """User facing routes only, the worker has no election state of its own"""
+    app = web.Application(middlewares=[admission])
+    app.router.add_get("/", homepage)
+    app.router.add_get("/static/{name:.+}", STATIC.handle, name="static")
+    app.router.add_get("/readiness", readiness_check)
+    app.router.add_get("/get_cookie", get_cookie)
+    app.cleanup_ctx.append(loop_monitor)
+    app.cleanup_ctx.append(fortune_reloader)
+    app.cleanup_ctx.append(proxy_client)
+    return app
+
+
+async def watch_shared_state(stop, interval=SHARED_STATE_POLL):
+    """
+    Worker side of a step-down: once the agent sets stepping_down, let this worker's
+    requests finish and close its kept-alive connections. Stops if the agent is gone
+    """
+    agent = os.getppid()
+    stepping_down = False
+    while not stop.is_set():
+        if os.getppid() != agent:
+            log.error("Election agent exited, stopping worker")
+            stop.set()
+            return
+        view = SHARED_STATE.read()
+        if view.stepping_down and not stepping_down:
+            deadline = time.monotonic() + STEP_DOWN_DRAIN_TIMEOUT
+            while INFLIGHT["user"] > 0 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            close_connections()
+        stepping_down = view.stepping_down
+        await asyncio.sleep(interval)
+
+
+async def serve_worker(index):
+    global RUNNER
+    RUNNER = web.AppRunner(create_worker_app(), access_log=None)
+    await RUNNER.setup()
+    await web.TCPSite(RUNNER, host="0.0.0.0", port=WEB_PORT, reuse_port=True).start()
+    # Metrics go to the agent over a socket of this worker's own, WEB_PORT is
+    # shared and a scrape there would reach any one of the workers
+    metrics_app = web.Application()
+    metrics_app.router.add_get("/metrics", metrics_snapshot)
+    metrics_runner = web.AppRunner(metrics_app, access_log=None)
+    await metrics_runner.setup()
+    await web.UnixSite(metrics_runner, worker_metrics_path(index)).start()
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    watcher = create_task(watch_shared_state(stop))
+    try:
+        await stop.wait()
+    finally:
+        watcher.cancel()
+        await metrics_runner.cleanup()
+        await RUNNER.cleanup()
+        RUNNER = None
+
+
+def run_worker(index, state_path):
+    global SHARED_STATE, WORKER
+    WORKER = True
+    SHARED_STATE = SharedState.open(state_path)
+    listener = setup_logging(
+        context=lambda: {"pod_id": POD_ID, "worker": index},
+        level=LOG_LEVEL,
+        fmt=LOG_FORMAT,
+        rate=LOG_RATE,
+        burst=LOG_BURST,
+        use_queue=LOG_QUEUE,
+    )
+    try:
+        asyncio.run(serve_worker(index))
+    finally:
+        if listener is not None:
+            listener.stop()
+
+
+def start_workers():
+    """Fork the HTTP workers, before this process starts any thread or event loop"""
+    global SHARED_STATE
+    SHARED_STATE = SharedState.create()
+    context = multiprocessing.get_context("fork")
+    for index in range(WORKERS):
+        process = context.Process(
+            target=run_worker,
+            args=(index, SHARED_STATE.path),
+            name=f"worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        WORKER_PROCESSES.append(process)
+
+
+def stop_workers():
+    for process in WORKER_PROCESSES:
+        process.terminate()
+    for process in WORKER_PROCESSES:
+        process.join(5)
+    if SHARED_STATE is not None:
+        for index in range(len(WORKER_PROCESSES)):
+            pathlib.Path(worker_metrics_path(index)).unlink(missing_ok=True)
+        SHARED_STATE.close(unlink=True)
+    WORKER_PROCESSES.clear()
+
+
+async def watch_workers(stop):
+    """A dead worker takes the pod down, so Kubernetes restarts it as a whole"""
+    while WORKER_PROCESSES:
+        for process in WORKER_PROCESSES:
+            if not process.is_alive():
+                log.error("%s exited with %s", process.name, process.exitcode)
+                stop.set()
+                return
+        await asyncio.sleep(1)
+
+
+def log_context():
+    return {"pod_id": POD_ID, "leader": leader["id"]}
+
+
+if __name__ == "__main__":
+    startup_phase("import")
+    if WORKERS > 1:
+        if CONTROL_PORT == WEB_PORT:
+            raise SystemExit("WORKERS > 1 needs a CONTROL_PORT other than WEB_PORT")
+        start_workers()
+    listener = setup_logging(
+        context=log_context,
+        level=LOG_LEVEL,
+        fmt=LOG_FORMAT,
+        rate=LOG_RATE,
+        burst=LOG_BURST,
+        use_queue=LOG_QUEUE,
+    )
+    try:
+        if K8S_INIT == "eager":
+            init_kubernetes()
+        asyncio.run(serve(create_app()))
+    finally:
+        stop_workers()
+        if listener is not None:
+            listener.stop()
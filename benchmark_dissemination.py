@@ -0,0 +1,120 @@
+"""
+Coordinator dissemination: flat broadcast vs. a tree of relays.
+
+Starts a simulated cluster (simulator.py) per cluster size and
+COORDINATOR_FANOUT, waits until it agrees on a leader and has the leader
+announce itself again with a new term. Reports the time until the last node
+followed the announcement, the time until the leader had every acknowledgement
+(including the retries), the most coordinator requests one pod had in flight,
+which is about the sockets it opened at once, and the nodes never reached.
+`--drop` makes that share of the nodes lose the first coordinator message
+they are sent, so relays fail and the leader has to retry.
+
+    python benchmark_dissemination.py --nodes 50 100 --fanouts 0 4 8 --drop 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import time
+
+import simulator
+
+
+async def measure(nodes, fanout, args):
+    env = {
+        "WEB_PORT": str(args.port),
+        "ELECTION_TYPE": "normal",
+        "HEARTBEAT_INTERVAL": str(args.time_scale),
+        "PEER_KEEPALIVE": str(2 * args.time_scale),
+        "LOOP_LAG_INTERVAL": "0",
+        "COORDINATOR_FANOUT": str(fanout),
+    }
+    cluster = simulator.Cluster(nodes, args.port, env, args.seed, args.time_scale)
+    try:
+        await cluster.start()
+        took, _ = await cluster.wait_converged(args.timeout)
+        if took is None:
+            return None
+        # Let the elections of the startup die down
+        await asyncio.sleep(args.settle)
+        leader = max(cluster.nodes, key=lambda node: node.pod_id)
+        term = max(node.module.LEADER_TERM for node in cluster.nodes) + 1
+
+        informed = {}
+        for node in cluster.nodes:
+            node.module.set_leader = informer(node, term, informed)
+            node.peak_inflight = {}
+        followers = [node for node in cluster.nodes if node is not leader]
+        rng = random.Random(args.seed)
+        for node in rng.sample(followers, int(len(followers) * args.drop)):
+            cluster.drops[(node.ip, "/receive_coordinator")] = 1
+
+        start = time.monotonic()
+        await leader.module.send_coordinator(term=term)
+        acked = time.monotonic() - start
+        reached = [informed[node.ip] for node in followers if node.ip in informed]
+        return {
+            "informed_s": max(reached, default=start) - start,
+            "acked_s": acked,
+            "peak": cluster.peak_inflight().get("/receive_coordinator", 0),
+            "missed": len(followers) - len(reached),
+        }
+    finally:
+        await cluster.stop()
+
+
+def informer(node, term, informed):
+    """Wrap a node's set_leader to note when it followed the announcement"""
+    set_leader = node.module.set_leader
+
+    def record(leader_id, leader_url, new_term=None):
+        if new_term == term and node.ip not in informed:
+            informed[node.ip] = time.monotonic()
+        set_leader(leader_id, leader_url, new_term)
+
+    return record
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[50, 100])
+    parser.add_argument("--fanouts", type=int, nargs="+", default=[0, 4, 8])
+    parser.add_argument("--drop", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--time-scale", type=float, default=2.0)
+    parser.add_argument("--settle", type=float, default=10)
+    args = parser.parse_args()
+    logging.getLogger().addHandler(logging.NullHandler())
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(
+        f"{'nodes':>5} {'fanout':>6} {'informed s':>10} {'acked s':>8}"
+        f" {'peak in flight':>14} {'missed':>6}"
+    )
+    for nodes in args.nodes:
+        for fanout in args.fanouts:
+            saved = dict(os.environ)
+            try:
+                result = await measure(nodes, fanout, args)
+            finally:
+                os.environ.clear()
+                os.environ.update(saved)
+            if result is None:
+                print(f"{nodes:>5} {fanout:>6} cluster did not converge")
+                continue
+            print(
+                f"{nodes:>5} {fanout:>6} {result['informed_s']:>10.3f}"
+                f" {result['acked_s']:>8.3f} {result['peak']:>14}"
+                f" {result['missed']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Message count and convergence time of the election algorithms.
+
+Runs simulator.py once per ELECTION_TYPE and cluster size, each in its own
+process, and prints the startup and the kill-leader numbers side by side.
+Elections are started by every pod that notices the dead leader, so this is
+close to the worst case for the bully elections.
+
+    python benchmark_elections.py --nodes 10 30 50 --election-types normal improved ring
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulator.py")
+
+
+def run(election_type, nodes, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [sys.executable, SIMULATOR, "--nodes", str(nodes)]
+    command += ["--election-type", election_type, "--scenario", args.scenario]
+    command += ["--timeout", str(args.timeout), "--seed", str(args.seed)]
+    command += ["--port", str(args.port), "--time-scale", str(args.time_scale)]
+    command += ["--output", output]
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    with open(output) as f:
+        result = json.load(f)
+    os.unlink(output)
+    return result
+
+
+def seconds(value):
+    return "timeout" if value is None else f"{value:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10, 30])
+    parser.add_argument(
+        "--election-types", nargs="+", default=["normal", "improved", "ring"]
+    )
+    parser.add_argument("--scenario", default="kill-leader")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="slower heartbeats and timeouts, for clusters too big for one event loop",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'nodes':>5} {'type':>8} {'start s':>8} {'start msgs':>10}"
+        f" {'failover s':>10} {'election msgs':>13} {'total msgs':>10} {'wrong':>5}"
+    )
+    for nodes in args.nodes:
+        for election_type in args.election_types:
+            result = run(election_type, nodes, args)
+            messages = result.get("messages", {})
+            # Probes are the same for every type, count what the election sends
+            election = sum(
+                count for path, count in messages.items() if path != "/pod_id"
+            )
+            print(
+                f"{nodes:>5} {election_type:>8}"
+                f" {seconds(result['initial_convergence_s']):>8}"
+                f" {result['startup_messages']:>10}"
+                f" {seconds(result.get('time_to_new_leader_s')):>10}"
+                f" {election:>13} {result.get('messages_total', 0):>10}"
+                f" {result.get('nodes_with_wrong_leader', 0):>5}"
+            )
+
+
+if __name__ == "__main__":
+    main()
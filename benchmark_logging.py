@@ -0,0 +1,124 @@
+"""
+Event loop lag while logging into a slow stdout.
+
+Runs one child process per mode. Each child logs like a busy heartbeat (a line
+with a 100-peer IP_TO_ID every few ms) while a probe task measures how late
+the event loop wakes it up. The child's stdout is unbuffered (like the
+container, PYTHONUNBUFFERED=1) and goes into a pipe the parent only drains at
+--drain bytes per second, like a slow log collector.
+
+Modes:
+- off:    no log output, the baseline
+- print:  print() as app.py used to
+- sync:   logging with a plain StreamHandler, formatting and writing on the loop
+- queue:  logs.py without rate limiting, formatting and writing in a thread
+- limited: logs.py as deployed, rate limited per message key
+
+    python benchmark_logging.py --duration 5 --drain 65536
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import LatencyHistogram
+from logs import setup_logging
+
+MODES = ["off", "print", "sync", "queue", "limited"]
+PEERS = {f"10.0.{i // 250}.{i % 250 + 1}": 100000 + i for i in range(100)}
+
+
+async def probe_lag(histogram, stop_at, interval=0.001):
+    while time.perf_counter() < stop_at:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        histogram.record(time.perf_counter() - start - interval)
+
+
+async def workload(mode, stop_at, interval):
+    log = logging.getLogger("bully")
+    lines = 0
+    while time.perf_counter() < stop_at:
+        if mode == "print":
+            print("=" * 50)
+            print(PEERS)
+            print(f"Leader ID: 100099 | ID cache hits {lines} misses 0")
+        elif mode != "off":
+            log.info("Heartbeat done, leader %s, %d peers", 100099, len(PEERS))
+            log.info("Peers", extra={"peers": PEERS})
+            log.warning("Error communicating with pod %s: %r", "10.0.0.7", "Timeout")
+        lines += 3
+        await asyncio.sleep(interval)
+    return lines
+
+
+async def child(mode, duration, interval, output):
+    listener = None
+    if mode == "sync":
+        setup_logging(rate=0, use_queue=False)
+    elif mode == "queue":
+        listener = setup_logging(rate=0)
+    elif mode == "limited":
+        listener = setup_logging()
+
+    lag = LatencyHistogram()
+    stop_at = time.perf_counter() + duration
+    _, lines = await asyncio.gather(
+        probe_lag(lag, stop_at), workload(mode, stop_at, interval)
+    )
+    with open(output, "w") as f:
+        json.dump({"mode": mode, "lines": lines, "lag_ms": lag.summary_ms()}, f)
+    if listener is not None:
+        # Not part of the measurement, flushing the queue may take a while
+        listener.stop()
+
+
+def run_mode(mode, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [sys.executable, "-u", __file__, "--child", mode, "--output", output]
+    command += ["--duration", str(args.duration), "--interval", str(args.interval)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    chunk = max(1, args.drain // 100)
+    while process.stdout.read(chunk):
+        time.sleep(0.01)
+    process.wait()
+    with open(output) as f:
+        result = json.load(f)
+    os.unlink(output)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds")
+    parser.add_argument("--drain", type=int, default=65536, help="bytes/s read")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.child, args.duration, args.interval, args.output))
+        return
+
+    columns = ["p50", "p99", "p99.9", "max"]
+    print(f"{'mode':>8} {'lines':>7} " + " ".join(f"{c + ' ms':>9}" for c in columns))
+    for mode in args.modes:
+        result = run_mode(mode, args)
+        lag = result["lag_ms"]
+        print(
+            f"{mode:>8} {result['lines']:>7} "
+            + " ".join(f"{lag[c]:>9.2f}" for c in columns)
+        )
+
+
+if __name__ == "__main__":
+    main()
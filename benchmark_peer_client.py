@@ -0,0 +1,159 @@
+"""
+Benchmark of one heartbeat probe round against N local peers.
+
+Compares the old pattern (a fresh ClientSession per round) with the pooled
+peer session from app.py, and with the WebSocket mesh (PEER_TRANSPORT=ws)
+sending the probes as frames over one link per peer. Every fake peer listens on its own loopback address
+(127.0.0.2, 127.0.0.3, ...) on the same port, just like pods in the cluster.
+
+    python benchmark_peer_client.py --peers 5 --rounds 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from aiohttp import ClientSession, ClientTimeout, TraceConfig, web
+
+os.environ.setdefault("POD_NAME", "benchmark")
+os.environ.setdefault("POD_IP", "127.0.0.1")
+os.environ.setdefault("WEB_PORT", "18080")
+
+import app  # noqa: E402
+from mesh import PeerMesh  # noqa: E402
+
+
+async def start_peers(n, port):
+    runners = []
+    for i in range(n):
+
+        async def pod_id(request, i=i):
+            return web.json_response(i)
+
+        async def mesh_pod_id(body, i=i):
+            return 200, i
+
+        peer_mesh = PeerMesh(
+            f"127.0.0.{i + 2}", port, {"/pod_id": mesh_pod_id}, app.peer_session
+        )
+        peer_app = web.Application()
+        peer_app.router.add_get("/pod_id", pod_id)
+        peer_app.router.add_get("/mesh", peer_mesh.handle)
+        peer_app.on_shutdown.append(lambda _, peer_mesh=peer_mesh: peer_mesh.close())
+        runner = web.AppRunner(peer_app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, f"127.0.0.{i + 2}", port).start()
+        runners.append(runner)
+    return runners
+
+
+def connection_tracer(stats):
+    async def on_create(session, ctx, params):
+        stats["created"] += 1
+
+    async def on_reuse(session, ctx, params):
+        stats["reused"] += 1
+
+    trace = TraceConfig()
+    trace.on_connection_create_end.append(on_create)
+    trace.on_connection_reuseconn.append(on_reuse)
+    return trace
+
+
+async def round_fresh_session(ips, port, trace):
+    """The heartbeat round as it was: a new session and new sockets every time"""
+    async with ClientSession(
+        timeout=ClientTimeout(total=0.5), trace_configs=[trace]
+    ) as session:
+
+        async def probe(ip):
+            async with session.get(f"http://{ip}:{port}/pod_id") as resp:
+                return await resp.json()
+
+        return await asyncio.gather(*(probe(ip) for ip in ips))
+
+
+async def round_pooled_session(ips, port, trace):
+    async def probe(ip):
+        resp = await app.peer_request("GET", ip, "/pod_id", timeout=app.PROBE_TIMEOUT)
+        return await resp.json()
+
+    return await asyncio.gather(*(probe(ip) for ip in ips))
+
+
+async def run(mode, ips, port, rounds):
+    stats = {"created": 0, "reused": 0}
+    trace = connection_tracer(stats)
+    if mode == "fresh":
+        do_round = round_fresh_session
+    else:
+        await app.close_peer_session()
+        app.peer_session()._trace_configs.append(trace)
+        trace.freeze()
+        do_round = round_pooled_session
+    if mode == "mesh":
+        app.PEER_TRANSPORT = "ws"
+        app.MESH = PeerMesh(app.POD_IP, port, {}, app.peer_session)
+        # Open the links before measuring, like a running pod has them
+        await do_round(ips, port, trace)
+
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await do_round(ips, port, trace)
+        latencies.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu_start
+
+    if mode == "mesh":
+        await app.MESH.close()
+        app.MESH = None
+        app.PEER_TRANSPORT = "http"
+    if mode != "fresh":
+        await app.close_peer_session()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        # Both ends run in this process, so this is the CPU of client and peers
+        "cpu_ms_per_round": cpu / rounds * 1000,
+        "sockets_opened": stats["created"],
+        "sockets_reused": stats["reused"],
+        "sockets_per_round": stats["created"] / rounds,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--peers", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--port", type=int, default=int(os.environ["WEB_PORT"]))
+    args = parser.parse_args()
+
+    app.WEB_PORT = app.CONTROL_PORT = args.port
+    runners = await start_peers(args.peers, args.port)
+    ips = [f"127.0.0.{i + 2}" for i in range(args.peers)]
+    try:
+        print(f"{args.peers} peers, {args.rounds} heartbeat rounds")
+        for mode in ("fresh", "pooled", "mesh"):
+            result = await run(mode, ips, args.port, args.rounds)
+            print(
+                f"[{result['mode']:>6}] mean {result['mean_ms']:.2f}ms"
+                f" | p50 {result['p50_ms']:.2f}ms | p95 {result['p95_ms']:.2f}ms"
+                f" | cpu {result['cpu_ms_per_round']:.2f}ms/round"
+                f" | sockets opened {result['sockets_opened']}"
+                f" ({result['sockets_per_round']:.2f}/round)"
+                f" | reused {result['sockets_reused']}"
+            )
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""
+CPU and bytes per request of the front end responses.
+
+Serves `/`, `/static/yoda.png` and `/get_cookie` from app.py and, for
+comparison, the way they were served before the pre-encoded responses: the page
+as a new text response per hit, the image through aiohttp's static route and the
+cookie through json_response. The server runs in its own process and only its
+CPU time is counted (in clock ticks, so use enough requests). A pooled client
+requests each path in a loop, like a browser that accepts gzip and revalidates
+with If-None-Match when it has an ETag.
+
+    python benchmark_responses.py --requests 2000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+
+from aiohttp import ClientSession, web
+
+os.environ.setdefault("POD_NAME", "benchmark")
+os.environ.setdefault("POD_IP", "127.0.0.1")
+os.environ.setdefault("WEB_PORT", "18080")
+
+import app  # noqa: E402
+from frontend import frontpage_html  # noqa: E402
+
+PATHS = ["/", "/static/yoda.png", "/get_cookie"]
+
+
+def old_app():
+    async def homepage(request):
+        return web.Response(text=frontpage_html, content_type="text/html")
+
+    async def get_cookie(request):
+        cookie = random.choice(app.cookiesList)
+        cookie += " Pod ID: " + str(app.POD_ID) + " and leader is: " + str(app.POD_ID)
+        return web.json_response(cookie)
+
+    old = web.Application()
+    old.router.add_get("/", homepage)
+    old.router.add_static("/static/", path=str(app.static_dir))
+    old.router.add_get("/get_cookie", get_cookie)
+    return old
+
+
+def new_app():
+    new = web.Application()
+    new.router.add_get("/", app.homepage)
+    new.router.add_get("/static/{name:.+}", app.STATIC.handle)
+    new.router.add_get("/get_cookie", app.get_cookie)
+    return new
+
+
+def serve(factory, port, ready):
+    async def run():
+        runner = web.AppRunner(factory(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def cpu_seconds(pid):
+    """User plus system time of a process, from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def measure(factory, port, path, requests, revalidate):
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(factory, port, ready))
+    server.start()
+    ready.wait(10)
+    url = f"http://127.0.0.1:{port}{path}"
+    received = 0
+    etag = None
+    try:
+        async with ClientSession(auto_decompress=False) as session:
+            start = cpu_seconds(server.pid)
+            for _ in range(requests):
+                headers = {"Accept-Encoding": "gzip, deflate"}
+                if revalidate and etag:
+                    headers["If-None-Match"] = etag
+                async with session.get(url, headers=headers) as resp:
+                    received += len(await resp.read())
+                    etag = resp.headers.get("ETag")
+            cpu = cpu_seconds(server.pid) - start
+    finally:
+        server.terminate()
+        server.join()
+    return {"cpu_us": cpu / requests * 1e6, "bytes": received / requests}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument(
+        "--no-revalidate",
+        action="store_true",
+        help="never send If-None-Match, every request gets the full body",
+    )
+    args = parser.parse_args()
+    app.leader = {"id": app.POD_ID, "url": app.POD_IP}
+
+    print(f"{'path':<18} {'mode':>4} {'cpu us/req':>11} {'bytes/req':>10}")
+    for path in PATHS:
+        for mode, factory in [("old", old_app), ("new", new_app)]:
+            result = await measure(
+                factory, args.port, path, args.requests, not args.no_revalidate
+            )
+            print(
+                f"{path:<18} {mode:>4} {result['cpu_us']:>11.1f}"
+                f" {result['bytes']:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("fork")
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Cold start time of app.py.
+
+Starts `python app.py` as a single pod on 127.0.0.1 a few times and reads the
+startup phases the pod reports in /metrics (bully_startup_seconds, measured from
+the process start): done importing, listening and the first heartbeat round
+done. The time until /readiness first answers is measured from the outside.
+Also times importing the kubernetes client on its own, which is what
+K8S_INIT=lazy takes off the path to listening.
+
+Outside a cluster only K8S_INIT=lazy starts, the label patches then fail in the
+background. Run it in a pod to compare with eager.
+
+    python benchmark_startup.py --runs 10 --k8s-init lazy
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PHASES = ["import", "listen", "first_heartbeat"]
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=0.5) as resp:
+            return resp.status, resp.read().decode()
+    except OSError:
+        return None, ""
+
+
+def time_kubernetes_import():
+    command = [sys.executable, "-c", "import kubernetes.client, kubernetes.config"]
+    start = time.perf_counter()
+    subprocess.run(command, check=True)
+    with_kubernetes = time.perf_counter() - start
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return with_kubernetes - (time.perf_counter() - start)
+
+
+def cold_start(k8s_init, args):
+    """One start of the pod, returns its phases and seconds until /readiness"""
+    env = dict(
+        os.environ,
+        WEB_PORT=str(args.port),
+        POD_IP="127.0.0.1",
+        POD_NAME="startup-benchmark",
+        PEER_SERVICE="localhost",
+        MEMBERSHIP_MODE="dns",
+        K8S_INIT=k8s_init,
+        HEARTBEAT_INTERVAL=str(args.heartbeat_interval),
+        LOG_LEVEL="WARNING",
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, APP],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        ready = None
+        phases = {}
+        while time.perf_counter() - start < args.timeout:
+            if process.poll() is not None:
+                raise SystemExit(f"app.py exited with {process.returncode}")
+            if ready is None and get(base + "/readiness")[0] == 200:
+                ready = time.perf_counter() - start
+            if ready is not None:
+                _, text = get(base + "/metrics")
+                phases = {
+                    phase: float(value)
+                    for phase, value in re.findall(
+                        r'bully_startup_seconds\{phase="(\w+)"\} (\S+)', text
+                    )
+                }
+                if "first_heartbeat" in phases:
+                    break
+            time.sleep(0.005)
+        phases["ready"] = ready
+        return phases
+    finally:
+        process.terminate()
+        process.wait(5)
+
+
+def seconds(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return "-"
+    return f"{statistics.median(values):.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--k8s-init", nargs="+", default=["lazy"])
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=20)
+    args = parser.parse_args()
+
+    print(f"importing the kubernetes client: {time_kubernetes_import():.3f}s")
+    print("median seconds from the process start")
+    print(f"{'K8S_INIT':>8} " + " ".join(f"{p:>15}" for p in PHASES + ["ready"]))
+    for k8s_init in args.k8s_init:
+        runs = [cold_start(k8s_init, args) for _ in range(args.runs)]
+        print(
+            f"{k8s_init:>8} "
+            + " ".join(
+                f"{seconds(run.get(p) for run in runs):>15}" for p in PHASES + ["ready"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
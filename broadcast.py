@@ -0,0 +1,34 @@
+"""
+Coordinator dissemination over a k-ary tree of relays.
+
+Instead of the new leader sending its announcement to every peer at once, it
+sends it to `fanout` peers and hands each of them a share of the rest to pass
+on, and so on down the tree. No pod has more than `fanout` messages in flight
+and everybody is reached in about log_fanout(N) hops. Relays answer once their
+subtree has, listing the pods they could not reach, so the leader knows whom
+to retry.
+"""
+
+import math
+
+
+def subtrees(targets, fanout):
+    """
+    Split `targets` into at most `fanout` subtrees as (head, rest) pairs, the
+    head gets the message and relays it to the rest
+    """
+    if not targets:
+        return []
+    size = math.ceil(len(targets) / fanout)
+    return [
+        (targets[i], targets[i + 1 : i + size]) for i in range(0, len(targets), size)
+    ]
+
+
+def relay_hops(size, fanout):
+    """Hops below a relay that passes the message on to `size` pods"""
+    hops = 0
+    while size > 0:
+        hops += 1
+        size = math.ceil(size / fanout) - 1
+    return hops
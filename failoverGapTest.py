@@ -0,0 +1,100 @@
+"""
+Measures the failover gap seen by users while the leader hands over.
+
+Keeps CONCURRENCY clients requesting /get_cookie through the load balancer for
+DURATION seconds, optionally runs a command (e.g. a kubectl delete of a pod)
+after TRIGGER_AT seconds, and reports the longest time without a successful
+response plus every leader change seen in the responses.
+
+Run it once against a deployment with STEP_DOWN_MODE=restart and once with
+STEP_DOWN_MODE=graceful to compare the two.
+
+    python failoverGapTest.py --url http://localhost:8080 --trigger "kubectl delete pod bully-app-..."
+"""
+
+import argparse
+import asyncio
+import json
+import shlex
+import subprocess
+import time
+
+import aiohttp
+
+
+async def client(session, url, stop_at, results):
+    while time.monotonic() < stop_at:
+        start = time.monotonic()
+        try:
+            async with session.get(url) as response:
+                body = await response.text()
+                leader_id = None
+                if response.status == 200:
+                    leader_id = json.loads(body).rsplit("leader is: ", 1)[-1]
+                results.append((start, time.monotonic(), response.status, leader_id))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            results.append((start, time.monotonic(), type(e).__name__, None))
+            await asyncio.sleep(0.05)
+
+
+def report(results, started):
+    results.sort()
+    ok = [r for r in results if r[2] == 200]
+    failed = len(results) - len(ok)
+    print(f"{len(results)} requests, {len(ok)} ok, {failed} failed")
+
+    longest_gap, gap_at = 0.0, None
+    for previous, current in zip(ok, ok[1:]):
+        gap = current[1] - previous[1]
+        if gap > longest_gap:
+            longest_gap, gap_at = gap, previous[1] - started
+    if gap_at is not None:
+        print(
+            f"Longest gap without a successful response: {longest_gap:.3f}s at t={gap_at:.2f}s"
+        )
+
+    leader = None
+    for start, end, status, leader_id in ok:
+        if leader_id != leader:
+            print(f"t={end - started:7.3f}s leader is {leader_id}")
+            leader = leader_id
+
+    errors = {}
+    for r in results:
+        if r[2] != 200:
+            errors[r[2]] = errors.get(r[2], 0) + 1
+    for error, count in sorted(errors.items(), key=str):
+        print(f"  {error}: {count}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--trigger", help="command that causes a leader hand-over")
+    parser.add_argument("--trigger-at", type=float, default=5)
+    args = parser.parse_args()
+
+    results = []
+    started = time.monotonic()
+    stop_at = started + args.duration
+    timeout = aiohttp.ClientTimeout(total=2)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        clients = [
+            asyncio.create_task(
+                client(session, args.url + "/get_cookie", stop_at, results)
+            )
+            for _ in range(args.concurrency)
+        ]
+        if args.trigger:
+            await asyncio.sleep(args.trigger_at)
+            print(f"t={time.monotonic() - started:7.3f}s running: {args.trigger}")
+            await asyncio.to_thread(subprocess.run, shlex.split(args.trigger))
+        await asyncio.gather(*clients)
+
+    report(results, started)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
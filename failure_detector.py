@@ -0,0 +1,96 @@
+"""
+Phi accrual failure detection (Hayashibara et al.), as used by Akka and Cassandra.
+
+Instead of calling a peer dead after one missed probe, every peer keeps a
+window of heartbeat inter-arrival times and probe latencies. `phi` says how
+unlikely it is to still not have heard from the peer, given that history:
+phi = 1 means about a 10% chance of being wrong, phi = 8 about 1e-8.
+"""
+
+import math
+import time
+from collections import deque
+
+
+class FailureDetector:
+    def __init__(
+        self,
+        now=None,
+        window=100,
+        first_interval=1.0,
+        min_std=0.1,
+        acceptable_pause=0.0,
+    ):
+        now = time.monotonic() if now is None else now
+        self.intervals = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.last = now
+        self.down = False
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        # Until real heartbeats arrive, assume they come every `first_interval`
+        self.intervals.append(first_interval)
+
+    def heartbeat(self, now=None, latency=None):
+        now = time.monotonic() if now is None else now
+        self.intervals.append(now - self.last)
+        if latency is not None:
+            self.latencies.append(latency)
+        self.last = now
+        self.down = False
+
+    def mark_down(self):
+        """The peer refused the connection, it is gone until it answers again"""
+        self.down = True
+
+    def phi(self, now=None):
+        if self.down:
+            return math.inf
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last
+        mean = sum(self.intervals) / len(self.intervals)
+        variance = sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals)
+        std = max(math.sqrt(variance), self.min_std)
+
+        # Logistic approximation of the normal CDF, as in Akka:
+        # phi = -log10(1 / (1 + exp(z))), split so exp() never overflows
+        y = (elapsed - mean - self.acceptable_pause) / std
+        z = y * (1.5976 + 0.070566 * y * y)
+        if z > 0:
+            return (z + math.log1p(math.exp(-z))) / math.log(10)
+        return math.log1p(math.exp(z)) / math.log(10)
+
+    def timeout(self, minimum, maximum):
+        """Probe timeout from the latency history: mean plus four deviations"""
+        if not self.latencies:
+            return minimum
+        mean = sum(self.latencies) / len(self.latencies)
+        variance = sum((i - mean) ** 2 for i in self.latencies) / len(self.latencies)
+        return min(max(mean + 4 * math.sqrt(variance), minimum), maximum)
+
+
+class FailureDetectors:
+    """One FailureDetector per peer IP"""
+
+    def __init__(self, **options):
+        self.options = options
+        self.detectors = {}
+
+    def get(self, ip, now=None):
+        detector = self.detectors.get(ip)
+        if detector is None:
+            detector = FailureDetector(now, **self.options)
+            self.detectors[ip] = detector
+        return detector
+
+    def reset(self, ip, now=None):
+        self.detectors.pop(ip, None)
+        return self.get(ip, now)
+
+    def retain(self, ips):
+        ips = set(ips)
+        for ip in [ip for ip in self.detectors if ip not in ips]:
+            del self.detectors[ip]
+
+    def phi(self, ip, now=None):
+        return self.get(ip, now).phi(now)
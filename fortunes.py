@@ -0,0 +1,129 @@
+"""
+Fortune store backed by a memory-mapped file.
+
+The file holds the fortunes in the fortune(6) format, separated by lines with a
+single "%", or one per line. A FortuneStore keeps only the mapping and two arrays
+with the offset and the length of every entry, so a random fortune is an index
+lookup and one slice, with no Python object per entry until it is served.
+
+FortuneFile polls the path and swaps in a new store when the file has changed.
+Replace the file by renaming a new one over it: truncating a file while it is
+mapped makes the readers crash with SIGBUS.
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import random
+import re
+from array import array
+
+log = logging.getLogger(__name__)
+
+# Regular expressions matching the separator between two entries
+SEPARATORS = {"fortune": re.compile(rb"(?m)^%\r?$\n?"), "lines": re.compile(rb"\n")}
+
+
+def file_signature(stat):
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class FortuneStore:
+    """The fortunes of one version of a file"""
+
+    def __init__(self, path, separator=SEPARATORS["fortune"]):
+        self.path = path
+        self.separator = separator
+        self.starts = array("Q")
+        self.lengths = array("I")
+        self._mm = None
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            # What was mapped, the path may point to a newer file by now
+            self.signature = file_signature(stat)
+            if stat.st_size:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm is not None:
+            self._index()
+
+    def _index(self):
+        pos = 0
+        for match in self.separator.finditer(self._mm):
+            self._add(pos, match.start())
+            pos = match.end()
+        self._add(pos, len(self._mm))
+
+    def _add(self, start, stop):
+        # Without the line break before the separator, empty entries are skipped
+        mm = self._mm
+        while stop > start and mm[stop - 1] in (10, 13):
+            stop -= 1
+        if stop > start:
+            self.starts.append(start)
+            self.lengths.append(stop - start)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        return self._mm[start : start + self.lengths[i]].decode(errors="replace")
+
+    def choice(self):
+        return self[random.randrange(len(self.starts))]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+class FortuneFile:
+    """The current FortuneStore of a path, reloaded when the file changes"""
+
+    def __init__(self, path, fmt="fortune", interval=5.0):
+        self.path = path
+        self.separator = SEPARATORS[fmt]
+        self.interval = interval
+        self.store = None
+        self.reloads = 0
+
+    def __len__(self):
+        return len(self.store) if self.store is not None else 0
+
+    def choice(self):
+        return self.store.choice()
+
+    async def load(self):
+        """Map and index the file if it changed, returns whether it did"""
+        signature = file_signature(os.stat(self.path))
+        if self.store is not None and self.store.signature == signature:
+            return False
+        # Indexing millions of entries takes a while, keep it off the event loop
+        store = await asyncio.to_thread(FortuneStore, self.path, self.separator)
+        # One assignment, a request sees either the old or the new store
+        old, self.store = self.store, store
+        if old is not None:
+            old.close()
+        self.reloads += 1
+        log.info("Loaded %d fortunes from %s", len(store), self.path)
+        return True
+
+    async def watch(self):
+        while True:
+            try:
+                await self.load()
+            except (OSError, ValueError) as e:
+                log.warning(
+                    "Cannot load fortunes from %s: %r",
+                    self.path,
+                    e,
+                    extra={"key": ("fortunes", self.path)},
+                )
+            await asyncio.sleep(self.interval)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
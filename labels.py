@@ -0,0 +1,162 @@
+"""
+Pod role label management.
+
+The heartbeat asks for the role label it wants every round, but the API server
+should only see a PATCH when the label actually has to change. LabelReconciler
+keeps the desired and the last applied role and a single worker task patches
+the difference, so repeated and back-to-back label/unlabel requests collapse
+into at most one PATCH. PodPatcher sends that PATCH with aiohttp and the
+in-cluster service account instead of the blocking kubernetes client.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import ssl
+import time
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+SERVICE_ACCOUNT = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+# Role of a pod whose label has not been patched by this process yet
+UNKNOWN = object()
+
+
+class PodPatcher:
+    """Async JSON merge-patch of pods against the API server"""
+
+    def __init__(self, namespace, host=None, port=None, token_ttl=60.0):
+        self.namespace = namespace
+        host = host or os.environ["KUBERNETES_SERVICE_HOST"]
+        port = port or os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+        if ":" in host:
+            host = f"[{host}]"
+        self.base_url = f"https://{host}:{port}"
+        self.token_ttl = token_ttl
+        self._token = None
+        self._token_read_at = 0.0
+        self._session = None
+
+    @staticmethod
+    def in_cluster():
+        return "KUBERNETES_SERVICE_HOST" in os.environ and os.path.exists(
+            os.path.join(SERVICE_ACCOUNT, "token")
+        )
+
+    def _bearer_token(self):
+        # Projected service account tokens are rotated, so read it again now and then
+        now = time.monotonic()
+        if self._token is None or now - self._token_read_at > self.token_ttl:
+            with open(os.path.join(SERVICE_ACCOUNT, "token")) as f:
+                self._token = f.read().strip()
+            self._token_read_at = now
+        return self._token
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            context = ssl.create_default_context(
+                cafile=os.path.join(SERVICE_ACCOUNT, "ca.crt")
+            )
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(ssl=context, limit_per_host=2),
+                timeout=aiohttp.ClientTimeout(total=5),
+            )
+        return self._session
+
+    async def patch_pod(self, name, body):
+        url = f"{self.base_url}/api/v1/namespaces/{self.namespace}/pods/{name}"
+        headers = {
+            "Authorization": f"Bearer {self._bearer_token()}",
+            "Content-Type": "application/merge-patch+json",
+        }
+        async with self._get_session().patch(
+            url, data=json.dumps(body), headers=headers
+        ) as response:
+            if response.status >= 400:
+                text = await response.text()
+                raise RuntimeError(f"PATCH {name} failed ({response.status}): {text}")
+            await response.read()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class LabelReconciler:
+    """
+    Patches the role label through `patch(role)` only when the desired role differs
+    from the last one applied, retrying failed patches with exponential backoff
+    """
+
+    def __init__(self, patch, min_backoff=0.1, max_backoff=5.0):
+        self.patch = patch
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.desired = UNKNOWN
+        self.applied = UNKNOWN
+        self.requests = 0
+        self.patches = 0
+        self.failures = 0
+        self.patch_seconds = 0.0
+        self.last_patch_seconds = 0.0
+        self._changed = None
+        self._task = None
+
+    def set(self, role):
+        """Ask for `role` (None removes the label), returns without waiting"""
+        self.requests += 1
+        self.desired = role
+        if role != self.applied and self._changed is not None:
+            self._changed.set()
+
+    def start(self):
+        self._changed = asyncio.Event()
+        if self.desired is not UNKNOWN and self.desired != self.applied:
+            self._changed.set()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self):
+        backoff = self.min_backoff
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            while self.desired is not UNKNOWN and self.desired != self.applied:
+                role = self.desired
+                start = time.monotonic()
+                try:
+                    await self.patch(role)
+                except Exception as e:
+                    self.failures += 1
+                    log.warning("Label patch to role=%s failed, retrying: %r", role, e)
+                    await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                self.last_patch_seconds = time.monotonic() - start
+                self.patch_seconds += self.last_patch_seconds
+                self.patches += 1
+                self.applied = role
+                backoff = self.min_backoff
+                log.info("Applied role label %s", role)
+
+    def stats(self):
+        return {
+            "desired": None if self.desired is UNKNOWN else self.desired,
+            "applied": None if self.applied is UNKNOWN else self.applied,
+            "requests": self.requests,
+            "patches": self.patches,
+            "failures": self.failures,
+            "patch_seconds_total": self.patch_seconds,
+            "last_patch_seconds": self.last_patch_seconds,
+        }
@@ -1,21 +1,245 @@
-import requests
+"""
+Open-loop load generator for /get_cookie.
+
+Requests are started on a fixed schedule (--rate per second) no matter how
+fast earlier ones complete, and latency is measured from the time a request
+was *scheduled*, so a stalled server shows up in the results instead of
+silently slowing the generator down (coordinated omission). --concurrency caps
+the requests in flight; requests waiting for a slot still count their wait.
+
+    python loadtest.py --url http://localhost:8080/get_cookie --rate 200 \\
+        --duration 30 --label normal --output normal.json
+    python loadtest.py --compare normal.json improved.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
 import time
-import numpy as np
 
-url = "http://localhost:8080/get_cookie"
+import aiohttp
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram: logarithmic buckets with a fixed relative precision
+    (1% by default) between 1 microsecond and 100 seconds, so recording is O(1)
+    and percentiles stay accurate at the tail without keeping every sample
+    """
+
+    def __init__(self, lowest=1e-6, highest=100.0, precision=0.01):
+        self.lowest = lowest
+        self.log_base = math.log1p(precision)
+        self.counts = [0] * (self._index(highest) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self.log_base) + 1
+
+    def _value(self, index):
+        """Upper bound of a bucket"""
+        return self.lowest * math.exp(index * self.log_base)
+
+    def record(self, value):
+        index = min(self._index(value), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if self.total == 0:
+            return 0.0
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(i), self.max)
+        return self.max
+
+    def summary_ms(self):
+        return {
+            "count": self.total,
+            "mean": self.sum / self.total * 1000 if self.total else 0.0,
+            "p50": self.percentile(50) * 1000,
+            "p90": self.percentile(90) * 1000,
+            "p99": self.percentile(99) * 1000,
+            "p99.9": self.percentile(99.9) * 1000,
+            "max": self.max * 1000,
+        }
+
+
+class LoadTest:
+    def __init__(self, url, rate, duration, concurrency, timeout):
+        self.url = url
+        self.rate = rate
+        self.duration = duration
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        self.latency = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.status = {}
+        self.errors = {}
+        self.seconds = []
+
+    def _second(self, elapsed):
+        index = int(elapsed)
+        while len(self.seconds) <= index:
+            self.seconds.append(
+                {"requests": 0, "ok": 0, "errors": 0, "latency": LatencyHistogram()}
+            )
+        return self.seconds[index]
+
+    async def _request(self, session, scheduled, started):
+        async with self.slots:
+            sent = time.perf_counter()
+            outcome = None
+            try:
+                async with session.get(self.url) as response:
+                    await response.read()
+                    outcome = response.status
+                    self.status[str(outcome)] = self.status.get(str(outcome), 0) + 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                name = type(e).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+            done = time.perf_counter()
+
+        # Latency counts from when the request should have been sent
+        latency = done - scheduled
+        self.latency.record(latency)
+        self.service_time.record(done - sent)
+        second = self._second(scheduled - started)
+        second["requests"] += 1
+        second["latency"].record(latency)
+        if outcome is not None and outcome < 400:
+            second["ok"] += 1
+        else:
+            second["errors"] += 1
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session:
+            tasks = []
+            started = time.perf_counter()
+            total = int(self.rate * self.duration)
+            for i in range(total):
+                scheduled = started + i / self.rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(
+                    asyncio.create_task(self._request(session, scheduled, started))
+                )
+            await asyncio.gather(*tasks)
+            self.elapsed = time.perf_counter() - started
+
+    def result(self, label):
+        ok = sum(count for status, count in self.status.items() if int(status) < 400)
+        total = self.latency.total
+        return {
+            "label": label,
+            "config": {
+                "url": self.url,
+                "rate": self.rate,
+                "duration": self.duration,
+                "concurrency": self.concurrency,
+            },
+            "summary": {
+                "requests": total,
+                "ok": ok,
+                "failed": total - ok,
+                "achieved_rate": total / self.elapsed if self.elapsed else 0.0,
+                "latency_ms": self.latency.summary_ms(),
+                "service_time_ms": self.service_time.summary_ms(),
+            },
+            "status": self.status,
+            "errors": self.errors,
+            "timeseries": [
+                {
+                    "second": i,
+                    "requests": s["requests"],
+                    "ok": s["ok"],
+                    "errors": s["errors"],
+                    "p50_ms": s["latency"].percentile(50) * 1000,
+                    "p99_ms": s["latency"].percentile(99) * 1000,
+                    "max_ms": s["latency"].max * 1000,
+                }
+                for i, s in enumerate(self.seconds)
+            ],
+        }
+
+
+def compare(paths):
+    runs = []
+    for path in paths:
+        with open(path) as f:
+            runs.append(json.load(f))
+
+    columns = ["p50", "p90", "p99", "p99.9", "max"]
+    print(
+        f"{'run':>12} {'requests':>9} {'failed':>7} {'rate/s':>8} "
+        + " ".join(f"{c + ' ms':>9}" for c in columns)
+    )
+    for run in runs:
+        summary = run["summary"]
+        latency = summary["latency_ms"]
+        print(
+            f"{str(run['label']):>12} {summary['requests']:>9} {summary['failed']:>7}"
+            f" {summary['achieved_rate']:>8.1f} "
+            + " ".join(f"{latency[c]:>9.2f}" for c in columns)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8080/get_cookie")
+    parser.add_argument("--rate", type=float, default=100, help="requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=256, help="max in flight")
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--label", help="name of the run, e.g. the ELECTION_TYPE")
+    parser.add_argument("--output", help="write the JSON result here, default stdout")
+    parser.add_argument("--compare", nargs="+", metavar="JSON", help="compare results")
+    args = parser.parse_args()
 
-NUMBER_OF_REQUESTS = 100
-times = []
+    if args.compare:
+        compare(args.compare)
+        return
 
-for i in range(NUMBER_OF_REQUESTS):
-    start = time.perf_counter()
-    response = requests.get(url)
-    response.raise_for_status()
-    end = time.perf_counter()
+    test = LoadTest(args.url, args.rate, args.duration, args.concurrency, args.timeout)
+    asyncio.run(test.run())
+    result = test.result(args.label)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        summary = result["summary"]
+        print(
+            f"{summary['requests']} requests, {summary['failed']} failed,"
+            f" p99 {summary['latency_ms']['p99']:.2f}ms -> {args.output}",
+            file=sys.stderr,
+        )
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
 
-    times.append(end - start)
 
-average = sum(times) / len(times)
-p95 = np.percentile(times, 95)
-print("Average time: ", average)
-print("P95: ", p95)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
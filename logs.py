@@ -0,0 +1,157 @@
+"""
+Structured logging that stays off the event loop.
+
+Log calls on the event loop only run the rate limiter and put the record on a
+queue; a QueueListener thread formats it as one JSON object per line and
+writes it to stdout. A stdout that blocks (unbuffered output into a slow log
+collector) then stalls that thread instead of the heartbeat and the request
+handlers.
+
+Every record is rate limited per key: `extra={"key": ...}`, or the message
+template if no key is given. A key may log `burst` records at once and then
+`rate` per second, the rest are dropped and counted in the `suppressed` field
+of the next record that gets through.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from collections import OrderedDict
+
+# Record attributes that are not user supplied `extra` fields
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "key",
+}
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message key, for the `max_keys` most recently used keys"""
+
+    def __init__(self, rate=1.0, burst=5, max_keys=1024, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.suppressed = 0
+
+    def _key(self, record):
+        key = getattr(record, "key", None)
+        return (record.name, record.msg) if key is None else key
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        now = self.clock()
+        key = self._key(record)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                # The least recently used key, it starts with a full bucket again
+                self.buckets.popitem(last=False)
+            # [tokens, last refill, records dropped since the last one let through]
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        else:
+            self.buckets.move_to_end(key)
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            self.suppressed += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class ContextFilter(logging.Filter):
+    """Adds the fields returned by `context()` (pod id, leader, ...) to every record"""
+
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+
+    def filter(self, record):
+        for name, value in self.context().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The base class formats the message here, on the event loop. Only turn
+        # the traceback into text and leave the rest to the listener thread
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    context=None,
+    level="INFO",
+    fmt="json",
+    rate=1.0,
+    burst=5,
+    use_queue=True,
+    stream=None,
+):
+    """
+    Send the root logger through the rate limiter to `stream` (stdout), via a
+    queue and a writer thread when `use_queue`. Returns the QueueListener,
+    which has to be stopped at exit to flush it, or None
+    """
+    stream = stream or sys.stdout
+    writer = logging.StreamHandler(stream)
+    if fmt == "json":
+        writer.setFormatter(JsonFormatter())
+    else:
+        writer.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+        )
+
+    listener = None
+    if use_queue:
+        handler = _QueueHandler(queue.SimpleQueue())
+        listener = logging.handlers.QueueListener(handler.queue, writer)
+    else:
+        handler = writer
+    handler.addFilter(RateLimitFilter(rate, burst))
+    if context is not None:
+        handler.addFilter(ContextFilter(context))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    if listener is not None:
+        listener.start()
+    return listener
@@ -0,0 +1,214 @@
+"""
+Cluster membership from the EndpointSlices of the headless bully service.
+
+Instead of resolving the service through DNS every heartbeat, a single
+list+watch stream is kept open against the API server and every change is
+turned into joined/left deltas for the peer table.
+"""
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+
+SERVICE_LABEL = "kubernetes.io/service-name"
+
+
+def _field(obj, name):
+    """Read a field from either a kubernetes client model or a plain dict"""
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def slice_name(endpoint_slice):
+    return _field(_field(endpoint_slice, "metadata"), "name")
+
+
+def slice_addresses(endpoint_slice):
+    """All pod IPs in one EndpointSlice, ready or not (like publishNotReadyAddresses)"""
+    addresses = set()
+    for endpoint in _field(endpoint_slice, "endpoints") or []:
+        for address in _field(endpoint, "addresses") or []:
+            addresses.add(str(address))
+    return addresses
+
+
+class Membership:
+    """
+    The set of pod IPs behind the service, built from watch events.
+    A service can be split over several slices, so addresses are kept per slice.
+    """
+
+    def __init__(self):
+        self.slices = {}
+        self.members = set()
+
+    def apply(self, event):
+        """Apply one watch event and return the (joined, left) IP sets"""
+        kind = event["type"]
+        obj = event["object"]
+        if kind == "RESET":
+            self.slices = {slice_name(s): slice_addresses(s) for s in obj}
+        elif kind in ("ADDED", "MODIFIED"):
+            self.slices[slice_name(obj)] = slice_addresses(obj)
+        elif kind == "DELETED":
+            self.slices.pop(slice_name(obj), None)
+        else:
+            return set(), set()
+
+        members = set().union(*self.slices.values())
+        joined = members - self.members
+        left = self.members - members
+        self.members = members
+        return joined, left
+
+
+@dataclass
+class PeerEntry:
+    pod_id: int
+    generation: int
+    resolved_at: float
+
+
+class PeerTable:
+    """
+    Pod IDs by IP. A pod keeps its ID for its whole life, so an ID is resolved once
+    and only looked up again after `ttl` seconds, in case the IP went to a new pod.
+    `generation` goes up on every change to the table.
+    """
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self.entries = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, ip, now=None):
+        """Return the cached ID of `ip`, or None if it has to be resolved"""
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(ip)
+        if entry is None or now - entry.resolved_at > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.pod_id
+
+    def store(self, ip, pod_id, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(ip)
+        if entry is None or entry.pod_id != pod_id:
+            self.generation += 1
+            self.entries[ip] = PeerEntry(pod_id, self.generation, now)
+        else:
+            entry.resolved_at = now
+
+    def evict(self, ip):
+        if self.entries.pop(ip, None) is not None:
+            self.generation += 1
+
+    def retain(self, ips):
+        """Drop every entry whose IP is no longer in `ips`"""
+        ips = set(ips)
+        for ip in [ip for ip in self.entries if ip not in ips]:
+            self.evict(ip)
+
+    def id_map(self):
+        return {ip: entry.pod_id for ip, entry in self.entries.items()}
+
+
+class EndpointSliceSource:
+    """
+    List+watch of the EndpointSlices of one service.
+    The kubernetes client is blocking, so the stream runs on one dedicated thread
+    and hands its events to the event loop.
+    """
+
+    def __init__(self, api_client, namespace, service, timeout_seconds=300):
+        self.api_client = api_client
+        self.namespace = namespace
+        self.selector = f"{SERVICE_LABEL}={service}"
+        self.timeout_seconds = timeout_seconds
+        self._watch = None
+        self._stopped = threading.Event()
+
+    def _run(self, loop, queue):
+        from kubernetes import client, watch
+
+        api = client.DiscoveryV1Api(self.api_client)
+        while not self._stopped.is_set():
+            try:
+                # Start every stream from a full list, so deletions missed while
+                # the watch was down are picked up by the RESET
+                slices = api.list_namespaced_endpoint_slice(
+                    self.namespace, label_selector=self.selector
+                )
+                loop.call_soon_threadsafe(
+                    queue.put_nowait, {"type": "RESET", "object": slices.items}
+                )
+                self._watch = watch.Watch()
+                for event in self._watch.stream(
+                    api.list_namespaced_endpoint_slice,
+                    self.namespace,
+                    label_selector=self.selector,
+                    resource_version=slices.metadata.resource_version,
+                    timeout_seconds=self.timeout_seconds,
+                ):
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(
+                    queue.put_nowait, {"type": "ERROR", "object": e}
+                )
+                time.sleep(1)
+
+    async def events(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        thread = threading.Thread(
+            target=self._run,
+            args=(loop, queue),
+            name="endpointslice-watch",
+            daemon=True,
+        )
+        thread.start()
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.close()
+
+    def close(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+
+class FakeWatchSource:
+    """In-memory stand-in for EndpointSliceSource, for tests and local clusters"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def set_slice(self, name, ips, kind="ADDED"):
+        endpoints = [{"addresses": [ip]} for ip in ips]
+        self.queue.put_nowait(
+            {
+                "type": kind,
+                "object": {"metadata": {"name": name}, "endpoints": endpoints},
+            }
+        )
+
+    def delete_slice(self, name):
+        self.queue.put_nowait(
+            {"type": "DELETED", "object": {"metadata": {"name": name}, "endpoints": []}}
+        )
+
+    async def events(self):
+        while True:
+            yield await self.queue.get()
+
+    def close(self):
+        pass
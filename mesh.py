@@ -0,0 +1,221 @@
+"""
+WebSocket mesh for pod to pod messages.
+
+Instead of an HTTP request per /pod_id probe, election or coordinator message,
+two pods keep one WebSocket open and send small JSON frames over it:
+
+    {"t": "req", "id": 7, "p": "/receive_election", "b": {...}}
+    {"t": "res", "id": 7, "s": 200, "b": "OK"}
+
+Either end may send requests over a link, whoever opened it. Replies are
+matched to requests by id, so many messages can be in flight on one socket.
+The socket closing fails the requests in flight at once and is reported
+through `on_close`, which is how a dead peer is noticed without waiting for a
+probe to time out. Pods that do not serve /mesh get MeshUnavailable and are
+left to plain HTTP for a while.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+
+class MeshUnavailable(Exception):
+    """The peer does not speak the mesh protocol, use HTTP instead"""
+
+
+class MeshResponse:
+    """Reply to a mesh request, read like the ClientResponse of an HTTP request"""
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+    def __repr__(self):
+        return f"<MeshResponse {self.status} {self.body!r}>"
+
+
+class Link:
+    def __init__(self, mesh, pod_ip, ws):
+        self.mesh = mesh
+        self.pod_ip = pod_ip
+        self.ws = ws
+        self.pending = {}
+        self.closed = False
+        # Server side links only, the connection of the /mesh request
+        self.transport = None
+
+    async def request(self, path, body, timeout):
+        self.mesh.next_id += 1
+        request_id = self.mesh.next_id
+        reply = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = reply
+        try:
+            await self.ws.send_str(
+                json.dumps({"t": "req", "id": request_id, "p": path, "b": body})
+            )
+            return await asyncio.wait_for(reply, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def run(self):
+        """Read frames until the socket closes"""
+        try:
+            async for message in self.ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                frame = json.loads(message.data)
+                if frame["t"] == "res":
+                    reply = self.pending.get(frame["id"])
+                    if reply is not None and not reply.done():
+                        reply.set_result(MeshResponse(frame["s"], frame.get("b")))
+                else:
+                    self.mesh.spawn(self.serve(frame))
+        finally:
+            self.closed = True
+            for reply in self.pending.values():
+                if not reply.done():
+                    reply.set_exception(
+                        aiohttp.ServerDisconnectedError(
+                            f"mesh link to {self.pod_ip} closed"
+                        )
+                    )
+            self.mesh.link_closed(self)
+
+    async def serve(self, frame):
+        handler = self.mesh.handlers.get(frame["p"])
+        if handler is None:
+            status, body = 404, "Not Found"
+        else:
+            try:
+                status, body = await handler(frame.get("b"))
+            except Exception as e:
+                log.warning("Mesh request %s failed: %r", frame["p"], e)
+                status, body = 500, "Error"
+        if not self.ws.closed:
+            await self.ws.send_str(
+                json.dumps({"t": "res", "id": frame["id"], "s": status, "b": body})
+            )
+
+
+class PeerMesh:
+    """
+    One link per peer. `handlers` maps a path to `async handler(body) -> (status,
+    body)`, `session()` returns the ClientSession new links are opened with
+    """
+
+    def __init__(
+        self,
+        self_ip,
+        port,
+        handlers,
+        session,
+        on_close=None,
+        heartbeat=5.0,
+        http_retry_after=60.0,
+    ):
+        self.self_ip = self_ip
+        self.port = port
+        self.handlers = handlers
+        self.session = session
+        self.on_close = on_close
+        self.heartbeat = heartbeat
+        self.http_retry_after = http_retry_after
+        self.links = {}
+        self.http_only = {}
+        self.next_id = 0
+        self.connects = 0
+        self._connecting = {}
+        self._served = set()
+        self._tasks = set()
+        self._closing = False
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def request(self, pod_ip, path, body=None, timeout=2.0):
+        until = self.http_only.get(pod_ip)
+        if until is not None:
+            if time.monotonic() < until:
+                raise MeshUnavailable(pod_ip)
+            del self.http_only[pod_ip]
+        deadline = time.monotonic() + timeout
+        link = await asyncio.wait_for(self._link(pod_ip), timeout)
+        return await link.request(path, body, max(deadline - time.monotonic(), 0))
+
+    async def _link(self, pod_ip):
+        link = self.links.get(pod_ip)
+        if link is not None and not link.closed:
+            return link
+        # Requests racing for a new link share one connect
+        task = self._connecting.get(pod_ip)
+        if task is None:
+            task = self.spawn(self._connect(pod_ip))
+            self._connecting[pod_ip] = task
+            task.add_done_callback(lambda _: self._connecting.pop(pod_ip, None))
+        return await asyncio.shield(task)
+
+    async def _connect(self, pod_ip):
+        url = f"http://{pod_ip}:{self.port}/mesh"
+        try:
+            ws = await self.session().ws_connect(
+                url, params={"from": self.self_ip}, heartbeat=self.heartbeat
+            )
+        except aiohttp.WSServerHandshakeError as e:
+            self.http_only[pod_ip] = time.monotonic() + self.http_retry_after
+            raise MeshUnavailable(pod_ip) from e
+        self.connects += 1
+        link = Link(self, pod_ip, ws)
+        self.links[pod_ip] = link
+        self.spawn(link.run())
+        return link
+
+    async def handle(self, request):
+        """GET /mesh: a peer opens a link to this pod"""
+        pod_ip = request.query.get("from") or request.remote
+        ws = web.WebSocketResponse(heartbeat=self.heartbeat)
+        await ws.prepare(request)
+        link = Link(self, pod_ip, ws)
+        link.transport = request.transport
+        current = self.links.get(pod_ip)
+        if current is None or current.closed:
+            # Our own requests to this peer can use its link too
+            self.links[pod_ip] = link
+        self._served.add(link)
+        try:
+            await link.run()
+        finally:
+            self._served.discard(link)
+        return ws
+
+    def transports(self):
+        """Connections of the links peers opened to this pod"""
+        return {link.transport for link in self._served if link.transport is not None}
+
+    def link_closed(self, link):
+        if self.links.get(link.pod_ip) is link:
+            del self.links[link.pod_ip]
+        if not self._closing and self.on_close is not None:
+            self.on_close(link.pod_ip)
+
+    async def close(self):
+        self._closing = True
+        for link in set(self.links.values()) | self._served:
+            await link.ws.close()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.links.clear()
+        self._closing = False
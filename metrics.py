@@ -0,0 +1,254 @@
+"""
+Prometheus metrics without the client library.
+
+Everything runs on the event loop thread, so the metrics are plain attributes
+without locks, and a histogram's buckets are allocated once when its label
+values are first seen. Recording is a bisect and two additions; the text
+exposition format is only built when /metrics is scraped.
+
+Other processes with the same metrics, such as HTTP workers, hand over a
+`snapshot()` of their counters and histograms, which `render()` adds to this
+process's own.
+"""
+
+import math
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from 100us for the cookie handler up to slow elections
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, snapshots=()):
+        """Text exposition, with the counters and histograms of `snapshots` added"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            states = [
+                snapshot[metric.name]
+                for snapshot in snapshots
+                if metric.name in snapshot and metric.type != "gauge"
+            ]
+            children = metric.merge(states) if states else None
+            lines.extend(metric.samples(children))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """The counters and histograms as JSON, to be rendered by another process"""
+        return {
+            metric.name: metric.snapshot()
+            for metric in self.metrics
+            if metric.type != "gauge"
+        }
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self._new_child()
+            self.children[values] = child
+        return child
+
+    def retain(self, keep):
+        """Drop the children whose label values are not in `keep`, e.g. departed peers"""
+        for values in [values for values in self.children if values not in keep]:
+            del self.children[values]
+
+    def snapshot(self):
+        return [
+            [list(values), self._state(child)]
+            for values, child in self.children.items()
+        ]
+
+    def merge(self, states):
+        """Copies of the children with the states of other processes added"""
+        children = {}
+        for values, child in self.children.items():
+            children[values] = self._new_child()
+            self._add(children[values], self._state(child))
+        for snapshot in states:
+            for values, state in snapshot:
+                values = tuple(values)
+                if values not in children:
+                    children[values] = self._new_child()
+                self._add(children[values], state)
+        return children
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from `function()` at scrape time instead"""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def _state(self, child):
+        return child.get()
+
+    def _add(self, child, state):
+        child.inc(state)
+
+    def samples(self, children=None):
+        if children is None:
+            children = self.children
+        for values, child in children.items():
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_total{labels} {_format_value(child.get())}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    def set_function(self, function):
+        self.children[()].set_function(function)
+
+    def samples(self, children=None):
+        if children is None:
+            children = self.children
+        for values, child in children.items():
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_format_value(child.get())}"
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket, never resized
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=None
+    ):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def _state(self, child):
+        return [list(child.counts), child.sum]
+
+    def _add(self, child, state):
+        counts, total = state
+        for i, count in enumerate(counts):
+            child.counts[i] += count
+        child.sum += total
+
+    def samples(self, children=None):
+        if children is None:
+            children = self.children
+        for values, child in children.items():
+            total = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                total += count
+                labels = _format_labels(
+                    self.labelnames, values, f'le="{_format_value(bound)}"'
+                )
+                yield f"{self.name}_bucket{labels} {total}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {total}"
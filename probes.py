@@ -0,0 +1,66 @@
+"""
+SWIM-style probe scheduling (Das, Gupta and Motivala, 2002).
+
+Instead of every pod probing the leader every round, each pod probes one peer
+per protocol period, taking them in a shuffled round-robin order. A peer that
+does not answer is probed indirectly through a few others before it is
+suspected, so one lost packet or a slow link between two pods does not start
+an election. Every pod sends one probe per period and gets one on average, so
+the load per pod stays the same however many replicas there are; a cluster
+wide probe budget stretches the period once the cluster outgrows it.
+"""
+
+import random
+
+
+class ProbeSchedule:
+    """Round-robin probe order over the current peers, reshuffled every pass"""
+
+    def __init__(self, rng=random):
+        self.rng = rng
+        self.members = set()
+        self.order = []
+
+    def update(self, members):
+        """Follow a membership change, returns True if the peers changed"""
+        members = set(members)
+        if members == self.members:
+            return False
+        self.order = [pod_ip for pod_ip in self.order if pod_ip in members]
+        # Joined peers go to a random place in the current pass, as in SWIM
+        for pod_ip in members - self.members:
+            self.order.insert(self.rng.randint(0, len(self.order)), pod_ip)
+        self.members = members
+        return True
+
+    def next(self):
+        """The peer to probe this period, None without peers"""
+        if not self.order:
+            self.order = list(self.members)
+            self.rng.shuffle(self.order)
+        return self.order.pop() if self.order else None
+
+
+def probe_period(cluster_size, interval, budget=0):
+    """
+    Seconds between the probes of one pod: `interval`, or longer if the whole
+    cluster would otherwise send more than `budget` probes per second
+    """
+    if budget > 0:
+        return max(interval, cluster_size / budget)
+    return interval
+
+
+def detection_bounds(cluster_size, period, probe_timeout, indirect_timeout):
+    """
+    Seconds until some pod suspects a crashed peer, as (expected, worst case).
+    Each of the other pods probes it with probability 1/(n-1) per period, so
+    some pod does with q = 1 - (1 - 1/(n-1))^(n-1), about 1 - 1/e. The
+    round-robin order puts an upper bound of 2(n-1) - 1 periods on it
+    """
+    peers = cluster_size - 1
+    if peers < 1:
+        return 0.0, 0.0
+    timeouts = probe_timeout + indirect_timeout
+    q = 1 - (1 - 1 / peers) ** peers
+    return period / q + timeouts, (2 * peers - 1) * period + timeouts
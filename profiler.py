@@ -0,0 +1,114 @@
+"""
+Sampling profiler and stall watchdog for the running process.
+
+sample_stacks runs on a thread of its own and reads the stack of every other
+thread from sys._current_frames() a few hundred times a second. It adds no
+hooks to the profiled code, so the overhead is one short GIL hold per sample.
+The result is in the collapsed format of flamegraph.pl and speedscope: one
+line per distinct stack, root first, frames separated by ";" and the sample
+count at the end.
+
+StallWatchdog is a thread that checks whether the event loop still ticks. When
+the loop has been stuck for longer than its threshold, it logs the loop
+thread's stack once, showing what blocked it.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+log = logging.getLogger(__name__)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def sample_stacks(seconds, interval=0.005):
+    """Sample all other threads for `seconds`, returns {collapsed stack: samples}"""
+    me = threading.get_ident()
+    names = {}
+    counts = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                names.setdefault(ident, str(ident))
+            stack = names[ident] + ";" + collapse(frame)
+            counts[stack] = counts.get(stack, 0) + 1
+        time.sleep(interval)
+    return counts
+
+
+def collapsed_text(counts):
+    return "".join(
+        f"{stack} {count}\n"
+        for stack, count in sorted(counts.items(), key=lambda item: -item[1])
+    )
+
+
+class StallWatchdog:
+    """Logs where the loop thread is stuck once it has not ticked for `threshold`"""
+
+    def __init__(self, threshold, check_interval=None):
+        self.threshold = threshold
+        self.check_interval = check_interval or threshold / 4
+        self.last_tick = time.monotonic()
+        self.loop_thread = threading.get_ident()
+        self.stalls = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def tick(self):
+        """Called from the event loop, e.g. by the loop lag sampler"""
+        self.last_tick = time.monotonic()
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, name="stall-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        reported = None
+        while not self._stopped.wait(self.check_interval):
+            tick = self.last_tick
+            stalled = time.monotonic() - tick
+            if stalled < self.threshold or reported == tick:
+                continue
+            # One report per stall, the loop has not moved since the last one
+            reported = tick
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            log.warning(
+                "Event loop stalled for %.3fs, stack of the loop thread:\n%s",
+                stalled,
+                stack,
+                extra={"stall_seconds": round(stalled, 3)},
+            )
@@ -0,0 +1,145 @@
+"""
+Pre-encoded responses for the front end.
+
+An EncodedAsset is a body encoded once, as is, with gzip and, if the brotli
+package is installed, with brotli, each with its own strong ETag. A request gets
+the smallest encoding it accepts, or 304 when it already has the body. Nothing
+is compressed per request.
+
+StaticAssets serves the files of a directory that way. A file is read and
+encoded on a thread on its first request and kept for the life of the process,
+the files are part of the image and do not change.
+"""
+
+import asyncio
+import functools
+import gzip
+import hashlib
+import mimetypes
+import pathlib
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Most preferred first, used when a client accepts several equally
+ENCODINGS = ["br", "gzip", "identity"] if brotli is not None else ["gzip", "identity"]
+# Types worth compressing, images and archives are compressed already
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg")
+
+
+@functools.lru_cache(maxsize=64)
+def accepted_encodings(accept_encoding):
+    """The ENCODINGS an Accept-Encoding header allows, most preferred first"""
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip()] = q
+    default = weights.get("*", 0.0)
+    # identity is fine unless it is refused explicitly
+    weights.setdefault("identity", default if "*" in weights else 1.0)
+    ranked = [
+        (weights.get(coding, default), -i, coding) for i, coding in enumerate(ENCODINGS)
+    ]
+    return tuple(coding for q, _, coding in sorted(ranked, reverse=True) if q > 0)
+
+
+class EncodedAsset:
+    def __init__(self, body, content_type, cache_control, compress=None):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {"identity": body}
+        if compress is None:
+            compress = content_type.startswith(COMPRESSIBLE)
+        if compress:
+            self.bodies["gzip"] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body)
+        # Strong ETags differ per encoding, the bytes on the wire differ
+        self.etags = {
+            encoding: (
+                f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            )
+            for encoding in self.bodies
+        }
+
+    def encoding_for(self, request):
+        for encoding in accepted_encodings(request.headers.get("Accept-Encoding", "")):
+            if encoding in self.bodies:
+                return encoding
+        return "identity"
+
+    def not_modified(self, request):
+        if_none_match = request.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison (RFC 9110), any encoding of the same content matches
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return not tags.isdisjoint(self.etags.values())
+
+    def response(self, request):
+        encoding = self.encoding_for(request)
+        headers = {
+            "Content-Type": self.content_type,
+            "ETag": self.etags[encoding],
+            "Cache-Control": self.cache_control,
+        }
+        if len(self.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if self.not_modified(request):
+            del headers["Content-Type"]
+            return web.Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=self.bodies[encoding], headers=headers)
+
+
+class StaticAssets:
+    """The files below a directory as EncodedAssets, read on first request"""
+
+    def __init__(self, directory, cache_control):
+        self.directory = pathlib.Path(directory).resolve()
+        self.cache_control = cache_control
+        self.assets = {}
+
+    def get(self, name):
+        """The asset for `name`, blocking. Cached under the file's own path, so
+        aliases such as `x/../yoda.png` share one copy"""
+        asset = self.assets.get(name)
+        if asset is None:
+            path = (self.directory / name).resolve()
+            if not path.is_relative_to(self.directory) or not path.is_file():
+                return None
+            key = path.relative_to(self.directory).as_posix()
+            asset = self.assets.get(key)
+            if asset is None:
+                content_type = mimetypes.guess_type(path.name)[0]
+                asset = EncodedAsset(
+                    path.read_bytes(),
+                    content_type or "application/octet-stream",
+                    self.cache_control,
+                )
+                self.assets[key] = asset
+        return asset
+
+    async def handle(self, request):
+        name = request.match_info["name"]
+        asset = self.assets.get(name)
+        if asset is None:
+            asset = await asyncio.to_thread(self.get, name)
+        if asset is None:
+            raise web.HTTPNotFound()
+        return asset.response(request)
@@ -0,0 +1,98 @@
+"""
+Leader state shared between the election agent and the HTTP workers.
+
+The agent process is the only writer. Workers map the same file (on tmpfs)
+and read it on every request, without a lock or a message to the agent: the
+block is a seqlock. The writer makes the sequence number odd, writes the
+fields and makes it even again; a reader retries if the number was odd or
+changed while it read. Readers keep the last decoded view and only decode the
+block again when the sequence number moved.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+# seq, leader id, ready, stepping down, url length, url
+_SEQ = struct.Struct("<Q")
+_BODY = struct.Struct("<q??xxxxxH64s")
+SIZE = _SEQ.size + _BODY.size
+
+LeaderView = namedtuple("LeaderView", "leader_id leader_url ready stepping_down")
+
+
+class SharedState:
+    def __init__(self, path, buffer):
+        self.path = path
+        self.buffer = buffer
+        self.writes = 0
+        self.retries = 0
+        self._seq = None
+        self._view = None
+
+    @classmethod
+    def create(cls, path=None):
+        """New zeroed block, by default in a fresh file under /dev/shm"""
+        if path is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            fd, path = tempfile.mkstemp(prefix="bully-", suffix=".state", dir=directory)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, SIZE)
+            buffer = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        state = cls(path, buffer)
+        state.write(-1, "", True, False)
+        return state
+
+    @classmethod
+    def open(cls, path):
+        fd = os.open(path, os.O_RDWR)
+        try:
+            buffer = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        return cls(path, buffer)
+
+    def write(self, leader_id, leader_url, ready, stepping_down):
+        url = (leader_url or "").encode()[:64]
+        seq = _SEQ.unpack_from(self.buffer)[0]
+        _SEQ.pack_into(self.buffer, 0, seq + 1)
+        _BODY.pack_into(
+            self.buffer, _SEQ.size, leader_id, ready, stepping_down, len(url), url
+        )
+        _SEQ.pack_into(self.buffer, 0, seq + 2)
+        self.writes += 1
+
+    def read(self):
+        buffer = self.buffer
+        while True:
+            seq = _SEQ.unpack_from(buffer)[0]
+            if seq == self._seq:
+                return self._view
+            if seq & 1:
+                self.retries += 1
+                continue
+            leader_id, ready, stepping_down, length, url = _BODY.unpack_from(
+                buffer, _SEQ.size
+            )
+            if _SEQ.unpack_from(buffer)[0] != seq:
+                self.retries += 1
+                continue
+            self._view = LeaderView(
+                leader_id, url[:length].decode(), ready, stepping_down
+            )
+            self._seq = seq
+            return self._view
+
+    def close(self, unlink=False):
+        self.buffer.close()
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
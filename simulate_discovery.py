@@ -0,0 +1,143 @@
+"""
+Round-based simulation of discovery traffic (peer requests per second).
+
+Models the heartbeat of every pod with one round per second and counts the
+requests pods send each other to learn IDs and check the leader:
+
+- probe-all: every pod sends /pod_id to every other pod each round (the old heartbeat)
+- cached:    pod IDs are cached in the peer table, only the leader is probed
+- gossip:    like cached, but when more pods are missing than the fan-out they are
+             learned from /cluster_view of a few peers
+
+Each mode is run through a cold start (all pods start at once), a steady state
+and a churn phase where one pod is replaced every CHURN_EVERY rounds.
+
+    python simulate_discovery.py --nodes 5 50 500
+"""
+
+import argparse
+import random
+
+from membership import PeerTable
+
+
+class Node:
+    def __init__(self, ip, pod_id):
+        self.ip = ip
+        self.pod_id = pod_id
+        self.peers = PeerTable()
+        self.unresolved = {}
+
+    def view(self):
+        peers = self.peers.id_map()
+        peers[self.ip] = self.pod_id
+        return peers
+
+
+def heartbeat_round(nodes, mode, fanout, probe_after, now):
+    """Run one heartbeat on every node, returns the number of requests sent"""
+    by_ip = {node.ip: node for node in nodes}
+    leader_id = max(node.pod_id for node in nodes)
+    messages = 0
+    for node in nodes:
+        ip_list = [ip for ip in by_ip if ip != node.ip]
+
+        if mode == "probe-all":
+            messages += len(ip_list)
+            node.peers.retain(ip_list)
+            for ip in ip_list:
+                node.peers.store(ip, by_ip[ip].pod_id, now)
+            continue
+
+        node.peers.retain(ip_list)
+        misses = [ip for ip in ip_list if node.peers.lookup(ip, now) is None]
+        if len(misses) > fanout and mode == "gossip":
+            sources = random.sample(ip_list, min(fanout, len(ip_list)))
+            messages += len(sources)
+            wanted = set(misses)
+            for source in sources:
+                for ip, pod_id in by_ip[source].view().items():
+                    if ip in wanted:
+                        node.peers.store(ip, pod_id, now)
+                        wanted.discard(ip)
+            node.unresolved = {ip: node.unresolved.get(ip, 0) + 1 for ip in wanted}
+            misses = [ip for ip in wanted if node.unresolved[ip] > probe_after]
+
+        messages += len(misses)
+        for ip in misses:
+            node.peers.store(ip, by_ip[ip].pod_id, now)
+
+        # liveness check of the leader
+        if node.pod_id != leader_id:
+            messages += 1
+    return messages
+
+
+def converged(nodes):
+    return all(len(node.peers.entries) == len(nodes) - 1 for node in nodes)
+
+
+def simulate(n, mode, rounds, churn_every, fanout, probe_after, seed=0):
+    random.seed(seed)
+    ids = random.sample(range(10**6), n + rounds)
+    nodes = [Node(f"10.0.{i // 250}.{i % 250}", ids[i]) for i in range(n)]
+    next_ip = n
+
+    cold, steady, churn = [], [], []
+    converged_after = None
+    now = 0.0
+    for r in range(rounds):
+        cold.append(heartbeat_round(nodes, mode, fanout, probe_after, now))
+        now += 1
+        if converged_after is None and converged(nodes):
+            converged_after = r + 1
+    for _ in range(rounds):
+        steady.append(heartbeat_round(nodes, mode, fanout, probe_after, now))
+        now += 1
+    for r in range(rounds):
+        if r % churn_every == 0:
+            # a pod restarts with a new IP and a new ID
+            nodes[random.randrange(n)] = Node(
+                f"10.1.{next_ip // 250}.{next_ip % 250}", ids[next_ip]
+            )
+            next_ip += 1
+        churn.append(heartbeat_round(nodes, mode, fanout, probe_after, now))
+        now += 1
+
+    return {
+        "nodes": n,
+        "mode": mode,
+        "cold_peak": max(cold),
+        "cold_rounds": converged_after,
+        "steady": sum(steady) / len(steady),
+        "churn": sum(churn) / len(churn),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--churn-every", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=2)
+    parser.add_argument("--probe-after", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'nodes':>6} {'mode':>10} {'cold peak/s':>12} {'rounds to ids':>14}"
+        f" {'steady/s':>10} {'churn/s':>10}"
+    )
+    for n in args.nodes:
+        for mode in ("probe-all", "cached", "gossip"):
+            result = simulate(
+                n, mode, args.rounds, args.churn_every, args.fanout, args.probe_after
+            )
+            print(
+                f"{result['nodes']:>6} {result['mode']:>10} {result['cold_peak']:>12}"
+                f" {str(result['cold_rounds']):>14} {result['steady']:>10.1f}"
+                f" {result['churn']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""
+In-process cluster simulator for leader election benchmarks.
+
+Runs N copies of the app.py node logic in one event loop. Every copy is a
+separate module object with its own globals, serving HTTP on its own loopback
+address (127.1.x.y) on the same port, just like pods in the cluster. The
+Kubernetes parts are faked: `bully-service` resolves to the registered nodes
+and every node gets a FakeCoreV1Api that records the role label patches.
+
+Faults are injected on the peer traffic of each node:
+- kill:      the node's server and background tasks are stopped and it leaves the service
+- pause:     the node sends nothing (its requests hang) and requests to it time out
+- partition: requests between groups time out
+- drop:      the next request(s) to one endpoint of a node time out
+
+For every scenario the simulator records the time until all reachable nodes
+agree on the expected leader, the messages sent per endpoint, and how many
+nodes adopted a wrong leader on the way.
+
+    python simulator.py --nodes 50 --election-type normal --scenario kill-leader
+    python simulator.py --nodes 200 --election-type improved --scenario pause-leader
+    python simulator.py --nodes 10 --trace trace.json  # open in ui.perfetto.dev
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import pathlib
+import random
+import resource
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from logs import setup_logging
+from trace_merge import merge
+
+APP_PATH = pathlib.Path(__file__).resolve().parent / "app.py"
+
+
+class FakeCoreV1Api:
+    """Records pod label patches instead of talking to an API server"""
+
+    def __init__(self, pods):
+        self.pods = pods
+        self.patches = 0
+
+    def patch_namespaced_pod(self, name, namespace, body):
+        self.patches += 1
+        labels = self.pods.setdefault(name, {})
+        for key, value in body["metadata"]["labels"].items():
+            if value is None:
+                labels.pop(key, None)
+            else:
+                labels[key] = value
+
+
+class SimNode:
+    def __init__(self, cluster, index, pod_id, env, time_scale=1.0):
+        self.cluster = cluster
+        self.index = index
+        self.ip = f"127.1.{index // 250}.{index % 250 + 1}"
+        self.pod_id = pod_id
+        self.name = f"bully-app-{index}"
+        self.alive = False
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.runner = None
+        # Peer requests of this node waiting for an answer and the most at
+        # once, per endpoint
+        self.inflight = {}
+        self.peak_inflight = {}
+        self.module = self._load(env, time_scale)
+
+    def _load(self, env, time_scale):
+        os.environ.update(env)
+        os.environ.update(POD_NAME=self.name, POD_IP=self.ip)
+        spec = importlib.util.spec_from_file_location(
+            f"bully_node_{self.index}", APP_PATH
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        module.POD_ID = self.pod_id
+        module.TRACE.pid = self.pod_id
+        module.TRACE.process_name = f"{self.name} ({self.pod_id})"
+        module.log = logging.getLogger(f"bully.{self.name}")
+        module.PROBE_TIMEOUT = aiohttp.ClientTimeout(
+            total=module.PROBE_TIMEOUT.total * time_scale
+        )
+        module.MESSAGE_TIMEOUT = aiohttp.ClientTimeout(
+            total=module.MESSAGE_TIMEOUT.total * time_scale
+        )
+        module.INDIRECT_PROBE_TIMEOUT = aiohttp.ClientTimeout(
+            total=module.INDIRECT_PROBE_TIMEOUT.total * time_scale
+        )
+        module.ELECTION_BACKOFF *= time_scale
+        module.v1 = self.cluster.k8s
+        module.resolve_service = self._resolve_service
+        module.peer_request = self._wrap_peer_request(module.peer_request)
+        return module
+
+    async def _resolve_service(self):
+        return [ip for ip in self.cluster.service if ip != self.ip]
+
+    def _wrap_peer_request(self, peer_request):
+        cluster = self.cluster
+
+        async def sim_peer_request(method, pod_ip, endpoint, timeout=None, **kwargs):
+            timeout = timeout or self.module.MESSAGE_TIMEOUT
+            if not self.alive:
+                raise aiohttp.ClientConnectionError(f"{self.ip} was killed")
+            # A paused node does not run, so whatever it wanted to send waits
+            await self.resumed.wait()
+            cluster.count(endpoint, pod_ip)
+            inflight = self.inflight.get(endpoint, 0) + 1
+            self.inflight[endpoint] = inflight
+            if inflight > self.peak_inflight.get(endpoint, 0):
+                self.peak_inflight[endpoint] = inflight
+            try:
+                target = cluster.by_ip.get(pod_ip)
+                if target is not None and (
+                    not target.resumed.is_set()
+                    or cluster.blocked(self, target)
+                    or cluster.dropped(pod_ip, endpoint)
+                ):
+                    await asyncio.sleep(timeout.total)
+                    raise asyncio.TimeoutError()
+                return await peer_request(
+                    method, pod_ip, endpoint, timeout=timeout, **kwargs
+                )
+            finally:
+                self.inflight[endpoint] -= 1
+
+        return sim_peer_request
+
+    async def start(self):
+        self.runner = web.AppRunner(self.module.create_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.ip, self.cluster.port).start()
+        self.module.RUNNER = self.runner
+        self.alive = True
+        self.cluster.service.add(self.ip)
+
+    async def kill(self):
+        self.alive = False
+        self.cluster.service.discard(self.ip)
+        self.module.RUNNER = None
+        await self.runner.cleanup()
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    @property
+    def reachable(self):
+        return self.alive and self.resumed.is_set()
+
+    @property
+    def leader_id(self):
+        return self.module.leader["id"]
+
+
+class Cluster:
+    def __init__(self, n, port, env, seed=0, time_scale=1.0):
+        self.port = port
+        self.pods = {}
+        self.k8s = FakeCoreV1Api(self.pods)
+        self.service = set()
+        self.groups = None
+        self.messages = {}
+        self.received = {}
+        self.drops = {}
+        # When the first node followed the leader expected now, see wait_converged
+        self.first_informed = None
+        rng = random.Random(seed)
+        ids = rng.sample(range(10**6), n)
+        self.nodes = [SimNode(self, i, ids[i], env, time_scale) for i in range(n)]
+        self.by_ip = {node.ip: node for node in self.nodes}
+
+    def count(self, endpoint, pod_ip):
+        self.messages[endpoint] = self.messages.get(endpoint, 0) + 1
+        self.received[pod_ip] = self.received.get(pod_ip, 0) + 1
+
+    def peak_inflight(self):
+        peaks = {}
+        for node in self.nodes:
+            for endpoint, peak in node.peak_inflight.items():
+                peaks[endpoint] = max(peaks.get(endpoint, 0), peak)
+        return dict(sorted(peaks.items()))
+
+    def dropped(self, pod_ip, endpoint):
+        left = self.drops.get((pod_ip, endpoint), 0)
+        if left:
+            self.drops[(pod_ip, endpoint)] = left - 1
+        return left > 0
+
+    def blocked(self, source, target):
+        return (
+            self.groups is not None and self.groups[source.ip] != self.groups[target.ip]
+        )
+
+    def partition(self, *groups):
+        self.groups = {node.ip: i for i, group in enumerate(groups) for node in group}
+
+    def heal(self):
+        self.groups = None
+
+    async def start(self):
+        for node in self.nodes:
+            await node.start()
+
+    async def stop(self):
+        for node in self.nodes:
+            if node.alive:
+                await node.kill()
+        # Let cancelled elections and step-downs unwind
+        await asyncio.sleep(0.1)
+
+    def live(self):
+        return [node for node in self.nodes if node.reachable]
+
+    def components(self):
+        """The reachable nodes split by partition group"""
+        groups = {}
+        for node in self.live():
+            key = 0 if self.groups is None else self.groups[node.ip]
+            groups.setdefault(key, []).append(node)
+        return list(groups.values())
+
+    def expected_leaders(self):
+        """Per component, the node the bully algorithm has to end up with"""
+        return [
+            (group, max(node.pod_id for node in group)) for group in self.components()
+        ]
+
+    def converged(self):
+        return all(
+            node.leader_id == expected
+            for group, expected in self.expected_leaders()
+            for node in group
+        )
+
+    def leaders_seen(self):
+        """How many live nodes follow each leader id"""
+        seen = {}
+        for node in self.live():
+            seen[node.leader_id] = seen.get(node.leader_id, 0) + 1
+        return dict(sorted(seen.items(), key=lambda item: -item[1]))
+
+    def labelled_leaders(self):
+        return sorted(
+            node.name
+            for node in self.nodes
+            if node.alive and self.pods.get(node.name, {}).get("role") == "leader"
+        )
+
+    async def wait_converged(self, timeout, allowed=(), since=None):
+        """
+        Wait until every component agrees on its expected leader. Returns the time
+        it took since `since` (default now, None on timeout) and the nodes that
+        adopted any other leader, apart from the ids in `allowed` (e.g. the old
+        leader before it is detected)
+        """
+        start = time.monotonic() if since is None else since
+        wrong = set()
+        while time.monotonic() - start < timeout:
+            expected = {
+                node.ip: leader_id
+                for group, leader_id in self.expected_leaders()
+                for node in group
+            }
+            for node in self.live():
+                seen = node.leader_id
+                if seen not in (-1, expected[node.ip], *allowed):
+                    wrong.add(node.ip)
+                if seen == expected[node.ip] and self.first_informed is None:
+                    self.first_informed = time.monotonic()
+            if self.converged():
+                return time.monotonic() - start, wrong
+            await asyncio.sleep(0.01)
+        return None, wrong
+
+
+async def run_scenario(cluster, scenario, timeout):
+    result = {"scenario": scenario}
+    started = time.monotonic()
+    await cluster.start()
+    took, _ = await cluster.wait_converged(timeout)
+    result["initial_convergence_s"] = took
+    result["startup_messages"] = sum(cluster.messages.values())
+    if took is None:
+        result["error"] = "cluster did not converge after start"
+        result["leaders_seen"] = cluster.leaders_seen()
+        return result
+
+    leader = max(cluster.nodes, key=lambda node: node.pod_id)
+    cluster.messages.clear()
+    cluster.received.clear()
+    cluster.first_informed = None
+    for node in cluster.nodes:
+        node.peak_inflight = dict(node.inflight)
+    fault_at = time.monotonic()
+
+    if scenario == "kill-leader":
+        await leader.kill()
+    elif scenario == "pause-leader":
+        leader.pause()
+    elif scenario == "missed-coordinator":
+        # The lowest node misses the new leader's broadcast and has to catch up
+        lowest = min(cluster.nodes, key=lambda node: node.pod_id)
+        cluster.drops[(lowest.ip, "/receive_coordinator")] = 1
+        await leader.kill()
+    elif scenario == "partition":
+        nodes = sorted(cluster.nodes, key=lambda node: node.pod_id)
+        half = len(nodes) // 2
+        cluster.partition(nodes[:half], nodes[half:])
+    elif scenario != "steady":
+        raise ValueError(f"unknown scenario {scenario}")
+
+    if scenario == "steady":
+        await asyncio.sleep(timeout)
+        took, wrong = 0.0, set()
+    else:
+        # Counted from the fault, killing a node takes a moment itself
+        took, wrong = await cluster.wait_converged(
+            timeout, allowed=(leader.pod_id,), since=fault_at
+        )
+    window = time.monotonic() - fault_at
+    informed_spread = None
+    if took is not None and cluster.first_informed is not None:
+        informed_spread = fault_at + took - cluster.first_informed
+    # The label reconciler patches in the background, give it a moment
+    await asyncio.sleep(0.5)
+
+    result.update(
+        {
+            "old_leader": leader.pod_id,
+            "new_leaders": sorted({node.leader_id for node in cluster.live()}),
+            "time_to_new_leader_s": took,
+            # From the first node, usually the winner itself, to the last one
+            "informed_spread_s": informed_spread,
+            "messages": dict(sorted(cluster.messages.items())),
+            "messages_total": sum(cluster.messages.values()),
+            "messages_per_s": sum(cluster.messages.values()) / window,
+            # The busiest pod, usually the leader
+            "max_received_per_s": max(cluster.received.values(), default=0) / window,
+            # Roughly the most sockets one pod had open at once, per endpoint
+            "peak_inflight_per_node": cluster.peak_inflight(),
+            "nodes_with_wrong_leader": len(wrong),
+            "label_patches": cluster.k8s.patches,
+            "labelled_leaders": cluster.labelled_leaders(),
+            "wall_time_s": time.monotonic() - started,
+        }
+    )
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--election-type", default="normal")
+    parser.add_argument(
+        "--scenario",
+        default="kill-leader",
+        choices=[
+            "kill-leader",
+            "pause-leader",
+            "partition",
+            "missed-coordinator",
+            "steady",
+        ],
+    )
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="stretch the heartbeat interval and peer timeouts by this factor",
+    )
+    parser.add_argument(
+        "--env", nargs="*", default=[], metavar="KEY=VALUE", help="extra app settings"
+    )
+    parser.add_argument("--output", help="also write the result as JSON here")
+    parser.add_argument(
+        "--trace", help="write the election trace of all nodes here (Chrome format)"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="log the nodes to stderr"
+    )
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    # Every node has both ends of its peer connections in this process. Close
+    # idle ones quickly and cap the ones in use so large clusters fit in the
+    # file descriptor limit; --env overrides both
+    env = {
+        "WEB_PORT": str(args.port),
+        "ELECTION_TYPE": args.election_type,
+        "HEARTBEAT_INTERVAL": str(args.time_scale),
+        "PEER_KEEPALIVE": str(2 * args.time_scale),
+        "PEER_CONN_LIMIT": str(max(4, (hard - 1000) // (4 * args.nodes))),
+        # All nodes share one loop and take no user requests, one lag sampler
+        # per node would only add wakeups
+        "LOOP_LAG_INTERVAL": "0",
+    }
+    env.update(item.split("=", 1) for item in args.env)
+
+    listener = None
+    if args.verbose:
+        listener = setup_logging(fmt="text", stream=sys.stderr)
+    else:
+        logging.getLogger().addHandler(logging.NullHandler())
+    cluster = Cluster(
+        args.nodes, args.port, env, seed=args.seed, time_scale=args.time_scale
+    )
+    try:
+        result = await run_scenario(cluster, args.scenario, args.timeout)
+    finally:
+        await cluster.stop()
+        if args.trace:
+            with open(args.trace, "w") as f:
+                json.dump(
+                    merge([node.module.TRACE.dump() for node in cluster.nodes]), f
+                )
+        if listener is not None:
+            listener.stop()
+    result.update(
+        {
+            "nodes": args.nodes,
+            "election_type": args.election_type,
+            "time_scale": args.time_scale,
+        }
+    )
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 import asyncio
+import json
 from unittest import mock
 
 import pytest
@@ -153,6 +154,40 @@ async def test_leader_election_no_response_becomes_leader():
         mock_coordinator.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_leader_election_retries_a_stale_term():
+    """Test a 409 to a stale election catches up the term and sends it again."""
+    from mesh import MeshResponse
+
+    app.POD_ID = 50
+    app.POD_IP = "10.0.0.50"
+    app.IP_TO_ID = {"10.0.0.2": 60}
+    app.ELECTION_IN_PROCESS = False
+    app.TERM = app.ELECTION_TERM = 2
+    app.leader = {"id": -1, "url": ""}
+    sent = []
+
+    async def mock_send_election(improved=False):
+        sent.append(app.ELECTION_TERM)
+        if app.ELECTION_TERM <= 7:
+            return [MeshResponse(409, {"term": 7})]
+        return [MeshResponse(200, "OK")]
+
+    with (
+        mock.patch("app.send_election", side_effect=mock_send_election),
+        mock.patch(
+            "app.send_coordinator", new_callable=mock.AsyncMock
+        ) as mock_coordinator,
+        mock.patch("app.remove_leader_label", new_callable=mock.AsyncMock),
+    ):
+        await app.leader_election()
+
+    assert sent == [3, 8]
+    # The higher pod answered OK in the fresh term, it takes over
+    assert app.leader["id"] == -1
+    mock_coordinator.assert_not_awaited()
+
+
 @pytest.mark.asyncio
 async def test_receive_coordinator_updates_leader(cli):
     """Test that receiving coordinator message updates the leader."""
@@ -171,3 +206,989 @@ async def test_receive_coordinator_updates_leader(cli):
         assert resp.status == 200
         assert app.leader["id"] == 100
         assert app.leader["url"] == "10.0.0.100"
+
+
+@pytest.mark.asyncio
+async def test_peer_request_reuses_pooled_connection():
+    """Test that consecutive peer requests share one kept-alive connection."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    transports = set()
+
+    async def pod_id(request):
+        transports.add(id(request.transport))
+        return web.json_response(60)
+
+    peer_app = web.Application()
+    peer_app.router.add_get("/pod_id", pod_id)
+    server = TestServer(peer_app, host="127.0.0.1")
+    await server.start_server()
+    app.CONTROL_PORT = server.port
+    try:
+        for _ in range(3):
+            resp = await app.peer_request(
+                "GET", "127.0.0.1", "/pod_id", timeout=app.PROBE_TIMEOUT
+            )
+            assert resp.status == 200
+            assert await resp.json() == 60
+        assert len(transports) == 1
+    finally:
+        await app.close_peer_session()
+        await server.close()
+        app.CONTROL_PORT = 8080
+
+
+@pytest.mark.asyncio
+async def test_follower_proxies_get_cookie_to_the_leader():
+    """Test followers forward /get_cookie over one kept-alive connection."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer, make_mocked_request
+
+    transports = set()
+    forwarded = []
+
+    async def leader_cookie(request):
+        transports.add(id(request.transport))
+        forwarded.append(request.headers.get(app.FORWARDED_HEADER))
+        return web.json_response("Cookie Pod ID: 60 and leader is: 60")
+
+    leader_app = web.Application()
+    leader_app.router.add_get("/get_cookie", leader_cookie)
+    server = TestServer(leader_app, host="127.0.0.1")
+    await server.start_server()
+    app.POD_ID = 50
+    app.leader = {"id": 60, "url": "127.0.0.1"}
+    proxied = sum(app.PROXY_SECONDS.children[()].counts)
+    try:
+        with (
+            mock.patch("app.COOKIE_ROUTING", "proxy"),
+            mock.patch("app.WEB_PORT", server.port),
+        ):
+            for _ in range(3):
+                resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+                assert resp.status == 200
+                assert json.loads(resp.body).endswith("leader is: 60")
+            assert len(transports) == 1
+            assert forwarded == ["50"] * 3
+            assert sum(app.PROXY_SECONDS.children[()].counts) == proxied + 3
+
+            # A forwarded request is answered here even if the leader moved on
+            resp = await app.get_cookie(
+                make_mocked_request(
+                    "GET", "/get_cookie", headers={app.FORWARDED_HEADER: "40"}
+                )
+            )
+            assert json.loads(resp.body).endswith("Pod ID: 50 and leader is: 60")
+            assert len(forwarded) == 3
+
+            # The leader short-circuits, and without one there is nothing to proxy to
+            app.leader = {"id": 50, "url": "10.0.0.1"}
+            resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+            assert json.loads(resp.body).endswith("leader is: 50")
+            assert resp.keep_alive is not False
+            app.leader = {"id": -1, "url": ""}
+            resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+            assert resp.status == 503
+    finally:
+        await app.close_proxy_session()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_get_cookie_serves_the_fortune_file_once_loaded(tmp_path):
+    """Test cookiesList is served until the fortune file has been loaded."""
+    from aiohttp.test_utils import make_mocked_request
+
+    from fortunes import FortuneFile
+
+    path = tmp_path / "fortunes"
+    path.write_text("From the file, this fortune is.\n%\n")
+    app.POD_ID = 50
+    app.leader = {"id": 50, "url": "10.0.0.1"}
+    fortunes = FortuneFile(str(path))
+    try:
+        with mock.patch("app.FORTUNES", fortunes):
+            resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+            assert json.loads(resp.body).split(" Pod ID")[0] in app.cookiesList
+
+            await fortunes.load()
+            resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+            assert json.loads(resp.body).startswith("From the file, this fortune is.")
+    finally:
+        fortunes.close()
+
+
+@pytest.mark.asyncio
+async def test_kubernetes_client_is_set_up_once_on_first_use():
+    """Test K8S_INIT=lazy callers share one client set up off the event loop."""
+    previous, app.v1 = app.v1, None
+    try:
+        with mock.patch("app.init_kubernetes", wraps=app.init_kubernetes) as init:
+            apis = await asyncio.gather(
+                app.kubernetes_client(), app.kubernetes_client()
+            )
+        init.assert_called_once()
+        assert apis[0] is apis[1] is app.v1 is not None
+    finally:
+        app.v1 = previous
+
+
+def test_startup_phases_are_recorded_once():
+    """Test startup phases keep the first time they were reached."""
+    app.STARTUP.clear()
+    app.startup_phase("listen")
+    first = app.STARTUP["listen"]
+    app.startup_phase("listen")
+
+    assert app.STARTUP["listen"] == first > 0
+    assert 'bully_startup_seconds{phase="listen"}' in app.METRICS.render()
+    app.STARTUP.clear()
+
+
+@pytest.mark.asyncio
+async def test_watch_endpoints_retries_a_failing_kubernetes_client():
+    """Test a failing client init is retried and DNS is used until the watch syncs."""
+    from membership import FakeWatchSource, Membership, PeerTable
+
+    app.POD_IP = "10.0.0.1"
+    app.IP_TO_ID = {}
+    app.IP_LIST = []
+    app.MEMBERSHIP = Membership()
+    app.PEERS = PeerTable()
+    app.MEMBERSHIP_SYNCED = False
+    source = FakeWatchSource()
+    client = mock.AsyncMock(side_effect=[RuntimeError("no config"), mock.Mock()])
+
+    with (
+        mock.patch("app.MEMBERSHIP_SOURCE", None),
+        mock.patch("app.kubernetes_client", client),
+        mock.patch("app.EndpointSliceSource", return_value=source),
+        mock.patch("app.fetch_pod_id", return_value=60),
+    ):
+        task = asyncio.create_task(app.watch_endpoints(min_backoff=0.01))
+        await asyncio.sleep(0.05)
+        assert client.await_count == 2
+        assert not app.MEMBERSHIP_SYNCED
+        source.set_slice("a", ["10.0.0.1", "10.0.0.2"])
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    assert app.MEMBERSHIP_SYNCED
+    assert app.IP_LIST == ["10.0.0.2"]
+    app.MEMBERSHIP_SYNCED = False
+
+
+@pytest.mark.asyncio
+async def test_watch_membership_probes_only_joining_pods():
+    """Test endpoint deltas update the peer table and only new pods are probed."""
+    from membership import FakeWatchSource, Membership, PeerTable
+
+    app.POD_IP = "10.0.0.1"
+    app.IP_TO_ID = {}
+    app.IP_LIST = []
+    app.MEMBERSHIP = Membership()
+    app.PEERS = PeerTable()
+    source = FakeWatchSource()
+    ids = {"10.0.0.2": 60, "10.0.0.3": 40}
+
+    with mock.patch(
+        "app.fetch_pod_id", side_effect=lambda ip: ids[ip]
+    ) as mock_fetch_pod_id:
+        task = asyncio.create_task(app.watch_membership(source))
+        source.set_slice("a", ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+        await asyncio.sleep(0.05)
+        assert app.IP_TO_ID == {"10.0.0.2": 60, "10.0.0.3": 40}
+        assert app.IP_LIST == ["10.0.0.2", "10.0.0.3"]
+
+        source.set_slice("a", ["10.0.0.1", "10.0.0.2"], kind="MODIFIED")
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    assert app.IP_TO_ID == {"10.0.0.2": 60}
+    assert app.IP_LIST == ["10.0.0.2"]
+    assert mock_fetch_pod_id.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_peers_only_resolves_unknown_pods():
+    """Test cached pod IDs are reused and only new IPs get a /pod_id request."""
+    from membership import PeerTable
+
+    app.PEERS = PeerTable()
+    ids = {"10.0.0.2": 60, "10.0.0.3": 40, "10.0.0.4": 70}
+
+    with mock.patch(
+        "app.fetch_pod_id", side_effect=lambda ip: ids[ip]
+    ) as mock_fetch_pod_id:
+        await app.refresh_peers(["10.0.0.2", "10.0.0.3"])
+        await app.refresh_peers(["10.0.0.2", "10.0.0.3"])
+        assert mock_fetch_pod_id.call_count == 2
+
+        await app.refresh_peers(["10.0.0.2", "10.0.0.4"])
+        assert mock_fetch_pod_id.call_count == 3
+
+    assert app.IP_LIST == ["10.0.0.2", "10.0.0.4"]
+    assert app.IP_TO_ID == {"10.0.0.2": 60, "10.0.0.4": 70}
+    assert app.PEERS.hits == 3
+    assert app.PEERS.misses == 3
+    text = app.METRICS.render()
+    assert 'bully_peer_id_cache_total{result="hit"} 3.0' in text
+    assert 'bully_peer_id_cache_total{result="miss"} 3.0' in text
+
+
+@pytest.mark.asyncio
+async def test_check_leader_evicts_dead_leader():
+    """Test a leader that refuses connections is suspected and dropped from the table."""
+    import aiohttp
+
+    from failure_detector import FailureDetectors
+    from membership import PeerTable
+
+    app.POD_ID = 50
+    app.PEERS = PeerTable()
+    app.PEERS.store("10.0.0.2", 60)
+    app.IP_TO_ID = app.PEERS.id_map()
+    app.DETECTORS = FailureDetectors()
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+
+    refused = aiohttp.ClientConnectorError(mock.Mock(), OSError(111, "refused"))
+    with mock.patch("app.peer_request", side_effect=refused):
+        leader_found, call_election = await app.check_leader()
+
+    assert leader_found is False
+    assert call_election is False
+    assert app.IP_TO_ID == {}
+
+
+@pytest.mark.asyncio
+async def test_check_leader_tolerates_one_slow_probe():
+    """Test a single timed out probe does not mark a recently seen leader as dead."""
+    from failure_detector import FailureDetectors
+
+    app.POD_ID = 50
+    app.IP_TO_ID = {"10.0.0.2": 60}
+    app.DETECTORS = FailureDetectors()
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+
+    with mock.patch("app.peer_request", side_effect=asyncio.TimeoutError()):
+        leader_found, call_election = await app.check_leader()
+
+    assert leader_found is True
+    assert call_election is False
+    assert app.IP_TO_ID == {"10.0.0.2": 60}
+
+
+@pytest.mark.asyncio
+async def test_swim_round_probes_a_silent_leader_through_other_pods():
+    """Test a leader that misses a direct probe is only suspected if helpers fail too."""
+    from probes import ProbeSchedule
+
+    app.POD_ID = 50
+    app.IP_LIST = ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    app.IP_TO_ID = {"10.0.0.2": 60, "10.0.0.3": 40, "10.0.0.4": 30}
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    app.PROBES = ProbeSchedule()
+    app.update_probe_schedule(app.IP_LIST)
+    app.PROBES.order = ["10.0.0.2"]
+
+    with (
+        mock.patch("app.fetch_pod_id", return_value=None),
+        mock.patch("app.probe_indirect", return_value=60) as mock_indirect,
+    ):
+        leader_found, call_election = await app.swim_round()
+    assert leader_found is True
+    assert mock_indirect.call_count == 2
+    assert app.IP_TO_ID["10.0.0.2"] == 60
+
+    app.PROBES.order = ["10.0.0.2"]
+    with (
+        mock.patch("app.fetch_pod_id", return_value=None),
+        mock.patch("app.probe_indirect", return_value=None),
+    ):
+        leader_found, call_election = await app.swim_round()
+    assert leader_found is False
+    assert "10.0.0.2" not in app.IP_TO_ID
+
+
+@pytest.mark.asyncio
+async def test_indirect_probe_handler():
+    """Test POST /probe answers with a peer's ID, 504 if it is silent, 400 for others."""
+    from aiohttp.test_utils import make_mocked_request
+
+    app.IP_LIST = ["10.0.0.2"]
+    request = make_mocked_request("POST", "/probe")
+    request.json = mock.AsyncMock(return_value={"target": "10.0.0.2"})
+    with mock.patch("app.fetch_pod_id", return_value=60):
+        resp = await app.indirect_probe(request)
+    assert resp.status == 200
+    assert json.loads(resp.body) == 60
+    with mock.patch("app.fetch_pod_id", return_value=None):
+        resp = await app.indirect_probe(request)
+    assert resp.status == 504
+
+    request.json = mock.AsyncMock(return_value={})
+    resp = await app.indirect_probe(request)
+    assert resp.status == 400
+
+    # Hosts that are not peers are never probed
+    request.json = mock.AsyncMock(return_value={"target": "203.0.113.7"})
+    with mock.patch("app.fetch_pod_id", return_value=60) as fetch:
+        resp = await app.indirect_probe(request)
+    assert resp.status == 400
+    fetch.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_pod_id_body_is_versioned_on_request():
+    """Test /pod_id stays a bare int for older pods and carries the leader with ?v=2."""
+    from aiohttp.test_utils import make_mocked_request
+
+    app.POD_ID = 50
+    app.POD_IP = "10.0.0.1"
+    app.LEADER_TERM = 4
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+
+    resp = await app.pod_id(make_mocked_request("GET", "/pod_id"))
+    assert json.loads(resp.body) == 50
+    resp = await app.pod_id(make_mocked_request("GET", "/pod_id?v=2"))
+    assert json.loads(resp.body) == {
+        "v": 2,
+        "id": 50,
+        "leader": {"id": 60, "url": "10.0.0.2"},
+        "term": 4,
+    }
+    assert await app.mesh_pod_id(None) == (200, 50)
+    assert (await app.mesh_pod_id({"v": 2}))[1]["term"] == 4
+
+
+def test_read_pod_id_follows_newer_piggybacked_leader():
+    """Test a stale pod adopts the leader named in a probe reply instead of electing."""
+    app.POD_ID = 50
+    app.POD_IP = "10.0.0.1"
+    app.TERM = app.LEADER_TERM = 3
+    app.leader = {"id": 90, "url": "10.0.0.9"}
+
+    def reply(leader_id, term):
+        return {"v": 2, "id": 70, "leader": {"id": leader_id, "url": "x"}, "term": term}
+
+    assert app.read_pod_id(70) == 70
+    # Older term, or lower than this pod: ignored
+    assert app.read_pod_id(reply(80, 2)) == 70
+    assert app.read_pod_id(reply(40, 5)) == 70
+    assert app.leader["id"] == 90
+
+    assert app.read_pod_id(reply(80, 4)) == 70
+    assert app.leader == {"id": 80, "url": "x"}
+    assert app.LEADER_TERM == 4
+    assert app.TERM == 4
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_asks_a_peer_before_electing():
+    """Test a pod whose leader is gone catches up from a peer without an election."""
+    app.POD_ID = 50
+    app.IP_LIST = ["10.0.0.3"]
+    app.IP_TO_ID = {"10.0.0.3": 70}
+    app.TERM = app.LEADER_TERM = 3
+    app.leader = {"id": 90, "url": "10.0.0.9"}
+
+    async def fetch(pod_ip):
+        app.set_leader(70, pod_ip, 4)
+        return 70
+
+    with mock.patch("app.fetch_pod_id", side_effect=fetch):
+        assert await app.ask_peer_for_leader() is True
+    with mock.patch("app.fetch_pod_id", return_value=70):
+        assert await app.ask_peer_for_leader() is False
+    assert app.leader == {"id": 70, "url": "10.0.0.3"}
+
+
+@pytest.mark.asyncio
+async def test_ring_election_passes_on_the_higher_candidate():
+    """Test a ring pod forwards higher candidates, replaces lower ones once and wins with its own."""
+    app.POD_ID = 50
+    app.TERM = 3
+    app.IP_LIST = ["10.0.0.2", "10.0.0.3"]
+    app.IP_TO_ID = {"10.0.0.2": 60, "10.0.0.3": 40}
+    app.RING_SEEN = None
+    assert app.ring_successors() == ["10.0.0.2", "10.0.0.3"]
+
+    with (
+        mock.patch("app.forward_ring", new_callable=mock.AsyncMock) as forward,
+        mock.patch("app.win_ring_election", new_callable=mock.AsyncMock) as win,
+    ):
+        app.on_ring_election({"candidate": 60, "hops": 2, "term": 3})
+        await asyncio.sleep(0)
+        forward.assert_called_once_with(60, 3, {"election_id": None, "term": 3})
+
+        # A lower candidate is replaced by this pod's own ID
+        forward.reset_mock()
+        app.RING_SEEN = None
+        app.on_ring_election(
+            {"candidate": 40, "hops": 1, "term": 4, "election_id": "40-1"}
+        )
+        await asyncio.sleep(0)
+        forward.assert_called_once_with(50, 1, {"election_id": "40-1", "term": 4})
+        assert app.TERM == 4
+
+        # ...but only once per election
+        forward.reset_mock()
+        app.RING_SEEN = (4, 50, app.time.monotonic())
+        app.on_ring_election({"candidate": 40, "hops": 1, "term": 4})
+        await asyncio.sleep(0)
+        forward.assert_not_called()
+
+        app.on_ring_election({"candidate": 50, "hops": 3, "term": 4})
+        await asyncio.sleep(0)
+        win.assert_called_once()
+
+        # A leader was announced since, this pod's candidacy is stale
+        win.reset_mock()
+        app.RING_SEEN = None
+        app.on_ring_election({"candidate": 50, "hops": 3, "term": 4})
+        await asyncio.sleep(0)
+        win.assert_not_called()
+
+        # Candidates of an older term are turned away with the current one
+        status, body = app.on_ring_election({"candidate": 60, "hops": 1, "term": 2})
+        assert (status, body) == (409, {"term": 4})
+        forward.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_ring_election_skips_dead_successor():
+    """Test the ring closes around a successor that does not answer."""
+    app.POD_ID = 50
+    app.TERM = 3
+    app.IP_TO_ID = {"10.0.0.2": 60, "10.0.0.3": 40}
+    app.RING_SEEN = None
+    ok = mock.Mock(status=200)
+    refused = app.aiohttp.ClientConnectorError(mock.Mock(), OSError(111, "refused"))
+    election = {"election_id": "50-1", "term": 3}
+
+    with mock.patch("app.peer_request", side_effect=[refused, ok]) as request:
+        await app.forward_ring(50, 1, election)
+
+    assert [call.args[1] for call in request.call_args_list] == [
+        "10.0.0.2",
+        "10.0.0.3",
+    ]
+    assert request.call_args.kwargs["json"] == {
+        "candidate": 50,
+        "hops": 1,
+        "election_id": "50-1",
+        "term": 3,
+    }
+    assert app.ring_forwarded() == 50
+
+
+@pytest.mark.asyncio
+async def test_coordinator_of_an_older_term_is_rejected():
+    """Test a delayed coordinator message cannot replace a leader elected later."""
+    app.POD_ID = 50
+    app.TERM = app.LEADER_TERM = 5
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+
+    status, body = await app.on_coordinator({"id": 70, "url": "10.0.0.4", "term": 4})
+    assert (status, body) == (409, {"term": 5})
+    assert app.leader == {"id": 60, "url": "10.0.0.2"}
+
+    # Same term, a higher leader wins
+    with mock.patch("app.remove_leader_label", new_callable=mock.AsyncMock):
+        status, _ = await app.on_coordinator({"id": 70, "url": "10.0.0.4", "term": 5})
+    assert status == 200
+    assert app.leader == {"id": 70, "url": "10.0.0.4"}
+
+    # A newer term replaces it even with a lower ID, e.g. after 70 died
+    with mock.patch("app.remove_leader_label", new_callable=mock.AsyncMock):
+        status, _ = await app.on_coordinator({"id": 60, "url": "10.0.0.2", "term": 6})
+    assert status == 200
+    assert (app.leader["id"], app.LEADER_TERM, app.TERM) == (60, 6, 6)
+
+
+@pytest.mark.asyncio
+async def test_coordinator_is_relayed_down_a_tree_and_retried():
+    """Test a tree broadcast retries pods behind failed or old relays directly."""
+    from mesh import MeshResponse
+
+    app.POD_ID = 90
+    app.ELECTION_TERM = 2
+    app.IP_LIST = [f"10.0.0.{i}" for i in range(1, 7)]
+    app.COORDINATOR_FANOUT = 2
+    sent = []
+
+    async def request(method, pod_ip, endpoint, timeout=None, json=None):
+        sent.append((pod_ip, json.get("relay")))
+        if pod_ip == "10.0.0.1":
+            # Relays, but could not reach one of its subtree
+            return MeshResponse(200, {"missed": ["10.0.0.3"]})
+        # 10.0.0.4 is an older pod that does not know about relays
+        return MeshResponse(200, "OK")
+
+    try:
+        with mock.patch("app.peer_request", side_effect=request):
+            await app.send_coordinator()
+    finally:
+        app.COORDINATOR_FANOUT = 0
+
+    assert sent[:2] == [
+        ("10.0.0.1", ["10.0.0.2", "10.0.0.3"]),
+        ("10.0.0.4", ["10.0.0.5", "10.0.0.6"]),
+    ]
+    assert sorted(sent[2:]) == [
+        ("10.0.0.3", None),
+        ("10.0.0.5", None),
+        ("10.0.0.6", None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_relay_reports_the_pods_it_missed():
+    """Test a pod relays an accepted coordinator message and lists who did not answer."""
+    app.POD_ID = 50
+    app.POD_IP = "10.0.0.1"
+    app.IP_LIST = ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    app.TERM = app.LEADER_TERM = 1
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    app.COORDINATOR_FANOUT = 0
+    data = {"id": 90, "url": "10.0.0.9", "term": 2}
+
+    async def forward(payload, targets, fanout):
+        assert payload == data
+        assert (targets, fanout) == (["10.0.0.3", "10.0.0.4"], 2)
+        return ["10.0.0.4"]
+
+    with (
+        mock.patch("app.disseminate", side_effect=forward),
+        mock.patch("app.remove_leader_label", new_callable=mock.AsyncMock),
+    ):
+        status, body = await app.on_coordinator(
+            {**data, "relay": ["10.0.0.3", "10.0.0.4", "203.0.113.7"], "fanout": 2}
+        )
+    # Hosts that are not peers of this pod are not sent to, only reported
+    assert (status, body) == (200, {"missed": ["203.0.113.7", "10.0.0.4"]})
+    assert app.leader == {"id": 90, "url": "10.0.0.9"}
+
+
+@pytest.mark.asyncio
+async def test_coordinator_naming_this_pod_keeps_its_label():
+    """Test the leader found by an improved election labels itself when announced."""
+    from labels import LabelReconciler
+
+    app.POD_ID = 90
+    app.POD_IP = "10.0.0.9"
+    app.TERM = app.LEADER_TERM = 2
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    app.LABELS = LabelReconciler(mock.AsyncMock())
+
+    with mock.patch("app.schedule_step_down") as step_down:
+        status, _ = await app.on_coordinator({"id": 90, "url": "10.0.0.9", "term": 3})
+
+    assert status == 200
+    assert app.leader == {"id": 90, "url": "10.0.0.9"}
+    assert app.LABELS.desired == "leader"
+    step_down.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_coordinator_lower_than_this_pod_starts_an_election():
+    """Test a pod does not follow a lower leader, it holds its own election."""
+    app.POD_ID = 50
+    app.TERM = app.LEADER_TERM = 5
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+
+    with mock.patch("app.general_election", new_callable=mock.AsyncMock) as election:
+        status, _ = await app.on_coordinator({"id": 40, "url": "10.0.0.3", "term": 6})
+        await asyncio.sleep(0)
+
+    assert status == 409
+    election.assert_awaited_once()
+    assert app.leader["id"] == 60
+    assert app.TERM == 6
+
+
+@pytest.mark.asyncio
+async def test_election_triggers_merge_into_one():
+    """Test triggers while an election is pending start no second one, covered terms none at all."""
+    app.POD_ID = 50
+    app.TERM = app.LEADER_TERM = app.ELECTION_TERM = 5
+    app.ELECTION_TYPE = "normal"
+    app.ELECTION_TASK = None
+    app.IP_TO_ID = {"10.0.0.2": 60}
+
+    with (
+        mock.patch("app.leader_election", new_callable=mock.AsyncMock) as election,
+        mock.patch("app.ELECTION_BACKOFF", 0.05),
+    ):
+        await app.general_election()
+        await app.general_election()
+        assert app.on_election({"id": 40, "term": 6}) == (200, "OK")
+        # Already held an election in term 5
+        assert app.on_election({"id": 40, "term": 5}) == (409, {"term": 6})
+        await asyncio.wait_for(app.ELECTION_TASK, 1)
+
+    election.assert_awaited_once()
+    assert app.TERM == 6
+
+
+@pytest.mark.asyncio
+async def test_election_skipped_when_leader_announced_during_backoff():
+    """Test a coordinator arriving during the backoff spares this pod its election."""
+    app.POD_ID = 50
+    app.LEADER_TERM = 5
+    app.ELECTION_TASK = None
+    app.IP_TO_ID = {"10.0.0.2": 60}
+
+    async def announce(delay):
+        app.LEADER_TERM = 6
+
+    with (
+        mock.patch("app.leader_election", new_callable=mock.AsyncMock) as election,
+        mock.patch("app.asyncio.sleep", side_effect=announce),
+    ):
+        await app.run_election()
+
+    election.assert_not_awaited()
+
+
+def test_next_heartbeat_delay_with_multi_second_interval():
+    """Test a just learned leader with a 2s heartbeat interval is not probed early."""
+    from failure_detector import FailureDetectors
+
+    app.POD_ID = 50
+    app.DETECTORS = FailureDetectors(first_interval=2 * 1.3)
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    with (
+        mock.patch("app.HEARTBEAT_INTERVAL", 2.0),
+        mock.patch("app.PROBE_MODE", "leader"),
+    ):
+        assert app.next_heartbeat_delay() == 2.0
+
+
+def test_closed_mesh_link_to_leader_wakes_heartbeat():
+    """Test losing the mesh link to the leader suspects it without waiting for a probe."""
+    from failure_detector import FailureDetectors
+
+    app.POD_ID = 50
+    app.DETECTORS = FailureDetectors()
+    app.DETECTORS.get("10.0.0.2").heartbeat()
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    app.HEARTBEAT_WAKE = asyncio.Event()
+
+    app.mesh_link_closed("10.0.0.3")
+    assert not app.HEARTBEAT_WAKE.is_set()
+
+    app.mesh_link_closed("10.0.0.2")
+    assert app.HEARTBEAT_WAKE.is_set()
+    assert app.DETECTORS.phi("10.0.0.2") >= 1
+
+
+@pytest.mark.asyncio
+async def test_cluster_view_includes_self_and_leader():
+    """Test GET /cluster_view returns the known peers, this pod and the leader."""
+    from aiohttp.test_utils import make_mocked_request
+
+    from membership import PeerTable
+
+    app.POD_ID = 50
+    app.POD_IP = "10.0.0.1"
+    app.PEERS = PeerTable()
+    app.PEERS.store("10.0.0.2", 60)
+    app.IP_TO_ID = app.PEERS.id_map()
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+
+    resp = await app.cluster_view(make_mocked_request("GET", "/cluster_view"))
+
+    data = json.loads(resp.body)
+    assert data["version"] == 1
+    assert data["leader"] == {"id": 60, "url": "10.0.0.2"}
+    assert data["peers"] == {"10.0.0.1": 50, "10.0.0.2": 60}
+
+
+@pytest.mark.asyncio
+async def test_sync_cluster_view_fills_misses_from_one_peer():
+    """Test missing IDs are taken from a peer's view instead of probing each pod."""
+    from membership import PeerTable
+
+    app.POD_ID = 50
+    app.PEERS = PeerTable()
+    app.UNRESOLVED = {}
+    app.GOSSIP_FANOUT = 1
+    app.leader = {"id": -1, "url": ""}
+    view = {
+        "version": 3,
+        "id": 60,
+        "leader": {"id": 70, "url": "10.0.0.4"},
+        "peers": {"10.0.0.2": 60, "10.0.0.3": 40, "10.0.0.4": 70},
+    }
+    ip_list = ["10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.5"]
+
+    try:
+        with (
+            mock.patch("app.fetch_cluster_view", return_value=view) as mock_view,
+            mock.patch("app.fetch_pod_id") as mock_fetch_pod_id,
+        ):
+            await app.refresh_peers(ip_list)
+
+        assert mock_view.call_count == 1
+        mock_fetch_pod_id.assert_not_called()
+        assert app.IP_TO_ID == {"10.0.0.2": 60, "10.0.0.3": 40, "10.0.0.4": 70}
+        assert app.UNRESOLVED == {"10.0.0.5": 1}
+        assert app.leader == {"id": 70, "url": "10.0.0.4"}
+    finally:
+        app.GOSSIP_FANOUT = 0
+
+
+@pytest.mark.asyncio
+async def test_step_down_drains_without_exiting():
+    """Test step-down refuses new cookies, waits for in-flight ones and closes connections."""
+    from aiohttp.test_utils import make_mocked_request
+
+    app.POD_ID = 50
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    app.INFLIGHT["user"] = 0
+    connection = mock.Mock()
+    app.RUNNER = mock.Mock()
+    app.RUNNER.server.connections = [connection]
+
+    try:
+        with (
+            mock.patch("app.remove_leader_label", new_callable=mock.AsyncMock) as rm,
+            mock.patch("os._exit") as mock_exit,
+        ):
+            # A request that arrived before the step-down and is still running
+            finished = asyncio.Event()
+
+            async def slow_handler(request):
+                await finished.wait()
+                return await app.get_cookie(request)
+
+            request = make_mocked_request("GET", "/get_cookie")
+            in_flight = asyncio.create_task(app.admission(request, slow_handler))
+            await asyncio.sleep(0)
+            task = asyncio.create_task(app.step_down())
+            await asyncio.sleep(0.05)
+
+            resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+            assert resp.status == 503
+            connection.close.assert_not_called()
+            assert not task.done()
+
+            finished.set()
+            await asyncio.wait_for(in_flight, 1)
+            await asyncio.wait_for(task, 1)
+
+        rm.assert_awaited_once()
+        connection.close.assert_called_once()
+        mock_exit.assert_not_called()
+        assert app.STEPPING_DOWN is False
+        resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+        assert resp.status == 200
+    finally:
+        app.RUNNER = None
+
+
+@pytest.mark.asyncio
+async def test_cookie_body_is_built_from_fragments():
+    """Test the pre-serialized cookie bodies match plain JSON encoding."""
+    from aiohttp.test_utils import make_mocked_request
+
+    app.POD_ID = 50
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    with mock.patch("random.choice", lambda fragments: fragments[1]):
+        resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+
+    expected = app.cookiesList[1] + " Pod ID: 50 and leader is: 60"
+    assert resp.body == json.dumps(expected).encode()
+    assert resp.headers["Content-Type"] == "application/json; charset=utf-8"
+
+
+@pytest.mark.asyncio
+async def test_admission_sheds_user_requests_before_control_plane():
+    """Test user requests get 503 under load while peer requests still pass."""
+    from aiohttp import web
+    from aiohttp.test_utils import make_mocked_request
+
+    def on_port(path, port):
+        transport = mock.Mock()
+        transport.get_extra_info.return_value = ("10.0.0.1", port)
+        return make_mocked_request("GET", path, transport=transport)
+
+    async def handler(request):
+        return web.Response(text="OK")
+
+    with (
+        mock.patch("app.WEB_PORT", 8080),
+        mock.patch("app.CONTROL_PORT", 9090),
+        mock.patch("app.LOOP_LAG", 0.5),
+    ):
+        resp = await app.admission(on_port("/get_cookie", 8080), handler)
+        assert resp.status == 503
+        resp = await app.admission(on_port("/pod_id", 9090), handler)
+        assert resp.status == 200
+        resp = await app.admission(on_port("/readiness", 8080), handler)
+        assert resp.status == 200
+
+        # Each kind of request is only served on its own port
+        with pytest.raises(web.HTTPNotFound):
+            await app.admission(on_port("/receive_election", 8080), handler)
+        with pytest.raises(web.HTTPNotFound):
+            await app.admission(on_port("/get_cookie", 9090), handler)
+
+        with (
+            mock.patch("app.LOOP_LAG", 0.0),
+            mock.patch.dict(app.INFLIGHT, {"control": app.CONTROL_MAX_INFLIGHT}),
+        ):
+            resp = await app.admission(on_port("/get_cookie", 8080), handler)
+            assert resp.status == 200
+            resp = await app.admission(on_port("/pod_id", 9090), handler)
+            assert resp.status == 503
+            # Mesh links last for the life of the pods and are not counted
+            resp = await app.admission(on_port("/mesh", 9090), handler)
+            assert resp.status == 200
+
+        link_open = asyncio.Event()
+        release = asyncio.Event()
+
+        async def mesh_handler(request):
+            link_open.set()
+            await release.wait()
+            return web.Response(text="OK")
+
+        link = asyncio.create_task(app.admission(on_port("/mesh", 9090), mesh_handler))
+        await link_open.wait()
+        assert app.INFLIGHT["control"] == 0
+        release.set()
+        await link
+    assert app.INFLIGHT == {"user": 0, "control": 0}
+
+
+def test_lagging_loop_stops_reading_user_connections():
+    """Test user connections are paused while the loop lags, peer ones are not."""
+
+    def connection(port):
+        conn = mock.Mock()
+        conn.transport.get_extra_info.return_value = ("10.0.0.1", port)
+        return conn
+
+    user, peer = connection(8080), connection(9090)
+    app.RUNNER = mock.Mock()
+    app.RUNNER.server.connections = [user, peer]
+    try:
+        with mock.patch("app.WEB_PORT", 8080), mock.patch("app.CONTROL_PORT", 9090):
+            with mock.patch("app.LOOP_LAG", 0.3):
+                app.throttle_user_connections()
+                app.throttle_user_connections()
+            user.pause_reading.assert_called_once()
+            peer.pause_reading.assert_not_called()
+
+            with mock.patch("app.LOOP_LAG", 0.08):
+                app.throttle_user_connections()
+            user.resume_reading.assert_not_called()
+            with mock.patch("app.LOOP_LAG", 0.01):
+                app.throttle_user_connections()
+            user.resume_reading.assert_called_once()
+            assert not app.THROTTLED
+    finally:
+        app.RUNNER = None
+
+
+@pytest.mark.asyncio
+async def test_profile_returns_collapsed_stacks_of_the_loop():
+    """Test /debug/profile samples the event loop thread and checks its query."""
+    from aiohttp import web
+    from aiohttp.test_utils import make_mocked_request
+
+    with pytest.raises(web.HTTPBadRequest):
+        await app.profile(make_mocked_request("GET", "/debug/profile?seconds=600"))
+
+    resp = await app.profile(
+        make_mocked_request("GET", "/debug/profile?seconds=0.1&hz=500")
+    )
+    assert resp.status == 200
+    assert any(line.startswith("MainThread;") for line in resp.text.splitlines())
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in resp.text.splitlines())
+    assert app.PROFILING is False
+
+
+@pytest.mark.asyncio
+async def test_metrics_exposes_cookie_latency_and_leader():
+    """Test GET /metrics reports served cookies, the leader and the peer count."""
+    from aiohttp.test_utils import make_mocked_request
+
+    app.POD_ID = 50
+    app.leader = {"id": 60, "url": "10.0.0.2"}
+    app.IP_TO_ID = {"10.0.0.2": 60, "10.0.0.3": 40}
+    served = app.COOKIE_SECONDS.children[()].counts[:]
+
+    await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+    # Refusals during a step-down are timed as well
+    with mock.patch("app.STEPPING_DOWN", True):
+        refused = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+    assert refused.status == 503
+    resp = await app.metrics(make_mocked_request("GET", "/metrics"))
+
+    assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = resp.body.decode()
+    assert "bully_leader_id 60.0" in text
+    assert "bully_known_peers 2.0" in text
+    assert sum(app.COOKIE_SECONDS.children[()].counts) == sum(served) + 2
+    assert "bully_get_cookie_seconds_count" in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_add_the_workers_cookie_latency(tmp_path):
+    """Test the agent's /metrics sums what the workers serve on their sockets."""
+    from aiohttp import web
+    from aiohttp.test_utils import make_mocked_request
+
+    state = mock.Mock(path=str(tmp_path / "bully.state"))
+    count = sum(app.COOKIE_SECONDS.children[()].counts)
+    worker = web.Application()
+    worker.router.add_get("/metrics", app.metrics_snapshot)
+    runner = web.AppRunner(worker)
+    await runner.setup()
+    try:
+        with mock.patch("app.SHARED_STATE", state):
+            await web.UnixSite(runner, app.worker_metrics_path(0)).start()
+            # Worker 1 is not listening, its metrics are left out
+            with mock.patch("app.WORKER_PROCESSES", [mock.Mock(), mock.Mock()]):
+                resp = await app.metrics(make_mocked_request("GET", "/metrics"))
+    finally:
+        await runner.cleanup()
+
+    # This process stands in for the worker, so its cookies count twice
+    assert f"bully_get_cookie_seconds_count {2 * count}" in resp.body.decode()
+
+
+@pytest.mark.asyncio
+async def test_worker_serves_cookies_from_the_shared_leader_state(tmp_path):
+    """Test leader changes reach the workers through the shared state block."""
+    from aiohttp.test_utils import make_mocked_request
+
+    from shared_state import SharedState
+
+    agent_state = SharedState.create(str(tmp_path / "state"))
+    app.POD_ID = 50
+    app.leader = {"id": -1, "url": ""}
+    try:
+        app.SHARED_STATE = agent_state
+        app.set_leader(50, "10.0.0.1")
+
+        # A worker process only has the mapped block
+        app.WORKER = True
+        app.SHARED_STATE = SharedState.open(agent_state.path)
+        app.leader = {"id": -1, "url": ""}
+        resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+        assert resp.status == 200
+        assert json.loads(resp.body).endswith("leader is: 50")
+
+        agent_state.write(60, "10.0.0.2", True, True)
+        resp = await app.get_cookie(make_mocked_request("GET", "/get_cookie"))
+        assert resp.status == 503
+    finally:
+        app.SHARED_STATE.close()
+        app.WORKER = False
+        app.SHARED_STATE = None
+        agent_state.close(unlink=True)
@@ -0,0 +1,20 @@
+from broadcast import relay_hops, subtrees
+
+
+def test_subtrees_cover_every_target_once():
+    targets = [f"10.0.0.{i}" for i in range(10)]
+    groups = subtrees(targets, 3)
+    assert len(groups) == 3
+    assert [head for head, _ in groups] == ["10.0.0.0", "10.0.0.4", "10.0.0.8"]
+    assert sorted(ip for head, rest in groups for ip in [head, *rest]) == sorted(
+        targets
+    )
+    assert subtrees([], 3) == []
+    assert subtrees(["a", "b"], 4) == [("a", []), ("b", [])]
+
+
+def test_relay_hops_grow_logarithmically():
+    assert relay_hops(0, 4) == 0
+    assert relay_hops(4, 4) == 1
+    assert relay_hops(5, 4) == 2
+    assert relay_hops(999, 10) == 3
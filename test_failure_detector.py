@@ -0,0 +1,62 @@
+import math
+
+from failure_detector import FailureDetector, FailureDetectors
+
+
+def test_phi_rises_as_heartbeats_stop():
+    detector = FailureDetector(now=0.0)
+    for t in range(1, 20):
+        detector.heartbeat(now=float(t))
+
+    assert detector.phi(now=19.5) < 1
+    assert detector.phi(now=20.5) < detector.phi(now=21.0) < detector.phi(now=22.0)
+    assert detector.phi(now=22.0) > 8
+
+
+def test_phi_with_multi_second_intervals():
+    """Test a fresh heartbeat long before the mean interval gives phi near 0."""
+    detector = FailureDetector(now=0.0, first_interval=2.6)
+    assert detector.phi(now=0.0) < 0.01
+    for t in range(10, 100, 10):
+        detector.heartbeat(now=float(t))
+    assert detector.phi(now=90.0) < 0.01
+    assert detector.phi(now=120.0) > 8
+
+
+def test_phi_adapts_to_irregular_heartbeats():
+    """Test a jittery peer needs a longer silence before it is suspected."""
+    steady = FailureDetector(now=0.0)
+    jittery = FailureDetector(now=0.0)
+    t_steady = t_jittery = 0.0
+    for i in range(40):
+        t_steady += 1.0
+        t_jittery += 0.5 if i % 2 else 1.5
+        steady.heartbeat(now=t_steady)
+        jittery.heartbeat(now=t_jittery)
+
+    assert jittery.phi(now=t_jittery + 2.0) < steady.phi(now=t_steady + 2.0)
+
+
+def test_mark_down_until_next_heartbeat():
+    detector = FailureDetector(now=0.0)
+    detector.mark_down()
+    assert detector.phi(now=0.1) == math.inf
+    detector.heartbeat(now=0.2)
+    assert detector.phi(now=0.3) < 1
+
+
+def test_timeout_follows_probe_latency():
+    detector = FailureDetector(now=0.0)
+    assert detector.timeout(0.5, 2.0) == 0.5
+    for i in range(10):
+        detector.heartbeat(now=float(i + 1), latency=0.8 if i % 2 else 1.0)
+    assert 1.0 < detector.timeout(0.5, 2.0) <= 2.0
+
+
+def test_detectors_reset_and_retain():
+    detectors = FailureDetectors()
+    detectors.get("10.0.0.2", now=0.0).mark_down()
+    assert detectors.reset("10.0.0.2", now=1.0).phi(now=1.0) < 1
+    detectors.get("10.0.0.3", now=0.0)
+    detectors.retain(["10.0.0.3"])
+    assert list(detectors.detectors) == ["10.0.0.3"]
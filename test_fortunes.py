@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from fortunes import SEPARATORS, FortuneFile, FortuneStore
+
+
+def test_store_indexes_fortune_format(tmp_path):
+    path = tmp_path / "fortunes"
+    path.write_bytes(b"%\nFirst one\n%\nSecond,\ntwo lines\n%\n%\nLast\n")
+    store = FortuneStore(str(path))
+    try:
+        assert len(store) == 3
+        assert [store[i] for i in range(3)] == [
+            "First one",
+            "Second,\ntwo lines",
+            "Last",
+        ]
+        assert store.choice() in {"First one", "Second,\ntwo lines", "Last"}
+    finally:
+        store.close()
+
+
+def test_store_one_fortune_per_line_and_empty_file(tmp_path):
+    path = tmp_path / "fortunes"
+    path.write_bytes(b"a\r\nb\n\nc")
+    store = FortuneStore(str(path), separator=SEPARATORS["lines"])
+    assert [store[i] for i in range(len(store))] == ["a", "b", "c"]
+    store.close()
+
+    path.write_bytes(b"")
+    assert len(FortuneStore(str(path))) == 0
+
+
+@pytest.mark.asyncio
+async def test_file_reloads_when_replaced(tmp_path):
+    path = tmp_path / "fortunes"
+    path.write_bytes(b"old\n")
+    fortunes = FortuneFile(str(path), fmt="lines")
+    try:
+        assert not fortunes
+        assert await fortunes.load()
+        assert not await fortunes.load()
+        old = fortunes.store
+
+        new = tmp_path / "fortunes.new"
+        new.write_bytes(b"new one\nnew two\n")
+        os.replace(new, path)
+        assert await fortunes.load()
+        assert len(fortunes) == 2
+        assert fortunes.choice() in {"new one", "new two"}
+        # The replaced mapping is released
+        assert old._mm is None
+        assert fortunes.reloads == 2
+    finally:
+        fortunes.close()
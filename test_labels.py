@@ -0,0 +1,54 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from labels import LabelReconciler
+
+
+@pytest.mark.asyncio
+async def test_reconciler_patches_only_on_change():
+    """Test asking for the same role every heartbeat sends a single PATCH."""
+    patch = mock.AsyncMock()
+    labels = LabelReconciler(patch)
+    labels.start()
+
+    for _ in range(5):
+        labels.set(None)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+    await labels.stop()
+
+    patch.assert_awaited_once_with(None)
+    assert labels.stats()["patches"] == 1
+    assert labels.stats()["requests"] == 5
+
+
+@pytest.mark.asyncio
+async def test_reconciler_coalesces_back_to_back_changes():
+    """Test label then unlabel before the worker runs only applies the last role."""
+    patch = mock.AsyncMock()
+    labels = LabelReconciler(patch)
+    labels.set("leader")
+    labels.set(None)
+    labels.set("leader")
+    labels.start()
+    await asyncio.sleep(0.01)
+    await labels.stop()
+
+    patch.assert_awaited_once_with("leader")
+    assert labels.applied == "leader"
+
+
+@pytest.mark.asyncio
+async def test_reconciler_retries_failed_patch():
+    patch = mock.AsyncMock(side_effect=[RuntimeError("API server down"), None])
+    labels = LabelReconciler(patch, min_backoff=0.001)
+    labels.start()
+    labels.set("leader")
+    await asyncio.sleep(0.05)
+    await labels.stop()
+
+    assert patch.await_count == 2
+    assert labels.stats()["failures"] == 1
+    assert labels.applied == "leader"
@@ -0,0 +1,22 @@
+from loadtest import LatencyHistogram
+
+
+def test_histogram_percentiles_within_precision():
+    histogram = LatencyHistogram()
+    for i in range(1, 1001):
+        histogram.record(i / 1000)  # 1ms .. 1s
+
+    assert abs(histogram.percentile(50) - 0.5) / 0.5 < 0.02
+    assert abs(histogram.percentile(99) - 0.99) / 0.99 < 0.02
+    assert histogram.percentile(100) == histogram.max == 1.0
+    assert histogram.summary_ms()["count"] == 1000
+
+
+def test_histogram_merge():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    a.record(0.001)
+    b.record(2.0)
+    a.merge(b)
+    assert a.total == 2
+    assert a.max == 2.0
+    assert a.percentile(50) < 0.0011
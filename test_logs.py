@@ -0,0 +1,75 @@
+import io
+import json
+import logging
+
+from logs import ContextFilter, JsonFormatter, RateLimitFilter, setup_logging
+
+
+def make_record(msg, *args, **extra):
+    record = logging.LogRecord("bully", logging.INFO, __file__, 1, msg, args, None)
+    for name, value in extra.items():
+        setattr(record, name, value)
+    return record
+
+
+def test_rate_limit_per_key_reports_suppressed():
+    now = [0.0]
+    limiter = RateLimitFilter(rate=1.0, burst=2, clock=lambda: now[0])
+
+    passed = [limiter.filter(make_record("probe %s failed", "a")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Another key has its own bucket
+    assert limiter.filter(make_record("probe failed", key=("probe", "b")))
+
+    now[0] = 1.0
+    record = make_record("probe %s failed", "a")
+    assert limiter.filter(record)
+    assert record.suppressed == 3
+    assert limiter.suppressed == 3
+
+
+def test_rate_limit_keeps_the_most_recently_used_keys():
+    limiter = RateLimitFilter(rate=1.0, burst=1, max_keys=2, clock=lambda: 0.0)
+    assert limiter.filter(make_record("a"))
+    assert limiter.filter(make_record("b"))
+    assert not limiter.filter(make_record("a"))
+    # "b" is the least recently used key now and makes room for "c"
+    assert limiter.filter(make_record("c"))
+    assert list(limiter.buckets) == [("bully", "a"), ("bully", "c")]
+    assert not limiter.filter(make_record("a"))
+
+
+def test_json_formatter_adds_context_and_extra_fields():
+    record = make_record("Starting election, %d nodes", 3, election_id="50-1")
+    ContextFilter(lambda: {"pod_id": 50, "leader": 60}).filter(record)
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "Starting election, 3 nodes"
+    assert entry["level"] == "INFO"
+    assert entry["pod_id"] == 50
+    assert entry["leader"] == 60
+    assert entry["election_id"] == "50-1"
+
+
+def test_queue_logging_writes_json_from_the_listener_thread():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    listener = setup_logging(context=lambda: {"pod_id": 7}, stream=stream)
+    try:
+        logging.getLogger("bully").info("Membership: +%d", 1, extra={"key": "m"})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("bully").exception("Patch failed")
+    finally:
+        listener.stop()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert first["msg"] == "Membership: +1"
+    assert first["pod_id"] == 7
+    assert "key" not in first
+    assert second["level"] == "ERROR"
+    assert "ValueError: boom" in second["exc"]
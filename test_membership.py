@@ -0,0 +1,78 @@
+from membership import FakeWatchSource, Membership, PeerTable
+
+
+def slice_event(kind, name, ips):
+    return {
+        "type": kind,
+        "object": {
+            "metadata": {"name": name},
+            "endpoints": [{"addresses": [ip]} for ip in ips],
+        },
+    }
+
+
+def test_membership_applies_deltas_across_slices():
+    """Test add/modify/delete events turn into joined and left sets."""
+    membership = Membership()
+
+    joined, left = membership.apply(slice_event("ADDED", "a", ["10.0.0.2", "10.0.0.3"]))
+    assert joined == {"10.0.0.2", "10.0.0.3"} and left == set()
+
+    joined, left = membership.apply(slice_event("ADDED", "b", ["10.0.0.4"]))
+    assert joined == {"10.0.0.4"} and left == set()
+
+    joined, left = membership.apply(slice_event("MODIFIED", "a", ["10.0.0.2"]))
+    assert joined == set() and left == {"10.0.0.3"}
+
+    joined, left = membership.apply(slice_event("DELETED", "b", []))
+    assert left == {"10.0.0.4"}
+    assert membership.members == {"10.0.0.2"}
+
+
+def test_membership_reset_drops_slices_missed_while_disconnected():
+    """Test a RESET after a reconnect removes pods whose DELETED event was lost."""
+    membership = Membership()
+    membership.apply(slice_event("ADDED", "a", ["10.0.0.2"]))
+    membership.apply(slice_event("ADDED", "b", ["10.0.0.3"]))
+
+    reset = slice_event("ADDED", "a", ["10.0.0.2", "10.0.0.5"])["object"]
+    joined, left = membership.apply({"type": "RESET", "object": [reset]})
+
+    assert joined == {"10.0.0.5"}
+    assert left == {"10.0.0.3"}
+
+
+def test_membership_ignores_unknown_events():
+    membership = Membership()
+    assert membership.apply({"type": "BOOKMARK", "object": {}}) == (set(), set())
+
+
+def test_fake_watch_source_queues_events():
+    source = FakeWatchSource()
+    source.set_slice("a", ["10.0.0.2"])
+    source.delete_slice("a")
+    membership = Membership()
+    membership.apply(source.queue.get_nowait())
+    assert membership.members == {"10.0.0.2"}
+    membership.apply(source.queue.get_nowait())
+    assert membership.members == set()
+
+
+def test_peer_table_counts_hits_and_misses_and_expires():
+    table = PeerTable(ttl=10)
+    assert table.lookup("10.0.0.2", now=0) is None
+    table.store("10.0.0.2", 60, now=0)
+    assert table.lookup("10.0.0.2", now=5) == 60
+    assert table.lookup("10.0.0.2", now=11) is None
+    assert (table.hits, table.misses) == (1, 2)
+
+
+def test_peer_table_generation_changes_only_on_new_ids():
+    table = PeerTable()
+    table.store("10.0.0.2", 60, now=0)
+    table.store("10.0.0.2", 60, now=1)
+    assert table.generation == 1
+    table.store("10.0.0.2", 61, now=2)
+    table.retain({"10.0.0.3"})
+    assert table.generation == 3
+    assert table.id_map() == {}
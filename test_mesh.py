@@ -0,0 +1,97 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from mesh import MeshUnavailable, PeerMesh
+
+
+async def start_peer(handlers, port=0, serve_mesh=True):
+    """A pod serving /mesh on 127.0.0.1, returns its mesh, runner and port"""
+    peer_mesh = PeerMesh("127.0.0.1", port, handlers, None)
+    peer_app = web.Application()
+    if serve_mesh:
+        peer_app.router.add_get("/mesh", peer_mesh.handle)
+    runner = web.AppRunner(peer_app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return peer_mesh, runner, site._server.sockets[0].getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_requests_share_one_link():
+    async def pod_id(body):
+        return 200, 42
+
+    async def receive_election(body):
+        return 200, f"OK {body['id']}"
+
+    peer, runner, port = await start_peer(
+        {"/pod_id": pod_id, "/receive_election": receive_election}
+    )
+    async with aiohttp.ClientSession() as session:
+        mesh = PeerMesh("127.0.0.1", port, {}, lambda: session)
+        try:
+            replies = await asyncio.gather(
+                mesh.request("127.0.0.1", "/pod_id"),
+                mesh.request("127.0.0.1", "/receive_election", {"id": 7}),
+                mesh.request("127.0.0.1", "/unknown"),
+            )
+            assert [(r.status, await r.json()) for r in replies] == [
+                (200, 42),
+                (200, "OK 7"),
+                (404, "Not Found"),
+            ]
+            assert mesh.connects == 1
+        finally:
+            await mesh.close()
+            await peer.close()
+            await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_closed_link_fails_pending_requests_and_reports_the_peer():
+    hang = asyncio.Event()
+
+    async def slow(body):
+        await hang.wait()
+        return 200, "late"
+
+    peer, runner, port = await start_peer({"/slow": slow})
+    closed = []
+    async with aiohttp.ClientSession() as session:
+        mesh = PeerMesh("127.0.0.1", port, {}, lambda: session, on_close=closed.append)
+        try:
+            pending = asyncio.create_task(mesh.request("127.0.0.1", "/slow", timeout=5))
+            await asyncio.sleep(0.1)
+            # The peer goes away with the request still unanswered
+            await peer.close()
+            with pytest.raises(aiohttp.ServerDisconnectedError):
+                await asyncio.wait_for(pending, 1)
+            await asyncio.sleep(0.05)
+            assert closed == ["127.0.0.1"]
+            assert "127.0.0.1" not in mesh.links
+        finally:
+            hang.set()
+            await mesh.close()
+            await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_peer_without_mesh_is_left_to_http():
+    peer, runner, port = await start_peer({}, serve_mesh=False)
+    async with aiohttp.ClientSession() as session:
+        mesh = PeerMesh("127.0.0.1", port, {}, lambda: session)
+        try:
+            with pytest.raises(MeshUnavailable):
+                await mesh.request("127.0.0.1", "/pod_id")
+            # No new handshake until the retry period is over
+            with pytest.raises(MeshUnavailable):
+                await mesh.request("127.0.0.1", "/pod_id")
+            assert mesh.connects == 0
+            assert "127.0.0.1" in mesh.http_only
+        finally:
+            await mesh.close()
+            await runner.cleanup()
@@ -0,0 +1,99 @@
+import math
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram(
+        "rt_seconds", "Round trip", buckets=(0.1, 1.0), registry=registry
+    )
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP rt_seconds Round trip", "# TYPE rt_seconds histogram"]
+    assert 'rt_seconds_bucket{le="0.1"} 2' in lines
+    assert 'rt_seconds_bucket{le="1.0"} 3' in lines
+    assert 'rt_seconds_bucket{le="+Inf"} 4' in lines
+    assert "rt_seconds_count 4" in lines
+    assert "rt_seconds_sum 3.65" in lines
+
+
+def test_histogram_buckets_are_preallocated():
+    histogram = Histogram("rt_seconds", "Round trip", buckets=(0.1, 1.0))
+    counts = histogram.children[()].counts
+    histogram.observe(math.inf)
+    assert histogram.children[()].counts is counts
+    assert counts == [0, 0, 1]
+
+
+def test_labels_and_retain():
+    registry = Registry()
+    histogram = Histogram(
+        "probe_seconds", "Probe", ["peer"], buckets=(1.0,), registry=registry
+    )
+    histogram.labels("10.0.0.2").observe(0.5)
+    histogram.labels("10.0.0.3").observe(0.5)
+    histogram.retain({("10.0.0.3",)})
+
+    text = registry.render()
+    assert "10.0.0.2" not in text
+    assert 'probe_seconds_bucket{peer="10.0.0.3",le="1.0"} 1' in text
+    with pytest.raises(ValueError):
+        histogram.labels("10.0.0.3", "extra")
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = Counter("elections", "Elections", ["election_type"], registry=registry)
+    counter.labels("normal").inc()
+    counter.labels("normal").inc()
+    state = {"leader": 7}
+    gauge = Gauge("leader_id", "Leader", registry=registry)
+    gauge.set_function(lambda: state["leader"])
+    state["leader"] = 9
+
+    lines = registry.render().splitlines()
+    assert 'elections_total{election_type="normal"} 2.0' in lines
+    assert "leader_id 9.0" in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    Counter("c", "C", ["name"], registry=registry).labels('a"b\\c').inc()
+    assert 'c_total{name="a\\"b\\\\c"} 1.0' in registry.render()
+
+
+def test_render_adds_snapshots_of_other_processes():
+    """Test counters and histograms of worker snapshots are summed, gauges are not."""
+    import json
+
+    def registry_with(observed, served, leader):
+        registry = Registry()
+        histogram = Histogram(
+            "cookie_seconds", "Cookie", buckets=(0.1,), registry=registry
+        )
+        counter = Counter("routes", "Routes", ["route"], registry=registry)
+        gauge = Gauge("leader_id", "Leader", registry=registry)
+        for value in observed:
+            histogram.observe(value)
+        counter.labels(served).inc()
+        gauge.set(leader)
+        return registry
+
+    agent = registry_with([], "proxy", 60)
+    worker = registry_with([0.05, 0.5], "local", 0)
+    # Snapshots cross a process boundary as JSON
+    snapshot = json.loads(json.dumps(worker.snapshot()))
+
+    lines = agent.render([snapshot, snapshot]).splitlines()
+    assert 'cookie_seconds_bucket{le="0.1"} 2' in lines
+    assert "cookie_seconds_count 4" in lines
+    assert 'routes_total{route="proxy"} 1.0' in lines
+    assert 'routes_total{route="local"} 2.0' in lines
+    assert "leader_id 60.0" in lines
+    # Rendering does not change the agent's own metrics
+    assert "cookie_seconds_count 0" in agent.render().splitlines()
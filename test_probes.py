@@ -0,0 +1,39 @@
+import random
+
+from probes import ProbeSchedule, detection_bounds, probe_period
+
+
+def test_every_peer_is_probed_once_per_pass():
+    schedule = ProbeSchedule(random.Random(1))
+    assert schedule.next() is None
+    assert schedule.update(["a", "b", "c"]) is True
+    assert schedule.update(["c", "b", "a"]) is False
+    first = [schedule.next() for _ in range(3)]
+    second = [schedule.next() for _ in range(3)]
+    assert sorted(first) == sorted(second) == ["a", "b", "c"]
+
+
+def test_schedule_follows_membership():
+    schedule = ProbeSchedule(random.Random(2))
+    schedule.update(["a", "b", "c"])
+    schedule.next()
+    schedule.update(["a", "b", "d"])
+    rest = [schedule.next() for _ in range(len(schedule.order))]
+    assert "c" not in rest
+    assert "d" in rest
+
+
+def test_budget_stretches_the_period():
+    assert probe_period(10, 1.0) == 1.0
+    assert probe_period(10, 1.0, budget=100) == 1.0
+    assert probe_period(1000, 1.0, budget=100) == 10.0
+
+
+def test_expected_detection_does_not_grow_with_the_cluster():
+    assert detection_bounds(1, 1.0, 0.5, 1.0) == (0.0, 0.0)
+    assert detection_bounds(2, 1.0, 0.5, 1.0) == (2.5, 2.5)
+    small, _ = detection_bounds(10, 1.0, 0.5, 1.0)
+    large, worst = detection_bounds(1000, 1.0, 0.5, 1.0)
+    # About e / (e - 1) periods plus the timeouts
+    assert 3.0 < small < large < 3.1
+    assert worst == 1997 + 1.5
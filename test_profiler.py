@@ -0,0 +1,42 @@
+import threading
+import time
+
+from profiler import StallWatchdog, collapsed_text, sample_stacks
+
+
+def busy_wait(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_stacks_finds_the_busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_wait, args=(stop,), name="busy")
+    thread.start()
+    try:
+        counts = sample_stacks(0.2, interval=0.002)
+    finally:
+        stop.set()
+        thread.join()
+
+    busy = {stack: n for stack, n in counts.items() if stack.startswith("busy;")}
+    assert busy
+    assert all("busy_wait (test_profiler.py:" in stack for stack in busy)
+    lines = collapsed_text(counts).splitlines()
+    assert len(lines) == len(counts)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) == max(counts.values())
+
+
+def test_watchdog_logs_the_stalled_thread_once(caplog):
+    watchdog = StallWatchdog(0.05, check_interval=0.01)
+    with caplog.at_level("WARNING", logger="profiler"):
+        watchdog.start()
+        try:
+            # Nothing ticks, as if this thread were the blocked event loop
+            time.sleep(0.2)
+        finally:
+            watchdog.stop()
+
+    assert watchdog.stalls == 1
+    assert "test_watchdog_logs_the_stalled_thread_once" in caplog.text
@@ -0,0 +1,68 @@
+import gzip
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from responses import EncodedAsset, StaticAssets, accepted_encodings
+
+
+def request(**headers):
+    return make_mocked_request("GET", "/", headers=headers)
+
+
+def test_accepted_encodings_follow_q_values():
+    assert accepted_encodings("")[0] == "identity"
+    assert accepted_encodings("gzip, deflate")[0] == "gzip"
+    assert accepted_encodings("gzip;q=0.5, identity")[0] == "identity"
+    assert accepted_encodings("gzip;q=0, identity;q=0") == ()
+    assert "identity" not in accepted_encodings("gzip, *;q=0")
+
+
+def test_asset_is_compressed_once_and_revalidated():
+    body = b"<html>" + b"Hungry you are. " * 100 + b"</html>"
+    asset = EncodedAsset(body, "text/html; charset=utf-8", "no-cache")
+
+    resp = asset.response(request(**{"Accept-Encoding": "gzip, deflate"}))
+    assert resp.status == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(resp.body) == body
+    assert resp.body is asset.bodies["gzip"]
+
+    plain = asset.response(request())
+    assert plain.body == body
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] != resp.headers["ETag"]
+
+    cached = asset.response(request(**{"If-None-Match": resp.headers["ETag"]}))
+    assert cached.status == 304
+    assert cached.body is None
+    assert cached.headers["Cache-Control"] == "no-cache"
+    stale = asset.response(request(**{"If-None-Match": '"other"'}))
+    assert stale.status == 200
+
+
+@pytest.mark.asyncio
+async def test_static_assets_stay_inside_their_directory(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    (static / "yoda.png").write_bytes(b"\x89PNG" + bytes(300))
+    (tmp_path / "secret.txt").write_text("no")
+    assets = StaticAssets(static, "public, max-age=60")
+
+    png = assets.get("yoda.png")
+    assert png.content_type == "image/png"
+    # Images are compressed already
+    assert list(png.bodies) == ["identity"]
+    assert assets.get("yoda.png") is png
+    assert assets.get("../secret.txt") is None
+    # Aliases of a file share its entry instead of adding their own
+    assert assets.get("c/../yoda.png") is png
+    assert list(assets.assets) == ["yoda.png"]
+    with pytest.raises(web.HTTPNotFound):
+        await assets.handle(
+            make_mocked_request(
+                "GET", "/static/missing.png", match_info={"name": "missing.png"}
+            )
+        )
@@ -0,0 +1,45 @@
+import threading
+
+from shared_state import SharedState
+
+
+def test_workers_see_what_the_agent_writes(tmp_path):
+    agent = SharedState.create(str(tmp_path / "state"))
+    worker = SharedState.open(agent.path)
+    try:
+        assert worker.read() == (-1, "", True, False)
+
+        agent.write(60, "10.0.0.2", True, False)
+        view = worker.read()
+        assert view.leader_id == 60
+        assert view.leader_url == "10.0.0.2"
+        # Unchanged block, the decoded view is reused
+        assert worker.read() is view
+
+        agent.write(60, "10.0.0.2", False, True)
+        assert worker.read() == (60, "10.0.0.2", False, True)
+    finally:
+        worker.close()
+        agent.close(unlink=True)
+
+
+def test_reader_waits_out_a_write_in_progress(tmp_path):
+    agent = SharedState.create(str(tmp_path / "state"))
+    worker = SharedState.open(agent.path)
+    # An odd sequence number means the agent is half way through a write
+    seq = int.from_bytes(agent.buffer[:8], "little")
+    agent.buffer[:8] = (seq + 1).to_bytes(8, "little")
+
+    def finish():
+        agent.buffer[:8] = seq.to_bytes(8, "little")
+        agent.write(70, "10.0.0.3", True, False)
+
+    timer = threading.Timer(0.05, finish)
+    timer.start()
+    try:
+        assert worker.read().leader_id == 70
+        assert worker.retries > 0
+    finally:
+        timer.join()
+        worker.close()
+        agent.close(unlink=True)
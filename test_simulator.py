@@ -0,0 +1,42 @@
+import os
+from unittest import mock
+
+import pytest
+
+import simulator
+
+
+@pytest.mark.asyncio
+async def test_kill_leader_elects_next_highest():
+    env = {"WEB_PORT": "18180", "ELECTION_TYPE": "normal", "PEER_KEEPALIVE": "1"}
+    with mock.patch.dict(os.environ):
+        cluster = simulator.Cluster(3, 18180, env, time_scale=0.3)
+    try:
+        result = await simulator.run_scenario(cluster, "kill-leader", timeout=10)
+    finally:
+        await cluster.stop()
+
+    ids = sorted(node.pod_id for node in cluster.nodes)
+    assert result["initial_convergence_s"] is not None
+    assert result["old_leader"] == ids[-1]
+    assert result["new_leaders"] == [ids[-2]]
+    assert result["time_to_new_leader_s"] is not None
+    assert result["messages"]["/receive_coordinator"] >= 1
+    new_leader = next(node for node in cluster.nodes if node.pod_id == ids[-2])
+    assert result["labelled_leaders"] == [new_leader.name]
+
+
+@pytest.mark.asyncio
+async def test_ring_election_elects_next_highest():
+    env = {"WEB_PORT": "18190", "ELECTION_TYPE": "ring", "PEER_KEEPALIVE": "1"}
+    with mock.patch.dict(os.environ):
+        cluster = simulator.Cluster(4, 18190, env, time_scale=0.3)
+    try:
+        result = await simulator.run_scenario(cluster, "kill-leader", timeout=10)
+    finally:
+        await cluster.stop()
+
+    ids = sorted(node.pod_id for node in cluster.nodes)
+    assert result["new_leaders"] == [ids[-2]]
+    assert result["messages"]["/ring_election"] >= 1
+    assert "/receive_election" not in result["messages"]
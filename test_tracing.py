@@ -0,0 +1,50 @@
+import pytest
+
+from trace_merge import merge
+from tracing import Tracer
+
+
+def test_span_records_begin_and_end_with_result():
+    tracer = Tracer(pid=7, process_name="pod 7")
+    with tracer.span("election_message", to=9) as result:
+        result["status"] = 200
+    begin, end = tracer.events
+    assert (begin["ph"], end["ph"]) == ("b", "e")
+    assert begin["id"] == end["id"]
+    assert begin["args"] == {"to": 9}
+    assert end["args"] == {"status": 200}
+    assert begin["ts"] <= end["ts"]
+
+
+def test_span_records_errors():
+    tracer = Tracer()
+    with pytest.raises(TimeoutError):
+        with tracer.span("coordinator"):
+            raise TimeoutError()
+    assert tracer.events[-1]["args"] == {"error": "TimeoutError()"}
+
+
+def test_ring_buffer_keeps_the_newest_events():
+    tracer = Tracer(capacity=3)
+    for n in range(5):
+        tracer.instant("leader_changed", leader=n)
+    assert [event["args"]["leader"] for event in tracer.events] == [2, 3, 4]
+
+    off = Tracer(capacity=0)
+    off.instant("leader_changed")
+    with off.span("election") as result:
+        result["term"] = 1
+    assert len(off.events) == 0
+
+
+def test_merge_sorts_events_of_all_pods():
+    first, second = Tracer(pid=1), Tracer(pid=2)
+    first.instant("leader_suspected")
+    second.instant("receive_election")
+    first.instant("leader_changed")
+    trace = merge([first.dump(), second.dump()])
+    events = trace["traceEvents"]
+    assert [event["ph"] for event in events[:2]] == ["M", "M"]
+    timestamps = [event["ts"] for event in events[2:]]
+    assert timestamps == sorted(timestamps)
+    assert {event["pid"] for event in events} == {1, 2}
@@ -0,0 +1,88 @@
+"""
+Merge the /debug/trace dumps of several pods into one Chrome/Perfetto trace.
+
+Sources are URLs of /debug/trace or files saved from it. For URLs the pod's
+clock offset is estimated from the request's round trip, like NTP does, and
+its events are shifted onto this machine's clock. Files are taken as they are.
+Open the result in https://ui.perfetto.dev or chrome://tracing.
+
+    python trace_merge.py http://10.0.0.5:8080/debug/trace pod-b.json -o trace.json
+    python trace_merge.py --service bully-service --port 8080 -o trace.json
+"""
+
+import argparse
+import json
+import socket
+import urllib.request
+
+from tracing import now_us
+
+
+def fetch(url, timeout):
+    """The dump of one pod, with its events moved onto the local clock"""
+    sent = now_us()
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        dump = json.load(resp)
+    received = now_us()
+    # The pod read its clock about halfway through the round trip
+    offset = dump.get("otherData", {}).get("now_us", received) - (sent + received) // 2
+    for event in dump["traceEvents"]:
+        if "ts" in event:
+            event["ts"] -= offset
+    dump.setdefault("otherData", {})["clock_offset_us"] = offset
+    return dump
+
+
+def merge(dumps):
+    metadata, events = [], []
+    for dump in dumps:
+        for event in dump["traceEvents"]:
+            (metadata if event.get("ph") == "M" else events).append(event)
+    events.sort(key=lambda event: event["ts"])
+    offsets = {
+        str(dump.get("otherData", {}).get("pid")): dump["otherData"].get(
+            "clock_offset_us"
+        )
+        for dump in dumps
+        if "otherData" in dump
+    }
+    return {
+        "traceEvents": metadata + events,
+        "displayTimeUnit": "ms",
+        "otherData": {"clock_offset_us": offsets},
+    }
+
+
+def service_urls(service, port):
+    addresses = {info[4][0] for info in socket.getaddrinfo(service, port)}
+    return [f"http://{address}:{port}/debug/trace" for address in sorted(addresses)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("sources", nargs="*", help="/debug/trace URLs or dump files")
+    parser.add_argument("--service", help="fetch from every address of this service")
+    parser.add_argument("--port", type=int, default=8080, help="CONTROL_PORT")
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("-o", "--output", default="trace.json")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.service:
+        sources += service_urls(args.service, args.port)
+    dumps = []
+    for source in sources:
+        if source.startswith(("http://", "https://")):
+            dumps.append(fetch(source, args.timeout))
+        else:
+            with open(source) as f:
+                dumps.append(json.load(f))
+
+    trace = merge(dumps)
+    with open(args.output, "w") as f:
+        json.dump(trace, f)
+    print(f"{len(trace['traceEvents'])} events from {len(dumps)} pods in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
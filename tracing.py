@@ -0,0 +1,81 @@
+"""
+In-memory election trace in Chrome trace event format.
+
+A Tracer keeps the last `capacity` events in a ring buffer. Spans are recorded
+as a begin and an end event of the async kind ("b"/"e"), which may overlap on
+one pod, e.g. the election messages sent to several peers at once. Timestamps
+are wall clock microseconds, so the dumps of all pods can be put on one
+timeline; trace_merge.py does that and corrects for clock offsets.
+
+The dump is a valid trace on its own and loads in Perfetto or chrome://tracing.
+"""
+
+import collections
+import contextlib
+import itertools
+import time
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+class Tracer:
+    def __init__(self, capacity=4096, pid=0, process_name=""):
+        self.events = collections.deque(maxlen=capacity)
+        self.enabled = capacity > 0
+        self.pid = pid
+        self.process_name = process_name
+        self._ids = itertools.count(1)
+
+    def instant(self, name, **args):
+        if self.enabled:
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "i",
+                    "s": "p",
+                    "ts": now_us(),
+                    "pid": self.pid,
+                    "tid": 0,
+                    "args": args,
+                }
+            )
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """
+        Record the time spent in the block. The yielded dict ends up in the end
+        event's args, for results known only then (e.g. a reply's status)
+        """
+        result = {}
+        if not self.enabled:
+            yield result
+            return
+        span_id = f"{self.pid}-{next(self._ids)}"
+        event = {"name": name, "cat": "election", "id": span_id, "pid": self.pid}
+        self.events.append({**event, "ph": "b", "ts": now_us(), "tid": 0, "args": args})
+        try:
+            yield result
+        except BaseException as e:
+            result.setdefault("error", repr(e))
+            raise
+        finally:
+            self.events.append(
+                {**event, "ph": "e", "ts": now_us(), "tid": 0, "args": result}
+            )
+
+    def dump(self):
+        """The buffered events in Chrome trace format, with this pod's clock"""
+        metadata = {
+            "name": "process_name",
+            "ph": "M",
+            "pid": self.pid,
+            "tid": 0,
+            "args": {"name": self.process_name or str(self.pid)},
+        }
+        return {
+            "traceEvents": [metadata, *self.events],
+            "displayTimeUnit": "ms",
+            "otherData": {"pid": self.pid, "now_us": now_us()},
+        }